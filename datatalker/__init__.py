@@ -1,7 +1,16 @@
 import dspy
 import inspect
-from typing import Callable
-from datatalker.resources import get_relevant_resources
+import threading
+from typing import TYPE_CHECKING, Callable
+from datatalker.resources import get_relevant_resources, search_multi_hop, warmup
+from datatalker.renderer import ResourceRenderer as md_renderer
+from datatalker.types import ResponseType
+from datatalker.config import OGD_API_KEY
+# the data engine, planner and record cache pull in pandas and pyarrow,
+# they are imported by the handlers that use them
+if TYPE_CHECKING:
+    from datatalker.engine import DataEngine
+    from datatalker.ogdp import OGDProxy
 
 
 # chat handler
@@ -39,14 +48,44 @@ def chat(message: str, history: list[dict], hint: str = "", log=print) -> str:
 
 
 # resource handler
-def retrieve(message: str, history: list[dict], log=print):
+NO_DATASETS_FOUND_MSG = "I couldn't find any datasets for that. Could you rephrase or be more specific?"
+# opt-in multi-hop search: sub-queries per request, seconds to spend
+# searching, and the number of datasets after which to stop early
+MULTI_HOP_OPTIONS = dict(max_hops=3, time_budget=90, enough=5)
+
+class DecomposeRequest(dspy.Signature):
+    """Break a data request down into independent dataset search queries"""
+
+    message: str = dspy.InputField(desc="current message from the user")
+    history: list[dict] = dspy.InputField()
+    max_queries: int = dspy.InputField(desc="maximum number of search queries")
+    search_queries: list[str] = dspy.OutputField(
+        desc="short search queries, each covering one aspect of the request"
+    )
+
+
+def retrieve(
+    message: str,
+    history: list[dict],
+    log=print,
+    max_hops: int = 1,
+    time_budget: float | None = None,
+    enough: int | None = None,
+):
     """
     Find relevant datasets based on a user query. Useful for locating
     data sources to support a user's question or analysis task.
     """
     
-    if len(history) == 0:
-        resources = get_relevant_resources(message, log=log)
+    if max_hops > 1:
+        # search each aspect of a complex request as its own hop
+        query_decomposer = dspy.ChainOfThought(DecomposeRequest)
+        prediction = query_decomposer(message=message, history=history, max_queries=max_hops)
+        print("retrieve.decompose_request.reasoning:", prediction.reasoning)
+        queries = prediction.search_queries[:max_hops] or [message]
+        resources = search_multi_hop(queries, time_budget=time_budget, enough=enough)
+    elif len(history) == 0:
+        resources = get_relevant_resources(message)
     else:    
         # craft a refined search query
         FormulateQuery = dspy.Signature(
@@ -56,27 +95,50 @@ def retrieve(message: str, history: list[dict], log=print):
         query_generator = dspy.ChainOfThought(FormulateQuery)
         prediction = query_generator(message=message, history=history)
         print("retrieve.generate_query.reasoning:", prediction.reasoning)
-        resources = get_relevant_resources(prediction.search_query, log=log)
+        resources = get_relevant_resources(prediction.search_query)
 
-    
-    doc = next(resources, None)
+    # thoughts only narrate the search, render the resources
+    docs = (
+        msg.content
+        for msg in resources
+        if msg.type == ResponseType.OBJECT
+    )
+    doc = next(docs, None)
     if doc is None:
         print("retriever: No relevant resources found.")
-        return NO_DATASETS_FOUND_MSG, None
+        yield NO_DATASETS_FOUND_MSG, None
+        return
 
     while doc is not None:
         markdown = md_renderer(json=doc)
         yield markdown, doc
-        doc = next(resources, None)
+        doc = next(docs, None)
 
 # data query handler
+FETCH_LIMIT = 1000 # records of a catalog loaded for analysis, resources are downloaded whole
+
+_OGD = None
+_LOCK = threading.Lock()
+
+
+def get_ogd() -> "OGDProxy":
+    """OGD proxy with a record cache, created on first use"""
+    global _OGD
+    with _LOCK:
+        if _OGD is None:
+            from datatalker.ogdp import OGDProxy
+            from datatalker.record_cache import RecordCache
+            _OGD = OGDProxy(api_key=OGD_API_KEY, record_cache=RecordCache())
+    return _OGD
+
+
 class ChooseDataset(dspy.Signature):
     datasets = dspy.InputField(desc="list of datasets to choose from")
     user_message = dspy.InputField(desc="user message")
     conversation_history = dspy.InputField()
     id_of_selected_dataset: str = dspy.OutputField(desc="Id of the selected dataset")
 
-def fetch_data(message: str, history: list[dict], resources: dict = None):
+def fetch_data(message: str, history: list[dict], resources: dict = None, data: "DataEngine" = None):
     """
     Downloads or pulls data associated for datasets. Use this
     to actually fetch the underlying data for analysis or processing. It
@@ -91,18 +153,57 @@ def fetch_data(message: str, history: list[dict], resources: dict = None):
     )
     print("fetch_data.dataset_selector.reasoning", prediction.reasoning)
     rsrc = resources[prediction.id_of_selected_dataset]
-    msg = next(chat(message=message, history=[], hint=f"inform the user that the system has selected {rsrc}."))
+    hint = f"inform the user that the system has selected {rsrc}."
+    if data is not None:
+        # the records are registered under the dataset's uuid for visualize()
+        metadata = rsrc["metadatas"]
+        if metadata["interface"] == "ogd:resource":
+            data.register_resource(get_ogd(), metadata["uuid"], progress=False)
+        else:
+            # catalogs can't be downloaded in bulk, only a sample is loaded
+            response = get_ogd().get_records(metadata["uuid"], metadata["interface"], limit=FETCH_LIMIT)
+            records = response.get("records") or []
+            data.register(metadata["uuid"], records)
+            total = int(response.get("total") or len(records))
+            if total > len(records):
+                hint += (
+                    f" Tell them that only a sample of {len(records)} of its {total} records"
+                    " was loaded, so answers computed from it are not over the whole dataset."
+                )
+    msg = chat(message=message, history=[], hint=hint)
     yield msg
 
 # visualization handler
-def visualize(message: str, history: list[dict], data = None):
+NO_DATA_LOADED_MSG = "There is no data to work with yet. Let's fetch a dataset first."
+
+def visualize(message: str, history: list[dict], data: "DataEngine" = None):
     """
     Generates visual representations of data (e.g., charts, graphs, tables)
     Use this tool to create plots or diagrams from structured data. It's helpful
     in exploring patterns, communicating insights, or support decision-making with
     clear visual evidence.
     """
-    return "You've reached the cutting edge! This portion is still under construction 😅."
+    # only tables for now: the planned query's result is rendered as markdown
+    if data is None or not data.tables:
+        return NO_DATA_LOADED_MSG
+    from datatalker.engine import to_markdown
+    from datatalker.query import DataRequest
+
+    class PlanDataRequest(dspy.Signature):
+        """Plan a query answering the user's message over the loaded datasets"""
+
+        message: str = dspy.InputField(desc="current message from the user")
+        history: list[dict] = dspy.InputField()
+        datasets: list[dict] = dspy.InputField(desc="loaded datasets, by name, with their columns")
+        request: DataRequest = dspy.OutputField(
+            desc="query over one dataset, its dataset_id is the dataset name and its interface is local"
+        )
+
+    planner = dspy.ChainOfThought(PlanDataRequest)
+    prediction = planner(message=message, history=history, datasets=data.describe())
+    print("visualize.plan_data_request.reasoning:", prediction.reasoning)
+    request = prediction.request.model_copy(update=dict(interface="local"))
+    return to_markdown(data.query(request))
 
 
 # handle handlers
@@ -114,11 +215,31 @@ class ChooseHandler(dspy.Signature):
 
 
 class DataTalker:
-    def __init__(self):
+    def __init__(self, retrieval_options: dict | None = None):
+        """
+        Parameters
+        ----------
+        retrieval_options : dict, optional
+            Keyword arguments of `retrieve`, e.g. MULTI_HOP_OPTIONS to split
+            requests into several searches. Defaults to a single search.
+        """
         self.HANDLERS = dict()
         self.handler_docs: list[dict] = list()
         self.resources = dict()
-        self.dataframes: list = list()
+        self._engine = None
+        self.retrieval_options = retrieval_options or dict()
+
+    @property
+    def engine(self) -> "DataEngine":
+        """Fetched datasets, queried in place, the engine is created on first use"""
+        if self._engine is None:
+            from datatalker.engine import DataEngine
+            self._engine = DataEngine()
+        return self._engine
+
+    @property
+    def dataframes(self) -> dict:
+        return self.engine.tables
 
     def add_handler(self, name: str, func: Callable):
         self.HANDLERS[name] = func
@@ -127,6 +248,10 @@ class DataTalker:
             usage=inspect.getdoc(func)
         ))
 
+    def load_dataset(self, name: str, data):
+        """Make fetched data (records, a data frame, a Parquet directory) available for analysis"""
+        return self.engine.register(name, data)
+
     def choose_handler(self, message: str, history: list) -> str:
         classifier = dspy.ChainOfThought(ChooseHandler \
             .with_instructions("The selected handler must be from the provided list of handlers.")
@@ -146,22 +271,27 @@ class DataTalker:
             if chunk is None:
                 break
             text, doc = chunk
-            # TODO: Multi-Hop Search
+            if doc is None:
+                # nothing found, the message asks the user to rephrase
+                yield text
+                return
             self.resources[doc['id']] = doc
             texts.append(text)
             yield text
-        yield chat(messge="", history=texts, hint="The system fetched datasets for the user query. Write a short follow up message.")
+        yield chat(message="", history=texts, hint="The system fetched datasets for the user query. Write a short follow up message.")
     
     def handle(self, message: str, history: list[dict]):
         handler_name = self.choose_handler(message, history)
         handler = self.HANDLERS[handler_name]
         if handler_name == "retrieve_datasets":
             # tried_again = False
-            response = handler(message, history)
-            return self.handle_retrieval(response)
+            response = handler(message, history, **self.retrieval_options)
+            yield from self.handle_retrieval(response)
         elif handler_name == "fetch_data":
-            response = handler(message, history, self.resources)
-            yield response
+            response = handler(message, history, self.resources, self.engine)
+            yield from response
+        elif handler_name == "visualize_data":
+            yield handler(message, history, self.engine)
         else:
             yield "You seemed to have reached the cutting edge! I tripped over."
 
@@ -14,9 +14,12 @@ from pydantic import BaseModel
 from dataclasses import dataclass
 import asyncio
 import uuid
-from datatalker.config import MODEL
-from datatalker.resources import get_relevant_resources
+from datatalker.config import MODEL, OGD_API_KEY
+from datatalker.resources import get_relevant_resources, get_relevant_resources_many
 from datatalker.ogdp import OGDProxy
+from datatalker.record_cache import RecordCache
+from datatalker.query import DataRequest, QueryPlanner, partial_note
+from datatalker.engine import DataEngine, to_markdown
 
 @function_tool
 def get_datasets(query: str) -> list[dict]:
@@ -32,6 +35,20 @@ def get_datasets(query: str) -> list[dict]:
 
     return list(get_relevant_resources(query))
 
+@function_tool
+def get_datasets_for_queries(queries: list[str]) -> list[list[dict]]:
+    """
+    Gets the datasets relevant to each of several search queries at once.
+    Prefer this over repeated calls to get_datasets when a request needs
+    more than one search, the queries are searched and judged as a batch.
+    Args:
+        queries (list[str]): The search queries
+    Returns:
+        list[list[dict]]: For each query, a list of relevant datasets
+    """
+
+    return get_relevant_resources_many(queries)
+
 retriever = Agent(
     name="Dataset Retriever",
     instructions=(
@@ -39,14 +56,33 @@ retriever = Agent(
         "Useful for locating dataset to support data analysis"
         "or answering user queries"
     ),
-    tools=[get_datasets],
+    tools=[get_datasets, get_datasets_for_queries],
     model=MODEL,
     
 )
 
-@function_tool
-def build_visualization(dataframe, instruction: str):
-    raise NotImplementedError()
+@dataclass
+class ConversationContext:
+    resources: list[dict]
+    dataframes: DataEngine # fetched datasets, by name
+
+
+# state shared by the agents' tools over a conversation
+conversation = ConversationContext(resources=list(), dataframes=DataEngine())
+
+
+@function_tool(strict_mode=False)
+def build_visualization(context: RunContextWrapper[ConversationContext], request: DataRequest) -> str:
+    """Builds a table from a fetched dataset, filtered, grouped and aggregated as requested.
+    Charts aren't supported yet, the table is the visualization.
+    Args:
+        request (DataRequest): Query over one fetched dataset, its dataset_id is the
+            dataset name and its interface is "local".
+    Returns:
+        The resulting rows as a markdown table
+    """
+    engine = context.context.dataframes
+    return to_markdown(engine.query(request.model_copy(update=dict(interface="local"))))
 
 dataviz = Agent(
     name="Data Visualzation Expert",
@@ -60,12 +96,6 @@ dataviz = Agent(
 )
 
 
-@dataclass
-class ConversationContext:
-    resources: list[dict]
-    dataframes: list # pd.DataFrame (maybe)
-
-
 ResourceType = Literal["ogd:resource", "ogd:catalog"]
 class SelectedDataset(BaseModel):
     dataset_id: str
@@ -79,7 +109,7 @@ dataset_selector = Agent[ConversationContext](
 )
 
 
-ogd = OGDProxy(api_key="579b464db66ec23bdd000001edd87d62b40343d54d7f4653d5d391a7")
+ogd = OGDProxy(api_key=OGD_API_KEY, record_cache=RecordCache())
 # @function_tool
 def fetch_data(uuid: str, interface: ResourceType, filter_params: dict[str, str]):
     """Fetches records from a dataset based on specified filters.
@@ -95,7 +125,25 @@ def fetch_data(uuid: str, interface: ResourceType, filter_params: dict[str, str]
     Returns:
         The filtered dataset records (format depends on implementation)
     """
-    return ogd.catalog(uuid, limit=100, params=filter_params).json()
+    response = ogd.get_records(uuid, interface, limit=100, params=filter_params)
+    # registered under the uuid, so build_visualization can query them
+    conversation.dataframes.register(uuid, response.get("records") or [])
+    return response
+
+
+planner = QueryPlanner(ogd=ogd, engine=conversation.dataframes)
+# @function_tool
+def query_data(request: DataRequest) -> dict:
+    """Filters and aggregates a dataset, the work is done by the data source when it can.
+    Only OGD ("ogd:resource", "ogd:catalog") and fetched ("local") datasets are supported.
+    Args:
+        request (DataRequest): The dataset, filters, group by fields, aggregates and limit.
+    Returns:
+        The resulting rows under "records", e.g. one per group with its aggregates,
+        and a "note" to pass on to the user when they cover only part of the data
+    """
+    result = planner.run(request)
+    return dict(records=result.to_dict(orient="records"), note=partial_note(result))
 
 
 data_fetcher = Agent(
@@ -104,7 +152,7 @@ data_fetcher = Agent(
         "Fetches the underlying dataset for a specific resource"
     ),
     model=MODEL,
-    # tools=[fetch_data],
+    # tools=[fetch_data, query_data],
 )
 
 
@@ -144,6 +192,7 @@ async def main():
         result = Runner.run_streamed(
             agent,
             input=inputs,
+            context=conversation,
             run_config=RunConfig(model=MODEL)
         )
         async for event in result.stream_events():
@@ -1,44 +1,143 @@
-import requests
-from typing import Dict, List, Any
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
+from typing import Dict, List, Any, Callable, Iterable, Iterator, Mapping, Tuple
+from datatalker.http_client import HTTPClient
+from datatalker.throttle import AdaptiveTokenBucket
 
 
 class CKANProxy:
     """Class to load data from a CKAN instance"""
-    
-    def __init__(self, ckan_url: str, headers: Dict[str, str] = None):
+
+    def __init__(
+        self,
+        ckan_url: str,
+        headers: Dict[str, str] = None,
+        max_workers: int = 8,
+        requests_per_second: float | None = 10,
+        timeout: float | tuple[float, float] = (10, 30),
+        client: HTTPClient | None = None,
+    ):
+        """
+        Parameters
+        ----------
+        ckan_url : str
+            Base URL of the CKAN instance.
+        headers : dict, optional
+            Headers sent with every request.
+        max_workers : int, optional
+            Number of concurrent requests made by the iter_* methods, also the
+            size of the connection pool.
+        requests_per_second : float, optional
+            Rate limit for requests to the CKAN host, None disables it. The
+            rate is lowered while the server throttles us (429/5xx).
+        timeout : float | (float, float), optional
+            Seconds to wait for the server, or (connect, read) timeouts.
+        client : HTTPClient, optional
+            Client to share with other proxies, replaces the options above.
+        """
         self.ckan_url = ckan_url.rstrip('/')
-        self.headers = headers or {
-            "Content-Type": "application/json",
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3",
-        }
-        
-    def _make_request(self, endpoint: str, params: Dict[str, Any] = None) -> Dict[str, Any]:
+        self.max_workers = max_workers
+        self.client = client or HTTPClient(
+            headers=headers or {
+                "Content-Type": "application/json",
+                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3",
+            },
+            max_connections=max_workers,
+            timeout=timeout,
+            rate_limiter=(
+                AdaptiveTokenBucket(requests_per_second) if requests_per_second else None
+            ),
+        )
+
+    def _make_request(self, endpoint: str, params: Mapping[str, Any] | None = None) -> Dict[str, Any]:
         """Make a request to the CKAN API"""
         url = f"{self.ckan_url}/api/3/action/{endpoint}"
-        response = requests.get(url, params=params, headers=self.headers)
-        response.raise_for_status()
-        return response.json()
-    
+        return self.client.get(url, params).json()
+
     def get_package_list(self) -> List[str]:
         """Get list of all package IDs"""
         result = self._make_request("package_list")
         return result["result"]
-    
+
     def get_package(self, package_id: str) -> Dict[str, Any]:
         """Get package details by ID"""
         result = self._make_request("package_show", {"id": package_id})
         return result["result"]
-    
+
     def get_resource(self, resource_id: str) -> Dict[str, Any]:
         """Get resource details by ID"""
         result = self._make_request("resource_show", {"id": resource_id})
         return result["result"]
-    
+
     def get_datastore_info(self, resource_id: str) -> Dict[str, Any]:
         result = self._make_request("datastore_info", {"id": resource_id})
         return result["result"]
-    
+
     def datastore_search_sql(self, sql: str) -> Dict[str, Any]:
         """Execute SQL query on datastore"""
         result = self._make_request("datastore_search_sql", {"sql": sql})
-        return result["result"]
\ No newline at end of file
+        return result["result"]
+
+    def datastore_search(self, resource_id: str, params: Mapping[str, Any] | None = None) -> Dict[str, Any]:
+        """Fetch datastore records, params are passed as is (filters, fields, limit, offset...)"""
+        result = self._make_request("datastore_search", {**(params or {}), "resource_id": resource_id})
+        return result["result"]
+
+    def search_packages(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Search packages, returns the result's count and a page of results"""
+        result = self._make_request("package_search", params)
+        return result["result"]
+
+    def iter_modified_packages(self, since: str | None = None, rows: int = 1000) -> Iterator[Dict[str, Any]]:
+        """Packages modified at or after `since` (CKAN metadata_modified), oldest first"""
+        # solr wants UTC timestamps with a Z suffix and at most millisecond precision
+        start = f"{since[:19]}Z" if since else "*"
+        offset = 0
+        while True:
+            page = self.search_packages({
+                "q": "*:*",
+                "fq": f"metadata_modified:[{start} TO *]",
+                "sort": "metadata_modified asc",
+                "rows": rows,
+                "start": offset,
+            })
+            yield from page["results"]
+            offset += len(page["results"])
+            if not page["results"] or offset >= page["count"]:
+                break
+
+    def iter_concurrently(
+        self, method: Callable[[str], Any], ids: Iterable[str]
+    ) -> Iterator[Tuple[str, Any, Exception | None]]:
+        """
+        Call a single-id method for many ids concurrently.
+        Yields (id, result, error) as the calls complete, error is None on success.
+        At most `max_workers` calls are in flight, so ids are read lazily and
+        a caller that stops early leaves no queued calls behind.
+        """
+        ids = iter(ids)
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            pending = {executor.submit(method, id_): id_ for id_ in islice(ids, self.max_workers)}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    id_ = pending.pop(future)
+                    for next_id in islice(ids, 1):
+                        pending[executor.submit(method, next_id)] = next_id
+                    try:
+                        result, error = future.result(), None
+                    except Exception as e:
+                        result, error = None, e
+                    yield id_, result, error
+        finally:
+            # calls still running when the caller stops are not waited for
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def iter_packages(self, package_ids: Iterable[str]):
+        """Fetch packages concurrently, yields (package_id, package, error)"""
+        return self.iter_concurrently(self.get_package, package_ids)
+
+    def iter_datastore_info(self, resource_ids: Iterable[str]):
+        """Fetch datastore info concurrently, yields (resource_id, info, error)"""
+        return self.iter_concurrently(self.get_datastore_info, resource_ids)
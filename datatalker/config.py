@@ -4,4 +4,31 @@ from pathlib import Path
 CHROMADB_DIR = os.environ.get(
     "CHROMADB_DIR",
     (Path(__file__).parents[1] / ".vectorstore").as_posix() # default
-)
\ No newline at end of file
+)
+
+# "chroma" or "flat", the memory-mapped index built by scripts/build_flat_index.py
+RETRIEVER_BACKEND = os.environ.get("RETRIEVER_BACKEND", "chroma")
+
+# key of the Open Government Data platform API, defaults to its public sample key
+OGD_API_KEY = os.environ.get("OGD_API_KEY", "579b464db66ec23bdd000001edd87d62b40343d54d7f4653d5d391a7")
+
+CACHE_DIR = os.environ.get(
+    "CACHE_DIR",
+    (Path(__file__).parents[1] / ".cache").as_posix() # default
+)
+
+# judged relevance verdicts, used to calibrate similarity gating, are only
+# logged when LOG_VERDICTS is set to 1
+LOG_VERDICTS = os.environ.get("LOG_VERDICTS", "0") == "1"
+VERDICT_LOG = os.environ.get(
+    "VERDICT_LOG",
+    (Path(CACHE_DIR) / "relevance_verdicts.jsonl").as_posix() # default
+)
+GATING_THRESHOLDS = os.environ.get(
+    "GATING_THRESHOLDS",
+    (Path(CACHE_DIR) / "gating_thresholds.json").as_posix() # default
+)
+
+# model served by every endpoint of the LM pool, and the comma separated endpoints
+LM_MODEL = os.environ.get("LM_MODEL", "ollama_chat/gemma3")
+LM_ENDPOINTS = os.environ.get("LM_ENDPOINTS", "http://localhost:11434")
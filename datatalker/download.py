@@ -0,0 +1,235 @@
+"""
+Bulk downloads of whole OGD resources into Parquet.
+
+Pages are fetched concurrently through the proxy's rate limited client and
+converted to typed Arrow columns as they arrive, using the resource's `field`
+metadata. They are written in order into part files of a Parquet dataset
+directory, so only the pages in flight are ever held in memory. Progress is
+kept next to the parts, so an interrupted download picks up from the last
+finished part.
+"""
+import csv
+import io
+import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from pathlib import Path
+from typing import Any, Literal, Mapping
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+from tqdm import tqdm
+
+from datatalker.ogdp import OGDProxy
+from datatalker.record_cache import records_to_table
+
+
+# OGD field types and the Arrow types they are stored as, anything else is a string.
+# Fields typed integer sometimes hold decimals and dates come in several
+# formats, so numbers are all stored as doubles and dates as strings.
+FIELD_TYPES = {
+    "double": pa.float64(),
+    "float": pa.float64(),
+    "integer": pa.float64(),
+    "long": pa.float64(),
+}
+NUMBER_PATTERN = r"^\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?\s*$"
+PROGRESS_FILE = "_progress.json"
+
+
+def resource_schema(fields: list[dict[str, Any]]) -> pa.Schema:
+    """Arrow schema of a resource from its `field` metadata, columns are named by field id"""
+    return pa.schema([
+        pa.field(
+            field["id"],
+            FIELD_TYPES.get(field.get("type"), pa.string()),
+            metadata={"name": field.get("name", field["id"]), "type": field.get("type", "")},
+        )
+        for field in fields
+    ])
+
+
+def to_typed_column(values: pa.Array, type: pa.DataType) -> pa.Array:
+    """Cast a string column, values that aren't numbers (e.g. "NA") become nulls"""
+    values = pc.cast(values, pa.string())
+    if type == pa.string():
+        return values
+    values = pc.replace_substring(values, ",", "")
+    numbers = pc.if_else(pc.match_substring_regex(values, NUMBER_PATTERN), values, None)
+    return pc.cast(numbers, type)
+
+
+def to_typed_table(table: pa.Table, schema: pa.Schema) -> pa.Table:
+    """Conform a page to the resource schema, adding missing columns as nulls"""
+    columns = list()
+    for field in schema:
+        if field.name in table.column_names:
+            columns.append(to_typed_column(table[field.name].combine_chunks(), field.type))
+        else:
+            columns.append(pa.nulls(len(table), field.type))
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+def csv_column_ids(header: list[str], schema: pa.Schema) -> list[str]:
+    """Field ids of the columns of a CSV page, whose header may use field names"""
+    ids = [field.name for field in schema]
+    by_name = {field.metadata[b"name"].decode(): field.name for field in schema}
+    if all(name in ids or name in by_name for name in header):
+        return [name if name in ids else by_name[name] for name in header]
+    # otherwise the columns follow the field order
+    return ids if len(header) == len(ids) else header
+
+
+class ResourceDownloader:
+    """Download a whole OGD resource into a Parquet dataset directory"""
+
+    def __init__(
+        self,
+        ogd: OGDProxy,
+        page_size: int = 1000,
+        pages_per_part: int = 50,
+        format: Literal["json", "csv"] = "csv",
+        progress: bool = True,
+    ):
+        """
+        Parameters
+        ----------
+        ogd : OGDProxy
+            Proxy whose client (and rate limit) the page requests go through.
+        page_size : int, optional
+            Records requested per page.
+        pages_per_part : int, optional
+            Pages written to each Parquet part file, a part is the unit of resumption.
+        format : "json" | "csv", optional
+            Format requested from the API, csv bodies are smaller.
+        progress : bool, optional
+            Show a progress bar of the downloaded records.
+        """
+        self.ogd = ogd
+        self.page_size = page_size
+        self.pages_per_part = pages_per_part
+        self.format = format
+        self.progress = progress
+
+    def fetch_page(
+        self, uuid: str, offset: int, rows: int, params: Mapping[str, Any] | None, schema: pa.Schema
+    ) -> pa.Table:
+        """
+        The `rows` records from `offset`. A short page is completed by requesting
+        the rest from where it stopped, a request bringing nothing fails the download.
+        """
+        tables = list()
+        while rows > 0:
+            table = self.request_page(uuid, offset, rows, params, schema)
+            if table.num_rows == 0:
+                raise RuntimeError(f"No records of {uuid} from offset {offset}, {rows} were expected")
+            tables.append(table.slice(0, rows))
+            offset += table.num_rows
+            rows -= table.num_rows
+        return pa.concat_tables(tables) if tables else schema.empty_table()
+
+    def request_page(
+        self, uuid: str, offset: int, limit: int, params: Mapping[str, Any] | None, schema: pa.Schema
+    ) -> pa.Table:
+        response = self.ogd.resource(uuid, offset, limit, self.format, params)
+        if self.format == "json":
+            return to_typed_table(records_to_table(response.json()["records"]), schema)
+        # only a page is held in memory, read every column as a string to cast afterwards
+        body = io.BytesIO(response.content)
+        header = next(csv.reader([body.readline().decode("utf-8-sig")]), [])
+        if not header:
+            return schema.empty_table()
+        table = pacsv.read_csv(
+            body,
+            read_options=pacsv.ReadOptions(column_names=header),
+            convert_options=pacsv.ConvertOptions(
+                column_types={name: pa.string() for name in header},
+                strings_can_be_null=True,
+            ),
+        )
+        return to_typed_table(table.rename_columns(csv_column_ids(header, schema)), schema)
+
+    def download(
+        self,
+        uuid: str,
+        path: str | Path,
+        params: Mapping[str, Any] | None = None,
+        resume: bool = True,
+    ) -> Path:
+        """
+        Download every record of a resource into `path`, a directory of
+        Parquet parts readable with pyarrow.dataset or pandas.read_parquet.
+        """
+        path = Path(path)
+        meta = self.ogd.resource(uuid, 0, 1, "json", params).json()
+        total = int(meta.get("total", 0))
+        fields = meta.get("field") or [{"id": key} for key in (meta.get("records") or [{}])[0]]
+        schema = resource_schema(fields)
+        settings = dict(
+            uuid=uuid, params=dict(params or {}), format=self.format,
+            page_size=self.page_size, pages_per_part=self.pages_per_part,
+        )
+
+        progress_path = path / PROGRESS_FILE
+        state = json.loads(progress_path.read_text()) if progress_path.exists() else None
+        if not resume or state is None or state["settings"] != settings or state["total"] != total:
+            # start over, only removing files of an earlier download
+            for part_path in [*path.glob("part-*.parquet"), *path.glob("_part-*.tmp")]:
+                part_path.unlink()
+            state = dict(settings=settings, total=total, done_parts=list())
+        path.mkdir(parents=True, exist_ok=True)
+
+        part_rows = self.page_size * self.pages_per_part
+        n_parts = -(-total // part_rows)
+        parts = [part for part in range(n_parts) if part not in set(state["done_parts"])]
+        done_rows = sum(min(part_rows, total - part * part_rows) for part in state["done_parts"])
+        bar = tqdm(total=total, initial=done_rows, unit="rows", desc=uuid, disable=not self.progress)
+
+        offsets = (
+            (part, offset)
+            for part in parts
+            for offset in range(part * part_rows, min((part + 1) * part_rows, total), self.page_size)
+        )
+        writers: dict[int, pq.ParquetWriter] = dict()
+        try:
+            with ThreadPoolExecutor(max_workers=self.ogd.max_workers) as executor:
+                # fetch a few pages ahead, write them in order
+                submit = lambda part, offset: (
+                    part, offset, executor.submit(
+                        self.fetch_page, uuid, offset, min(self.page_size, total - offset), params, schema
+                    )
+                )
+                pending = deque(submit(*item) for item in islice(offsets, self.ogd.max_workers))
+                while pending:
+                    part, offset, future = pending.popleft()
+                    table = future.result()
+                    for item in islice(offsets, 1):
+                        pending.append(submit(*item))
+
+                    if part not in writers:
+                        # underscored files are skipped by Parquet dataset readers
+                        writers[part] = pq.ParquetWriter(path / f"_part-{part:05d}.tmp", schema)
+                    writers[part].write_table(table)
+                    bar.update(table.num_rows)
+
+                    if offset + self.page_size >= min((part + 1) * part_rows, total):
+                        writers.pop(part).close()
+                        (path / f"_part-{part:05d}.tmp").replace(path / f"part-{part:05d}.parquet")
+                        state["done_parts"].append(part)
+                        progress_path.write_text(json.dumps(state))
+        finally:
+            # unfinished parts are closed, they are rewritten by the next attempt
+            for writer in writers.values():
+                writer.close()
+            bar.close()
+        return path
+
+
+def download_resource(ogd: OGDProxy, uuid: str, path: str | Path, **options) -> Path:
+    """Download every record of a resource into a Parquet dataset directory"""
+    params = options.pop("params", None)
+    resume = options.pop("resume", True)
+    return ResourceDownloader(ogd, **options).download(uuid, path, params=params, resume=resume)
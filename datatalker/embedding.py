@@ -0,0 +1,140 @@
+import hashlib
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+
+from datatalker.config import CACHE_DIR
+
+
+EMBEDDING_CACHE_PATH = (Path(CACHE_DIR) / "embeddings.sqlite3").as_posix()
+
+
+def normalize_text(text: str) -> str:
+    """Canonical form of a text for embedding and cache lookups"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class CachedEmbeddingFunction:
+    """
+    Embedding function that remembers the vectors it has computed.
+
+    Lookups go through an in-memory LRU first, then an on-disk SQLite store,
+    and only the texts missing from both are embedded, in a single call to
+    the wrapped function. Entries are keyed by model name and normalized text.
+    """
+
+    def __init__(
+        self,
+        embedding_fn: Callable[[list[str]], list],
+        model_name: str,
+        db_path: str | None = EMBEDDING_CACHE_PATH,
+        max_memory_items: int = 10_000,
+    ):
+        """
+        Parameters
+        ----------
+        embedding_fn : callable
+            Function embedding a list of texts, e.g. an OllamaEmbeddingFunction.
+        model_name : str
+            Name of the embedding model, part of the cache key.
+        db_path : str, optional
+            SQLite file persisting the vectors. None keeps the cache in memory only.
+        max_memory_items : int, optional
+            Number of vectors held in the in-memory LRU.
+        """
+        self.embedding_fn = embedding_fn
+        self.model_name = model_name
+        self.db_path = db_path
+        self.max_memory_items = max_memory_items
+        self.memory: OrderedDict[str, np.ndarray] = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._db = None
+
+    @property
+    def db(self) -> sqlite3.Connection | None:
+        if self._db is None and self.db_path:
+            Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)"
+            )
+        return self._db
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode()).hexdigest()
+
+    def __call__(self, input: list[str]) -> list[np.ndarray]:
+        texts = [normalize_text(text) for text in input]
+        keys = [self.key(text) for text in texts]
+        vectors: dict[str, np.ndarray] = dict()
+
+        with self.lock:
+            for key in keys:
+                if key in self.memory:
+                    self.memory.move_to_end(key)
+                    vectors[key] = self.memory[key]
+            self.hits += len(vectors)
+
+            missing = [key for key in dict.fromkeys(keys) if key not in vectors]
+            # stay under SQLite's limit on query parameters
+            for i in range(0, len(missing) if self.db is not None else 0, 500):
+                chunk = missing[i : i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self.db.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    chunk,
+                ).fetchall()
+                for key, blob in rows:
+                    vectors[key] = np.frombuffer(blob, dtype=np.float32)
+                    self._remember(key, vectors[key])
+                self.disk_hits += len(rows)
+
+        # embed each distinct uncached text once, outside the lock
+        uncached = {
+            key: text
+            for key, text in zip(keys, texts)
+            if key not in vectors
+        }
+        if uncached:
+            embeddings = self.embedding_fn(list(uncached.values()))
+            computed = {
+                key: np.asarray(embedding, dtype=np.float32)
+                for key, embedding in zip(uncached, embeddings)
+            }
+            vectors.update(computed)
+            with self.lock:
+                self.misses += len(computed)
+                for key, vector in computed.items():
+                    self._remember(key, vector)
+                if self.db is not None:
+                    self.db.executemany(
+                        "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                        [(key, vector.tobytes()) for key, vector in computed.items()],
+                    )
+                    self.db.commit()
+
+        return [vectors[key] for key in keys]
+
+    def _remember(self, key: str, vector: np.ndarray):
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_items:
+            self.memory.popitem(last=False)
+
+    def stats(self) -> dict[str, int | float]:
+        """Hit and miss counters since the function was created"""
+        lookups = self.hits + self.disk_hits + self.misses
+        return dict(
+            hits=self.hits,
+            disk_hits=self.disk_hits,
+            misses=self.misses,
+            hit_rate=(self.hits + self.disk_hits) / lookups if lookups else 0.0,
+        )
@@ -0,0 +1,240 @@
+"""
+Embedded analytical engine over fetched datasets.
+
+Datasets fetched in a conversation (downloaded Parquet directories, API
+records or data frames) are registered as named Arrow datasets and queried
+with Arrow compute: filters and column selection are pushed into the Parquet
+scan, group-bys, aggregates, sorts and joins run vectorized in Arrow's C++
+engine, so nothing loops over rows in Python.
+"""
+import operator
+import threading
+from functools import reduce
+from pathlib import Path
+from typing import Any
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+from datatalker.config import CACHE_DIR
+from datatalker.download import download_resource, to_typed_column
+from datatalker.query import DataRequest, Filter
+from datatalker.record_cache import records_to_table
+
+
+DATASETS_DIR = (Path(CACHE_DIR) / "datasets").as_posix()
+
+ARROW_FUNCTIONS = {"count": "count", "sum": "sum", "avg": "mean", "min": "min", "max": "max"}
+COMPARISONS = {
+    "eq": pc.equal,
+    "ne": pc.not_equal,
+    "gt": pc.greater,
+    "gte": pc.greater_equal,
+    "lt": pc.less,
+    "lte": pc.less_equal,
+}
+
+
+def _values(f: Filter) -> list:
+    return f.value if isinstance(f.value, list) else [f.value]
+
+
+def _is_numeric(values: list) -> bool:
+    return any(isinstance(value, (int, float)) for value in values)
+
+
+def _expression(f: Filter, type: pa.DataType) -> ds.Expression | None:
+    """Filter as a scan expression, None when the column has to be converted first"""
+    values = _values(f)
+    if _is_numeric(values):
+        comparable = pa.types.is_integer(type) or pa.types.is_floating(type)
+    else:
+        comparable = pa.types.is_string(type) or pa.types.is_large_string(type)
+    if not comparable:
+        return None
+    if f.op == "in":
+        return pc.field(f.field).isin(values)
+    return COMPARISONS[f.op](pc.field(f.field), values[0])
+
+
+def _mask(column: pa.ChunkedArray, f: Filter) -> pa.ChunkedArray:
+    """Filter over a column converted to the values' type, unparseable numbers never match"""
+    values = _values(f)
+    if _is_numeric(values):
+        column = to_typed_column(column, pa.float64())
+        values = [float(value) for value in values]
+    else:
+        column = pc.cast(column, pa.string())
+        values = [str(value) for value in values]
+    if f.op == "in":
+        return pc.is_in(column, value_set=pa.array(values))
+    return COMPARISONS[f.op](column, values[0])
+
+
+class DataEngine:
+    """Registry of named datasets queried with Arrow compute"""
+
+    def __init__(self, root: str = DATASETS_DIR):
+        """
+        Parameters
+        ----------
+        root : str
+            Directory holding the downloaded datasets, one Parquet directory per resource.
+        """
+        self.root = Path(root)
+        self.tables: dict[str, ds.Dataset] = dict()
+        self.lock = threading.Lock()
+
+    def register(self, name: str, data: Any) -> ds.Dataset:
+        """
+        Register a dataset under a name: a Parquet file or directory, an Arrow
+        table, a data frame or a list of records (e.g. an API page).
+        """
+        if isinstance(data, (str, Path)):
+            dataset = ds.dataset(data, format="parquet")
+        elif isinstance(data, pd.DataFrame):
+            dataset = ds.dataset(pa.Table.from_pandas(data, preserve_index=False))
+        elif isinstance(data, list):
+            dataset = ds.dataset(records_to_table(data))
+        else:
+            dataset = ds.dataset(data)
+        with self.lock:
+            self.tables[name] = dataset
+        return dataset
+
+    def register_resource(self, ogd, uuid: str, name: str | None = None, **options) -> ds.Dataset:
+        """Download a whole OGD resource (resuming an earlier download) and register it"""
+        path = download_resource(ogd, uuid, self.root / uuid, **options)
+        return self.register(name or uuid, path)
+
+    def unregister(self, name: str):
+        with self.lock:
+            self.tables.pop(name, None)
+
+    def schema(self, name: str) -> pa.Schema:
+        return self.tables[name].schema
+
+    def describe(self) -> list[dict]:
+        """Registered datasets with their columns, e.g. for a prompt"""
+        return [
+            dict(name=name, columns=[f"{field.name}: {field.type}" for field in dataset.schema])
+            for name, dataset in self.tables.items()
+        ]
+
+    def query(self, request: DataRequest) -> pa.Table:
+        """Run a request against the dataset registered as request.dataset_id"""
+        return self._query(request, request.limit)
+
+    def _query(self, request: DataRequest, limit: int | None) -> pa.Table:
+        dataset = self.tables[request.dataset_id]
+        schema = dataset.schema
+
+        # comparable filters are pushed into the scan, the rest run on the scanned columns
+        pushed, remaining = list(), list()
+        for f in request.filters:
+            expression = _expression(f, schema.field(f.field).type)
+            if expression is None:
+                remaining.append(f)
+            else:
+                pushed.append(expression)
+        condition = reduce(operator.and_, pushed) if pushed else None
+        if not (remaining or request.group_by or request.aggregates or request.order_by):
+            # a plain lookup stops scanning once it has enough rows
+            if limit is None:
+                return dataset.to_table(filter=condition)
+            return dataset.head(limit, filter=condition)
+
+        columns = None
+        if request.group_by or request.aggregates:
+            columns = list(dict.fromkeys(
+                [*request.group_by]
+                + [agg.field for agg in request.aggregates if agg.field is not None]
+                + [f.field for f in remaining]
+            ))
+        table = dataset.to_table(columns=columns, filter=condition)
+        for f in remaining:
+            table = table.filter(_mask(table[f.field], f))
+
+        if request.aggregates:
+            table = self._aggregate(table, request)
+        elif request.group_by:
+            table = table.group_by(request.group_by).aggregate([])
+
+        if request.order_by:
+            table = table.sort_by([
+                (name.removeprefix("-"), "descending" if name.startswith("-") else "ascending")
+                for name in request.order_by
+            ])
+        return table.slice(0, limit)
+
+    def _aggregate(self, table: pa.Table, request: DataRequest) -> pa.Table:
+        # Table.group_by names its outputs "<field>_<function>", or "count_all"
+        aggregations, outputs = dict(), list()
+        for agg in request.aggregates:
+            if agg.field is None:
+                aggregation = ([], "count_all")
+            else:
+                aggregation = (agg.field, ARROW_FUNCTIONS[agg.function])
+                column = table[agg.field]
+                if agg.function != "count" and not (
+                    pa.types.is_integer(column.type) or pa.types.is_floating(column.type)
+                ):
+                    # numeric aggregates over columns stored as strings parse them first
+                    table = table.set_column(
+                        table.schema.get_field_index(agg.field), agg.field,
+                        to_typed_column(column, pa.float64()),
+                    )
+            output = "count_all" if agg.field is None else "_".join(aggregation)
+            aggregations[output] = aggregation
+            outputs.append(output)
+        result = table.group_by(request.group_by).aggregate(list(aggregations.values()))
+        columns = request.group_by + outputs
+        return pa.Table.from_arrays(
+            [result[name] for name in columns],
+            names=request.group_by + [agg.name for agg in request.aggregates],
+        )
+
+    def join(
+        self,
+        left: DataRequest,
+        right: DataRequest,
+        keys: list[str],
+        join_type: str = "full outer",
+        suffixes: tuple[str, str] = ("_left", "_right"),
+        limit: int | None = None,
+    ) -> pa.Table:
+        """
+        Join the results of two requests on key columns, e.g. a measure per
+        district from two datasets side by side. Both sides are computed in
+        full, `limit` (by default the larger of the requests' limits) applies
+        to the joined rows.
+        """
+        left_table, right_table = self._query(left, None), self._query(right, None)
+        # keys of one dataset are often numbers stored as strings in the other
+        for key in keys:
+            if left_table[key].type != right_table[key].type:
+                left_table = left_table.set_column(
+                    left_table.schema.get_field_index(key), key, pc.cast(left_table[key], pa.string())
+                )
+                right_table = right_table.set_column(
+                    right_table.schema.get_field_index(key), key, pc.cast(right_table[key], pa.string())
+                )
+        joined = left_table.join(
+            right_table, keys, join_type=join_type,
+            left_suffix=suffixes[0], right_suffix=suffixes[1], coalesce_keys=True,
+        )
+        return joined.slice(0, max(left.limit, right.limit) if limit is None else limit)
+
+
+def to_markdown(table: pa.Table, max_rows: int = 50) -> str:
+    """Markdown table of the first rows of a result"""
+    table = table.slice(0, max_rows)
+    rows = [table.column_names] + [
+        ["" if value is None else str(value) for value in row.values()]
+        for row in table.to_pylist()
+    ]
+    lines = ["| " + " | ".join(row) + " |" for row in rows]
+    lines.insert(1, "|" + "---|" * len(table.column_names))
+    return "\n".join(lines)
@@ -0,0 +1,134 @@
+"""
+Structured pre-filtering of dataset searches.
+
+Facets such as the state, sector or government type mentioned in a query are
+matched against the values present in the catalog metadata and turned into
+ChromaDB `where` filters, narrowing the search before any ranking happens.
+"""
+import re
+from collections import defaultdict
+from typing import Any, Iterable
+
+
+FACET_FIELDS = ("jurisdiction", "sector", "department", "govt_type")
+# facets a catalog can have several values of, stored joined by VALUE_SEPARATOR
+# and, since ChromaDB filters only compare scalars, as one flag per value
+MULTI_VALUED_FIELDS = ("jurisdiction", "sector", "department")
+VALUE_SEPARATOR = "; "
+# values too generic to narrow a search with
+IGNORED_VALUES = frozenset({"", "india", "all india", "other", "others", "na", "n/a"})
+GOVT_TYPE_CUES = {
+    "central": re.compile(r"\b(central|union)\s+(govt|government|ministry)|\bministry of\b", re.I),
+    "state": re.compile(r"\bstate\s+(govt|government|department)\b", re.I),
+}
+API_CUE = re.compile(r"\bapis?\b", re.I)
+
+
+def flag(field: str, value: str) -> str:
+    """Metadata key set to True on documents having a value of a multi-valued facet"""
+    return f"{field}={value}"
+
+
+class FacetExtractor:
+    """Finds facet values of the catalog metadata mentioned in a query"""
+
+    def __init__(self, vocabulary: dict[str, set[str]]):
+        self.vocabulary = vocabulary
+        # longest values first, so "West Bengal" is preferred over "Bengal"
+        self.patterns = {
+            field: [
+                (value, re.compile(rf"\b{re.escape(value)}\b", re.I))
+                for value in sorted(values, key=len, reverse=True)
+            ]
+            for field, values in vocabulary.items()
+        }
+
+    @classmethod
+    def from_metadatas(cls, metadatas: Iterable[dict[str, Any]], fields=FACET_FIELDS):
+        """Collect the vocabulary of each facet from document metadata"""
+        vocabulary = defaultdict(set)
+        for metadata in metadatas:
+            for field in fields:
+                value = metadata.get(field)
+                if not isinstance(value, str):
+                    continue
+                values = value.split(VALUE_SEPARATOR) if field in MULTI_VALUED_FIELDS else [value]
+                vocabulary[field].update(
+                    value for value in values if value.strip().lower() not in IGNORED_VALUES
+                )
+        return cls(dict(vocabulary))
+
+    def extract(self, query: str) -> dict[str, list]:
+        """Facet values mentioned in the query"""
+        facets = dict()
+        for field, patterns in self.patterns.items():
+            if field == "govt_type":
+                continue
+            matched, remaining = list(), query
+            for value, pattern in patterns:
+                if pattern.search(remaining):
+                    matched.append(value)
+                    remaining = pattern.sub(" ", remaining)
+            if matched:
+                facets[field] = matched
+
+        for cue, pattern in GOVT_TYPE_CUES.items():
+            if pattern.search(query):
+                values = [
+                    value for value in self.vocabulary.get("govt_type", ())
+                    if cue in value.lower()
+                ]
+                if values:
+                    facets["govt_type"] = values
+                break
+
+        if API_CUE.search(query):
+            facets["is_api_available"] = [True]
+        return facets
+
+    def where(self, query: str) -> dict | None:
+        """ChromaDB `where` filter for the facets mentioned in the query"""
+        return to_where(self.extract(query))
+
+
+def to_where(facets: dict[str, list]) -> dict | None:
+    conditions = list()
+    for field, values in facets.items():
+        if field in MULTI_VALUED_FIELDS:
+            # documents having any of the values
+            flags = [{flag(field, value): True} for value in values]
+            conditions.append(flags[0] if len(flags) == 1 else {"$or": flags})
+        else:
+            conditions.append({field: values[0]} if len(values) == 1 else {field: {"$in": values}})
+    if not conditions:
+        return None
+    if len(conditions) == 1:
+        return conditions[0]
+    return {"$and": conditions}
+
+
+def matches(metadata: dict[str, Any], where: dict | None) -> bool:
+    """Evaluate the subset of ChromaDB `where` filters produced by to_where"""
+    if not where:
+        return True
+    for field, condition in where.items():
+        if field == "$and":
+            if not all(matches(metadata, clause) for clause in condition):
+                return False
+        elif field == "$or":
+            if not any(matches(metadata, clause) for clause in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(field)
+            for op, operand in condition.items():
+                if op == "$eq" and value != operand:
+                    return False
+                if op == "$ne" and value == operand:
+                    return False
+                if op == "$in" and value not in operand:
+                    return False
+                if op == "$nin" and value in operand:
+                    return False
+        elif metadata.get(field) != condition:
+            return False
+    return True
@@ -0,0 +1,344 @@
+"""
+In-process embedding index backed by memory-mapped NumPy arrays.
+
+The vectors live in a single .npy file opened with mmap, so worker processes
+on one machine share the operating system's page cache instead of each
+loading a copy. The documents and their metadata are memory-mapped too, one
+JSON line each, and only the rows a search returns are parsed. Search is an
+exact, vectorized dot product over the unit normalized vectors, optionally
+restricted to the nearest IVF partitions and to the rows of precomputed
+facet masks.
+"""
+import json
+import mmap
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Literal
+
+import dspy
+import numpy as np
+from dspy.dsp.utils import dotdict
+
+from datatalker.facets import FACET_FIELDS, matches
+
+
+SCORE_CHUNK_ROWS = 8192 # rows upcast to float32 at a time while scoring
+# metadata indexed at build time for filtering, besides the facet value flags
+INDEXED_FIELDS = (*FACET_FIELDS, "is_api_available")
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def kmeans(vectors: np.ndarray, n_lists: int, n_iter: int = 20, seed: int = 0) -> np.ndarray:
+    """Spherical k-means centroids of unit vectors"""
+    n_lists = min(n_lists, len(vectors))
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=n_lists, replace=False)]
+    for _ in range(n_iter):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        for i in range(n_lists):
+            members = vectors[assignments == i]
+            if len(members):
+                centroids[i] = members.mean(axis=0)
+        centroids = normalize(centroids)
+    return centroids
+
+
+def is_indexed(key: str, value: Any) -> bool:
+    """Whether a metadata value gets a precomputed mask, facet flags and facet fields do"""
+    return key in INDEXED_FIELDS or ("=" in key and value is True)
+
+
+class DocStore:
+    """Memory-mapped JSON lines of [document, metadata], parsed on access"""
+
+    def __init__(self, path: Path):
+        self.offsets = np.load(path.with_suffix(".offsets.npy"), mmap_mode="r")
+        with open(path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.offsets[-1] else b""
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row: int) -> list:
+        return json.loads(self.data[self.offsets[row]:self.offsets[row + 1]])
+
+    @staticmethod
+    def write(path: Path, rows):
+        offsets = [0]
+        with open(path, "wb") as f:
+            for row in rows:
+                offsets.append(offsets[-1] + f.write(json.dumps(row).encode() + b"\n"))
+        np.save(path.with_suffix(".offsets.npy"), np.asarray(offsets, dtype=np.int64))
+
+
+class DocColumn:
+    """The documents or metadatas of a DocStore, as a read-only sequence"""
+
+    def __init__(self, store: DocStore, column: int):
+        self.store = store
+        self.column = column
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, row: int):
+        return self.store[row][self.column]
+
+    def __iter__(self):
+        return (self[row] for row in range(len(self)))
+
+
+class FlatIndex:
+    """Memory-mapped matrix of unit embeddings with an id and metadata sidecar"""
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        with open(self.path / "index.json") as f:
+            info = json.load(f)
+        self.dtype = info["dtype"]
+        self.built_at: str | None = info.get("built_at")
+        with open(self.path / "ids.json") as f:
+            self.ids: list[str] = json.load(f)
+        store = DocStore(self.path / "docs.jsonl")
+        self.documents = DocColumn(store, 0)
+        self.metadatas = DocColumn(store, 1)
+        # rows of each indexed metadata value, by field and JSON encoded value
+        with open(self.path / "facets.json") as f:
+            self.facets: dict[str, dict[str, list[int]]] = json.load(f)
+        self._masks: dict[tuple[str, str], np.ndarray] = dict()
+
+        self.vectors = np.load(self.path / "vectors.npy", mmap_mode="r")
+        self.scales = (
+            np.load(self.path / "scales.npy", mmap_mode="r")
+            if self.dtype == "int8" else None
+        )
+        self._rows: dict[str, int] | None = None
+        self.centroids = None
+        self.offsets = None
+        if info.get("n_lists"):
+            self.centroids = np.load(self.path / "centroids.npy")
+            self.offsets = np.load(self.path / "offsets.npy")
+
+    def __len__(self):
+        return len(self.ids)
+
+    def doc(self, row: int) -> dotdict:
+        """The id, text and metadata of a row, parsed from the doc store"""
+        document, metadata = self.documents.store[row]
+        return dotdict(id=self.ids[row], long_text=document, metadatas=metadata)
+
+    def get(self, ids: list[str], where: dict | None = None) -> list[dotdict]:
+        """Documents by id, in the given order, keeping those matching `where`"""
+        if self._rows is None:
+            self._rows = {doc_id: row for row, doc_id in enumerate(self.ids)}
+        docs = (self.doc(self._rows[doc_id]) for doc_id in ids if doc_id in self._rows)
+        return [doc for doc in docs if matches(doc.metadatas, where)]
+
+    def value_mask(self, field: str, value: Any) -> np.ndarray:
+        """Rows whose metadata `field` equals `value`, cached per value"""
+        key = (field, json.dumps(value))
+        mask = self._masks.get(key)
+        if mask is None:
+            if field in INDEXED_FIELDS or "=" in field:
+                mask = np.zeros(len(self), dtype=bool)
+                mask[self.facets.get(field, {}).get(key[1], [])] = True
+            else:
+                # not indexed at build time, scanned once
+                mask = np.fromiter(
+                    (metadata.get(field) == value for metadata in self.metadatas),
+                    dtype=bool, count=len(self),
+                )
+            self._masks[key] = mask
+        return mask
+
+    def where_mask(self, where: dict) -> np.ndarray:
+        """Rows matching a `where` filter, the vectorized equivalent of facets.matches"""
+        mask = np.ones(len(self), dtype=bool)
+        for field, condition in where.items():
+            if field == "$and":
+                for clause in condition:
+                    mask &= self.where_mask(clause)
+            elif field == "$or":
+                mask &= np.logical_or.reduce([self.where_mask(clause) for clause in condition])
+            elif isinstance(condition, dict):
+                for op, operand in condition.items():
+                    if op in ("$eq", "$ne"):
+                        selected = self.value_mask(field, operand)
+                    else:
+                        selected = np.logical_or.reduce(
+                            [self.value_mask(field, value) for value in operand]
+                            or [np.zeros(len(self), dtype=bool)]
+                        )
+                    mask &= ~selected if op in ("$ne", "$nin") else selected
+            else:
+                mask &= self.value_mask(field, condition)
+        return mask
+
+    @classmethod
+    def build(
+        cls,
+        path: str | Path,
+        ids: list[str],
+        documents: list[str],
+        metadatas: list[dict[str, Any]],
+        embeddings,
+        dtype: Literal["float16", "int8"] = "float16",
+        n_lists: int = 0,
+    ) -> "FlatIndex":
+        """
+        Write an index to a directory and open it.
+        Parameters
+        ----------
+        dtype : "float16" | "int8"
+            Storage type of the vectors, int8 keeps a per-row scale.
+        n_lists : int, optional
+            Number of IVF partitions, 0 searches every vector.
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        vectors = normalize(embeddings)
+        n_lists = min(n_lists, len(ids))
+
+        order = np.arange(len(ids))
+        if n_lists:
+            centroids = kmeans(vectors, n_lists)
+            assignments = np.argmax(vectors @ centroids.T, axis=1)
+            # store each partition's rows contiguously
+            order = np.argsort(assignments, kind="stable")
+            counts = np.bincount(assignments, minlength=n_lists)
+            np.save(path / "centroids.npy", centroids)
+            np.save(path / "offsets.npy", np.concatenate([[0], np.cumsum(counts)]))
+        vectors = vectors[order]
+
+        if dtype == "int8":
+            scales = np.abs(vectors).max(axis=1) / 127
+            scales[scales == 0] = 1
+            np.save(path / "vectors.npy", np.round(vectors / scales[:, None]).astype(np.int8))
+            np.save(path / "scales.npy", scales.astype(np.float32))
+        else:
+            np.save(path / "vectors.npy", vectors.astype(np.float16))
+
+        facets = defaultdict(lambda: defaultdict(list))
+        for row, i in enumerate(order):
+            for key, value in metadatas[i].items():
+                if is_indexed(key, value):
+                    facets[key][json.dumps(value)].append(row)
+        with open(path / "facets.json", "w") as f:
+            json.dump(facets, f)
+        with open(path / "ids.json", "w") as f:
+            json.dump([ids[i] for i in order], f)
+        DocStore.write(path / "docs.jsonl", ([documents[i], metadatas[i]] for i in order))
+        with open(path / "index.json", "w") as f:
+            json.dump(dict(
+                dtype=dtype, dim=vectors.shape[1], n_lists=n_lists,
+                built_at=datetime.now(timezone.utc).isoformat(),
+            ), f)
+        return cls(path)
+
+    @classmethod
+    def from_chroma(cls, collection, path: str | Path, batch_size: int = 1000, **kwargs) -> "FlatIndex":
+        """Build an index from the stored embeddings of a ChromaDB collection"""
+        ids, documents, metadatas, embeddings = list(), list(), list(), list()
+        for offset in range(0, collection.count(), batch_size):
+            batch = collection.get(
+                offset=offset, limit=batch_size,
+                include=["documents", "metadatas", "embeddings"],
+            )
+            ids.extend(batch["ids"])
+            documents.extend(batch["documents"])
+            metadatas.extend(batch["metadatas"])
+            embeddings.extend(batch["embeddings"])
+        return cls.build(path, ids, documents, metadatas, np.asarray(embeddings), **kwargs)
+
+    def _rows_to_search(self, query: np.ndarray, n_probe: int) -> np.ndarray | None:
+        if self.centroids is None:
+            return None
+        nearest = np.argsort(-(self.centroids @ query))[:n_probe]
+        return np.concatenate([
+            np.arange(self.offsets[i], self.offsets[i + 1]) for i in nearest
+        ])
+
+    def scores(self, queries: np.ndarray, rows: np.ndarray | None = None) -> np.ndarray:
+        """Cosine similarity of each query (rows of `queries`) with the selected vectors"""
+        n_rows = len(self) if rows is None else len(rows)
+        scores = np.empty((len(queries), n_rows), dtype=np.float32)
+        for start in range(0, n_rows, SCORE_CHUNK_ROWS):
+            stop = min(start + SCORE_CHUNK_ROWS, n_rows)
+            selected = slice(start, stop) if rows is None else rows[start:stop]
+            block = np.asarray(self.vectors[selected], dtype=np.float32)
+            scores[:, start:stop] = queries @ block.T
+            if self.scales is not None:
+                scores[:, start:stop] *= self.scales[selected]
+        return scores
+
+    def search(
+        self,
+        query_embeddings,
+        k: int = 10,
+        where: dict | None = None,
+        n_probe: int = 8,
+    ) -> list[list[tuple[int, float]]]:
+        """Top-k (row, similarity) pairs for each query embedding"""
+        queries = normalize(np.atleast_2d(query_embeddings))
+        allowed = self.where_mask(where) if where else None
+
+        # without partitions or filters every query scans the same rows,
+        # score them all in one matrix product
+        batch_scores = None
+        if self.centroids is None and allowed is None:
+            batch_scores = self.scores(queries)
+
+        results = list()
+        for q, query in enumerate(queries):
+            rows = self._rows_to_search(query, n_probe)
+            if allowed is not None:
+                rows = np.flatnonzero(allowed) if rows is None else rows[allowed[rows]]
+            if batch_scores is None:
+                scores = self.scores(query[None, :], rows)[0]
+            else:
+                scores = batch_scores[q]
+            top = np.argpartition(-scores, min(k, len(scores)) - 1)[:k] if len(scores) else []
+            top = sorted(top, key=lambda i: -scores[i])
+            results.append([
+                (int(i if rows is None else rows[i]), float(scores[i]))
+                for i in top
+            ])
+        return results
+
+
+class FlatRetriever(dspy.Retrieve):
+    """Retriever over a FlatIndex returning ChromadbRM shaped results"""
+
+    def __init__(self, index: FlatIndex, embedding_fn, k: int = 7, n_probe: int = 8):
+        self.index = index
+        self.embedding_fn = embedding_fn
+        self.n_probe = n_probe
+        super().__init__(k=k)
+
+    def forward(self, query_or_queries: str | list[str], k: int | None = None, where: dict | None = None, **kwargs):
+        queries = (
+            [query_or_queries]
+            if isinstance(query_or_queries, str)
+            else query_or_queries
+        )
+        # like ChromadbRM, only the first query's results are returned
+        return self.forward_many(queries, k=k, where=where)[0]
+
+    def forward_many(self, queries: list[str], k: int | None = None, where: dict | None = None, **kwargs):
+        """Results for each query, all queries are embedded in one call"""
+        k = self.k if k is None else k
+        embeddings = self.embedding_fn(queries)
+        return [
+            [
+                # squared L2 distance between unit vectors, as reported by ChromaDB
+                dotdict(self.index.doc(row), score=2 - 2 * sim)
+                for row, sim in hits
+            ]
+            for hits in self.index.search(embeddings, k=k, where=where, n_probe=self.n_probe)
+        ]
@@ -0,0 +1,118 @@
+"""
+Shared HTTP layer of the data portal proxies.
+
+A requests.Session keeps gzip enabled, keep-alive connections pooled per host
+and carries no per-call state: parameters are copied into each request and
+never stored, so one client can serve many threads at once. From asyncio
+code, call it through asyncio.to_thread.
+"""
+from typing import Any, Mapping
+
+import requests
+from requests.adapters import HTTPAdapter
+from tenacity import (
+    Retrying,
+    stop_after_attempt,
+    wait_exponential,
+    retry_if_exception
+)
+
+from datatalker.throttle import (
+    AdaptiveTokenBucket,
+    is_retryable,
+    is_throttled,
+    retry_after,
+)
+
+
+DEFAULT_TIMEOUT = (10, 60) # seconds to connect, seconds to wait for a response
+DEFAULT_HEADERS = {
+    "Accept-Encoding": "gzip, deflate",
+    "Connection": "keep-alive",
+}
+
+
+class HTTPClient:
+    """Thread-safe, rate limited and retrying HTTP client over pooled connections"""
+
+    def __init__(
+        self,
+        headers: Mapping[str, str] | None = None,
+        max_connections: int = 10,
+        timeout: float | tuple[float, float] = DEFAULT_TIMEOUT,
+        rate_limiter: AdaptiveTokenBucket | None = None,
+        max_attempts: int = 5,
+        min_wait: float = 2,
+        max_wait: float = 60,
+    ):
+        """
+        Parameters
+        ----------
+        headers : Mapping, optional
+            Headers sent with every request.
+        max_connections : int, optional
+            Keep-alive connections kept open to each host, should be at least
+            the number of threads sharing the client.
+        timeout : float | (float, float), optional
+            Seconds to wait for the server, or (connect, read) timeouts.
+        rate_limiter : AdaptiveTokenBucket, optional
+            Paces the requests and backs off when the server throttles them.
+        max_attempts, min_wait, max_wait : optional
+            Retries of failed requests with exponential backoff, only network
+            errors, 429 and 5xx responses are retried.
+        """
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter
+        self.retrying = Retrying(
+            stop=stop_after_attempt(max_attempts),
+            wait=wait_exponential(multiplier=1, min=min_wait, max=max_wait),
+            retry=retry_if_exception(is_retryable),
+            reraise=True,
+        )
+        self.session = requests.Session()
+        self.session.headers.update(DEFAULT_HEADERS)
+        self.session.headers.update(headers or {})
+        # the adapter keeps a pool of max_connections per host
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=max_connections)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _send(self, method: str, url: str, params: Mapping[str, Any] | None, **kwargs) -> requests.Response:
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        try:
+            response = self.session.request(
+                method=method.upper(),
+                url=url,
+                params=dict(params or {}),
+                timeout=kwargs.pop("timeout", self.timeout),
+                **kwargs,
+            )
+        except requests.exceptions.RequestException:
+            if self.rate_limiter is not None:
+                self.rate_limiter.on_failure()
+            raise
+        if self.rate_limiter is not None:
+            if is_throttled(response):
+                self.rate_limiter.on_throttle(retry_after(response))
+            elif response.ok:
+                self.rate_limiter.on_success()
+            else:
+                self.rate_limiter.on_failure()
+        response.raise_for_status()
+        return response
+
+    def request(self, method: str, url: str, params: Mapping[str, Any] | None = None, **kwargs) -> requests.Response:
+        """Send a request, retrying transient failures"""
+        # a copy per call keeps the retry state out of other threads' way
+        return self.retrying.copy()(self._send, method, url, params, **kwargs)
+
+    def get(self, url: str, params: Mapping[str, Any] | None = None, **kwargs) -> requests.Response:
+        return self.request("GET", url, params, **kwargs)
+
+    def stats(self) -> dict:
+        """Throughput and throttling metrics of the requests made so far"""
+        return self.rate_limiter.stats() if self.rate_limiter is not None else dict()
+
+    def close(self):
+        self.session.close()
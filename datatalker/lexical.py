@@ -0,0 +1,252 @@
+"""
+Lexical (BM25) search over the catalog documents, fused with vector search.
+
+Embeddings are good at paraphrases but tend to miss exact terms such as
+scheme names, district names and ministry acronyms. A small in-process
+inverted index catches those, and reciprocal rank fusion merges both
+rankings before the candidates reach the relevance judge.
+"""
+import gzip
+import heapq
+import json
+import math
+import re
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Any, Callable, Iterable
+
+import dspy
+from dspy.dsp.utils import dotdict
+
+from datatalker.ogdp import DocumentAdapter
+from datatalker.retrieval import retrieve_many
+
+
+STOPWORDS = frozenset(
+    "a an and are as at be by data dataset datasets for from in is it of on or "
+    "show the to with about find me related".split()
+)
+RRF_K = 60 # dampens the influence of top ranks, 60 is the usual choice
+MAX_LEXICAL_SCAN = 10 # chunks of filtered BM25 hits looked up before giving up
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercase alphanumeric tokens without stopwords"""
+    return [
+        token
+        for token in re.findall(r"[a-z0-9]+", text.lower())
+        if token not in STOPWORDS
+    ]
+
+
+class BM25Index:
+    """
+    Inverted index scoring documents with Okapi BM25. Only the postings are
+    kept, the documents themselves stay in the vector store and are looked
+    up by id for the hits that are used.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.ids: list[str] = list()
+        self.doc_lens: list[int] = list()
+        self.postings: dict[str, list[tuple[int, int]]] = defaultdict(list)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, ids: Iterable[str], documents: Iterable[str]):
+        for doc_id, document in zip(ids, documents):
+            idx = len(self.ids)
+            tokens = tokenize(document or "")
+            self.ids.append(doc_id)
+            self.doc_lens.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                self.postings[term].append((idx, tf))
+
+    def scores(self, query: str) -> dict[int, float]:
+        """BM25 score of every document matching at least one query term"""
+        n_docs = len(self.ids)
+        if n_docs == 0:
+            return dict()
+        avg_len = sum(self.doc_lens) / n_docs
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for idx, tf in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lens[idx] / avg_len)
+                scores[idx] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+    def ranking(self, query: str, limit: int | None = None) -> list[tuple[str, float]]:
+        """(id, score) of the best matching documents, best first"""
+        scores = self.scores(query)
+        top = (
+            sorted(scores, key=scores.get, reverse=True) if limit is None
+            else heapq.nlargest(limit, scores, key=scores.get)
+        )
+        return [(self.ids[idx], scores[idx]) for idx in top]
+
+    def save(self, path: str | Path, **extra):
+        """Persist the index as gzipped JSON, extra keys are stored alongside"""
+        state = dict(
+            k1=self.k1,
+            b=self.b,
+            ids=self.ids,
+            doc_lens=self.doc_lens,
+            postings=self.postings,
+            **extra,
+        )
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(state, f)
+        tmp_path.replace(path)
+
+    @classmethod
+    def load(cls, path: str | Path) -> tuple["BM25Index", dict[str, Any]]:
+        """Load a persisted index, returns the index and the extra keys saved with it"""
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            state = json.load(f)
+        index = cls(k1=state.pop("k1"), b=state.pop("b"))
+        index.ids = state.pop("ids")
+        index.doc_lens = state.pop("doc_lens")
+        index.postings = defaultdict(list, {
+            term: [tuple(posting) for posting in postings]
+            for term, postings in state.pop("postings").items()
+        })
+        return index, state
+
+    @classmethod
+    def from_chroma(cls, collection, batch_size: int = 1000) -> "BM25Index":
+        """Build the index from the documents of a ChromaDB collection"""
+        index = cls()
+        index.add(*read_chroma(collection, batch_size))
+        return index
+
+    @classmethod
+    def from_mongo(cls, collection, filters: dict | None = None) -> "BM25Index":
+        """Build the index from OGD catalogs stored in a MongoDB collection"""
+        index = cls()
+        for catalog in collection.find(filters or {}):
+            inputs = DocumentAdapter.to_vectorstore_inputs(catalog)
+            index.add([inputs["id"]], [inputs["document"]])
+        return index
+
+
+def read_chroma(collection, batch_size: int = 1000) -> tuple[list, list]:
+    """Ids and documents of a ChromaDB collection"""
+    ids, documents = list(), list()
+    for offset in range(0, collection.count(), batch_size):
+        batch = collection.get(offset=offset, limit=batch_size, include=["documents"])
+        ids.extend(batch["ids"])
+        documents.extend(batch["documents"])
+    return ids, documents
+
+
+def chroma_lookup(collection):
+    """Look up documents of a ChromaDB collection by id, keeping those matching `where`"""
+    def lookup(ids: list[str], where: dict | None = None) -> list[dotdict]:
+        if not ids:
+            return list()
+        batch = collection.get(ids=ids, where=where or None, include=["documents", "metadatas"])
+        found = {
+            doc_id: dotdict(id=doc_id, long_text=document, metadatas=metadata)
+            for doc_id, document, metadata in zip(batch["ids"], batch["documents"], batch["metadatas"])
+        }
+        return [found[doc_id] for doc_id in ids if doc_id in found]
+    return lookup
+
+
+def reciprocal_rank_fusion(rankings: Iterable[list[str]], k: int = RRF_K) -> dict[str, float]:
+    """Fuse ranked lists of ids, ids ranked high in several lists score the most"""
+    fused = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            fused[doc_id] += 1 / (k + rank + 1)
+    return fused
+
+
+class HybridRetriever(dspy.Retrieve):
+    """Combines a vector retriever with a BM25 index using reciprocal rank fusion"""
+
+    def __init__(
+        self,
+        retriever,
+        index: BM25Index,
+        lookup: Callable[[list[str], dict | None], list[dotdict]],
+        k: int = 7,
+        candidates_per_retriever: int = 20,
+    ):
+        """
+        Parameters
+        ----------
+        retriever : ChromadbRM
+            Vector retriever queried for semantic candidates.
+        index : BM25Index
+            Lexical index over the same documents.
+        lookup : callable
+            Fetches the documents of lexical hits by id, keeping those that
+            match the `where` filter.
+        candidates_per_retriever : int, optional
+            Minimum number of candidates pulled from each ranking before fusion.
+        """
+        self.retriever = retriever
+        self.index = index
+        self.lookup = lookup
+        self.candidates_per_retriever = candidates_per_retriever
+        super().__init__(k=k)
+
+    def forward(self, query: str, k: int | None = None, **kwargs) -> list[dotdict]:
+        k = self.k if k is None else k
+        n_candidates = max(k, self.candidates_per_retriever)
+        semantic = self.retriever(query, k=n_candidates, **kwargs)
+        return self.fuse(query, semantic, k, where=kwargs.get("where"))
+
+    def forward_many(self, queries: list[str], k: int | None = None, **kwargs) -> list[list[dotdict]]:
+        """Batched search, the vector side embeds and queries all queries at once"""
+        k = self.k if k is None else k
+        n_candidates = max(k, self.candidates_per_retriever)
+        semantic = retrieve_many(self.retriever, queries, k=n_candidates, where=kwargs.get("where"))
+        return [
+            self.fuse(query, docs, k, where=kwargs.get("where"))
+            for query, docs in zip(queries, semantic)
+        ]
+
+    def lexical(self, query: str, n_candidates: int, known: dict[str, dotdict], where: dict | None = None) -> list[dotdict]:
+        """Best BM25 hits matching `where`, documents not in `known` are looked up"""
+        ranking = self.index.ranking(query, limit=None if where else n_candidates)
+        max_scanned = n_candidates * MAX_LEXICAL_SCAN if where else n_candidates
+        hits = list()
+        # filtered hits are looked up a chunk at a time until there are enough
+        for start in range(0, min(len(ranking), max_scanned), n_candidates):
+            chunk = ranking[start:start + n_candidates]
+            found = {
+                doc.id: doc
+                for doc in self.lookup([doc_id for doc_id, _ in chunk if doc_id not in known], where)
+            }
+            for doc_id, score in chunk:
+                doc = known.get(doc_id) or found.get(doc_id)
+                if doc is not None:
+                    hits.append(dotdict(doc, bm25_score=score))
+            if len(hits) >= n_candidates:
+                break
+        return hits[:n_candidates]
+
+    def fuse(self, query: str, semantic: list[dotdict], k: int, where: dict | None = None) -> list[dotdict]:
+        n_candidates = max(k, self.candidates_per_retriever)
+        # the vector results already match the filter and carry the similarity score
+        docs = {doc.id: doc for doc in semantic}
+        lexical = self.lexical(query, n_candidates, docs, where)
+        docs = {doc.id: doc for doc in lexical} | docs
+        fused = reciprocal_rank_fusion([
+            [doc.id for doc in semantic],
+            [doc.id for doc in lexical],
+        ])
+        top = sorted(fused, key=fused.get, reverse=True)[:k]
+        return [dotdict(docs[doc_id], rrf_score=fused[doc_id]) for doc_id in top]
@@ -0,0 +1,245 @@
+"""
+A pool of compatible model servers used as a single dspy LM.
+
+Requests go to the healthy endpoint with the fewest requests outstanding
+relative to its capacity. An endpoint that keeps failing is taken out of
+rotation until a health probe answers or its cooldown ends, and its
+requests fail over to the other endpoints. Configure it like any LM,
+
+    dspy.configure(lm=LMPool.from_config())
+
+and size batch jobs by `capacity`, so throughput grows with the number of
+servers listed in LM_ENDPOINTS.
+"""
+import threading
+import time
+from dataclasses import dataclass
+
+import dspy
+import litellm
+import requests
+
+from datatalker.config import LM_ENDPOINTS, LM_MODEL
+
+
+SINGLE_ENDPOINT_RETRIES = 8 # dspy.LM's default, used when there is nothing to fail over to
+
+
+@dataclass
+class Endpoint:
+    """A model server and its load and health"""
+    api_base: str
+    lm: dspy.LM
+    max_concurrency: int = 4
+    outstanding: int = 0
+    consecutive_failures: int = 0
+    down_until: float = 0.0
+    requests: int = 0
+    failures: int = 0
+    seconds: float = 0.0
+
+    @property
+    def load(self) -> float:
+        return self.outstanding / self.max_concurrency
+
+    def is_up(self, now: float) -> bool:
+        return now >= self.down_until
+
+
+def is_request_error(exc: Exception) -> bool:
+    """Errors caused by the request itself, which other endpoints would return too"""
+    return isinstance(exc, (litellm.BadRequestError, litellm.AuthenticationError))
+
+
+class LMPool(dspy.BaseLM):
+    """A dspy LM spreading requests over several endpoints serving the same model"""
+
+    def __init__(
+        self,
+        model: str,
+        api_bases: list[str],
+        max_concurrency: int = 4,
+        max_failures: int = 3,
+        cooldown: float = 30,
+        health_check_interval: float | None = 15,
+        model_type: str = "chat",
+        temperature: float = 0.0,
+        max_tokens: int = 1000,
+        cache: bool = True,
+        **kwargs,
+    ):
+        """
+        Parameters
+        ----------
+        model : str
+            LiteLLM model name, e.g. "ollama_chat/gemma3" or "openai/gemma3"
+            for OpenAI-compatible servers.
+        api_bases : list of str
+            Base URLs of the servers, all serving the model.
+        max_concurrency : int, optional
+            Requests sent to an endpoint at once, callers wait beyond that.
+        max_failures : int, optional
+            Consecutive failures after which an endpoint is taken out of rotation.
+        cooldown : float, optional
+            Seconds an endpoint stays out of rotation before it is probed again.
+        health_check_interval : float, optional
+            Seconds between background probes of the endpoints that are down,
+            None only probes them when a request needs one.
+        model_type, temperature, max_tokens, cache, kwargs
+            As for dspy.LM.
+        """
+        super().__init__(model, model_type, temperature, max_tokens, cache, **kwargs)
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        # failover replaces retries on the same server, unless there is no other
+        num_retries = 1 if len(api_bases) > 1 else SINGLE_ENDPOINT_RETRIES
+        self.endpoints = [
+            Endpoint(
+                api_base=api_base.rstrip("/"),
+                lm=dspy.LM(model, model_type, api_base=api_base, cache=cache, num_retries=num_retries),
+                max_concurrency=max_concurrency,
+            )
+            for api_base in api_bases
+        ]
+        self.condition = threading.Condition()
+        self.health_check_interval = health_check_interval
+        if health_check_interval:
+            threading.Thread(target=self._check_health_periodically, daemon=True).start()
+
+    @classmethod
+    def from_config(cls, **kwargs) -> "LMPool":
+        """Pool of the endpoints in LM_ENDPOINTS serving LM_MODEL"""
+        api_bases = [url.strip() for url in LM_ENDPOINTS.split(",") if url.strip()]
+        return cls(LM_MODEL, api_bases, **kwargs)
+
+    @property
+    def capacity(self) -> int:
+        """Requests the pool serves at once, e.g. the number of workers of a batch job"""
+        return sum(endpoint.max_concurrency for endpoint in self.endpoints)
+
+    def copy(self, **kwargs):
+        """A pool sharing the endpoints, with updated request parameters"""
+        new = object.__new__(type(self))
+        new.__dict__.update(self.__dict__)
+        new.kwargs = dict(self.kwargs)
+        new.history = []
+        for key, value in kwargs.items():
+            if key in self.__dict__ and key not in self.kwargs:
+                setattr(new, key, value)
+            else:
+                new.kwargs[key] = value
+        return new
+
+    def _acquire(self, tried: set, wait: bool = True) -> Endpoint:
+        """The least loaded endpoint that is up and hasn't been tried, waiting for capacity"""
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                candidates = [e for e in self.endpoints if id(e) not in tried]
+                up = [e for e in candidates if e.is_up(now)]
+                if not up:
+                    # every endpoint is down, try the one back soonest
+                    up = [min(candidates, key=lambda e: e.down_until)]
+                endpoint = min(up, key=lambda e: e.load)
+                if endpoint.outstanding < endpoint.max_concurrency or not wait:
+                    endpoint.outstanding += 1
+                    endpoint.requests += 1
+                    return endpoint
+                self.condition.wait()
+
+    def _release(self, endpoint: Endpoint, started: float, error: Exception | None):
+        with self.condition:
+            endpoint.outstanding -= 1
+            endpoint.seconds += time.monotonic() - started
+            if error is None:
+                endpoint.consecutive_failures = 0
+            else:
+                endpoint.failures += 1
+                endpoint.consecutive_failures += 1
+                if endpoint.consecutive_failures >= self.max_failures:
+                    if endpoint.is_up(time.monotonic()):
+                        print(f"LM endpoint {endpoint.api_base} is down: {error}")
+                    endpoint.down_until = time.monotonic() + self.cooldown
+            self.condition.notify()
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        tried, error = set(), None
+        for _ in self.endpoints:
+            endpoint = self._acquire(tried)
+            tried.add(id(endpoint))
+            started = time.monotonic()
+            try:
+                response = endpoint.lm.forward(prompt, messages, **{**self.kwargs, **kwargs})
+            except Exception as e:
+                if is_request_error(e):
+                    self._release(endpoint, started, None)
+                    raise
+                self._release(endpoint, started, e)
+                error = e
+                continue
+            self._release(endpoint, started, None)
+            return response
+        raise error
+
+    async def aforward(self, prompt=None, messages=None, **kwargs):
+        tried, error = set(), None
+        for _ in self.endpoints:
+            # the event loop mustn't block, so no waiting for capacity
+            endpoint = self._acquire(tried, wait=False)
+            tried.add(id(endpoint))
+            started = time.monotonic()
+            try:
+                response = await endpoint.lm.aforward(prompt, messages, **{**self.kwargs, **kwargs})
+            except Exception as e:
+                if is_request_error(e):
+                    self._release(endpoint, started, None)
+                    raise
+                self._release(endpoint, started, e)
+                error = e
+                continue
+            self._release(endpoint, started, None)
+            return response
+        raise error
+
+    def probe(self, endpoint: Endpoint) -> bool:
+        """Whether an endpoint answers, by listing its models"""
+        path = "/api/tags" if self.model.startswith("ollama") else "/models"
+        try:
+            requests.get(endpoint.api_base + path, timeout=5).raise_for_status()
+        except requests.exceptions.RequestException:
+            return False
+        return True
+
+    def check_health(self):
+        """Probe the endpoints that are down, putting back the ones that answer"""
+        now = time.monotonic()
+        for endpoint in self.endpoints:
+            if endpoint.is_up(now):
+                continue
+            up = self.probe(endpoint)
+            with self.condition:
+                if up:
+                    endpoint.down_until = 0.0
+                    endpoint.consecutive_failures = 0
+                    self.condition.notify_all()
+                else:
+                    endpoint.down_until = time.monotonic() + self.cooldown
+
+    def _check_health_periodically(self):
+        while True:
+            time.sleep(self.health_check_interval)
+            self.check_health()
+
+    def stats(self) -> list[dict]:
+        now = time.monotonic()
+        return [
+            dict(
+                api_base=endpoint.api_base,
+                up=endpoint.is_up(now),
+                outstanding=endpoint.outstanding,
+                requests=endpoint.requests,
+                failures=endpoint.failures,
+                mean_seconds=endpoint.seconds / endpoint.requests if endpoint.requests else 0.0,
+            )
+            for endpoint in self.endpoints
+        ]
@@ -1,32 +1,74 @@
 import requests
-from tenacity import (
-    retry,
-    stop_after_attempt,
-    wait_exponential,
-    retry_if_exception_type
-)
-from typing import Any
-from multiprocessing import Pool, cpu_count
-from typing import Literal
+from typing import Any, Mapping
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Literal, TYPE_CHECKING
+from datatalker.http_client import HTTPClient
+from datatalker.throttle import AdaptiveTokenBucket
+from datatalker.facets import VALUE_SEPARATOR, flag
+
+if TYPE_CHECKING:
+    # imports pyarrow
+    from datatalker.record_cache import RecordCache
 
 class OGDProxy:
 
-    def __init__(self, api_key: str):
+    def __init__(
+        self,
+        api_key: str,
+        max_workers: int = 4,
+        requests_per_second: float = 2,
+        max_requests_per_second: float = 10,
+        timeout: float | tuple[float, float] = (10, 60),
+        client: HTTPClient | None = None,
+        record_cache: "RecordCache | None" = None,
+    ):
+        """
+        Parameters
+        ----------
+        api_key : str
+            OGD Platform API key.
+        max_workers : int, optional
+            Number of concurrent requests made by the get_all* methods, also
+            the size of the connection pool.
+        requests_per_second : float, optional
+            Initial request rate, lowered when the portal throttles us (429/5xx)
+            and raised back up to `max_requests_per_second` while it doesn't.
+        timeout : float | (float, float), optional
+            Seconds to wait for the server, or (connect, read) timeouts.
+        client : HTTPClient, optional
+            Client to share with other proxies, replaces the options above.
+        record_cache : RecordCache, optional
+            Disk cache serving repeated get_records calls.
+        """
         self.api_key = api_key
         self.backend_url = "https://www.data.gov.in/backend"
         self.api_url = "https://api.data.gov.in"
+        self.max_workers = max_workers
+        self.client = client or HTTPClient(
+            max_connections=max_workers,
+            timeout=timeout,
+            rate_limiter=AdaptiveTokenBucket(
+                requests_per_second, max_rate=max_requests_per_second
+            ),
+            min_wait=5,
+        )
+        self.record_cache = record_cache
+
+    def _make_request(self, url: str, method = "GET", params: Mapping[str, Any] | None = None, **kwargs) -> requests.Response:
+        return self.client.request(method, url, params, **kwargs)
+
+    def _starmap(self, method, args: list[tuple]) -> list:
+        """Call a method for each tuple of arguments concurrently, results are in order"""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(lambda arg: method(*arg), args))
+
+    def stats(self) -> dict:
+        """Throughput and throttling metrics of the requests made so far"""
+        return self.client.stats()
     
-    @retry(
-        stop=stop_after_attempt(5),
-        wait=wait_exponential(multiplier=1, min=5, max=60),
-        retry=retry_if_exception_type(requests.exceptions.RequestException)
-    )
-    def _make_request(self, url: str, method = "GET", **kwargs) -> requests.Response:
-        response = requests.request(method=method.upper(), url=url, **kwargs)
-        response.raise_for_status()
-        return response
-    
-    def get_all(self, endpoint_method, batch_size=1000, params = dict()):
+    def get_all(self, endpoint_method, batch_size=1000, params: Mapping[str, Any] | None = None):
         """Fetch all the records from a paginated endpoint"""
         # get the total number of records
         initial_resp = endpoint_method(0, 1, params)
@@ -36,87 +78,169 @@ class OGDProxy:
             (i, batch_size, params)
             for i in range(0, total_records, batch_size)
         ]
+        return self._starmap(endpoint_method, args)
 
-        with Pool(cpu_count()) as pool:
-            responses = pool.starmap(endpoint_method, args)
-        
-        return responses
-    
-    def catalogs(self, offset: int = 0, limit: int = 10, params=dict()):
+    def iter_pages(self, endpoint_method, records_of, batch_size=1000, params: Mapping[str, Any] | None = None, skip=()):
+        """
+        Yield (offset, records, error) for each page of a paginated endpoint,
+        in order, error is None unless the page couldn't be fetched. At most
+        `max_workers` pages are fetched ahead, so memory use doesn't grow with
+        the number of records. Offsets in `skip` are not fetched.
+        """
+        total_records = endpoint_method(0, 1, params)["total"]
+        offsets = (
+            offset for offset in range(0, total_records, batch_size)
+            if offset not in skip
+        )
+
+        def fetch(offset):
+            try:
+                return offset, records_of(endpoint_method(offset, batch_size, params)), None
+            except Exception as e:
+                return offset, None, e
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = deque(
+                executor.submit(fetch, offset)
+                for offset in islice(offsets, self.max_workers)
+            )
+            while pending:
+                page = pending.popleft().result()
+                for offset in islice(offsets, 1):
+                    pending.append(executor.submit(fetch, offset))
+                yield page
+
+    def iter_all(self, endpoint_method, records_of, batch_size=1000, params: Mapping[str, Any] | None = None):
+        """Yield all the records from a paginated endpoint, page by page"""
+        for _, records, error in self.iter_pages(endpoint_method, records_of, batch_size, params):
+            if error is not None:
+                raise error
+            yield from records
+
+    def iter_modified(self, endpoint_method, records_of, changed_at, since, sort_params: dict, batch_size=1000):
+        """
+        Yield the records changed at or after `since` from a paginated endpoint.
+        Records stamped exactly `since` are yielded again rather than risk
+        missing others changed in the same second, upserting them is
+        idempotent. Pages are requested newest first using `sort_params` and
+        paging stops at the first page reaching before `since`. If the
+        endpoint ignores the sort order every page is scanned instead.
+        """
+        offset = 0
+        while True:
+            response = endpoint_method(offset, batch_size, sort_params)
+            page = records_of(response)
+            times = [changed_at(record) for record in page]
+            yield from (
+                record for record, time in zip(page, times)
+                if since is None or time >= since
+            )
+            offset += len(page)
+            is_sorted = all(a >= b for a, b in zip(times, times[1:]))
+            reached_since = since is not None and times and min(times) < since
+            if not page or offset >= response["total"] or (is_sorted and reached_since):
+                break
+
+    def catalogs(self, offset: int = 0, limit: int = 10, params: Mapping[str, Any] | None = None):
         """Fetch the list of catalogs"""
         url = self.backend_url + "/dmspublic/v1/catalogs"
-        params["offset"] = offset
-        params["limit"] = limit
+        params = {**(params or {}), "offset": offset, "limit": limit}
         return self._make_request(url, params=params).json()
     
-    def catalog_metadata(self, catalog_uuid: str, params=dict()) -> dict:
+    def catalog_metadata(self, catalog_uuid: str, params: Mapping[str, Any] | None = None) -> dict:
         """Fetch catalog information from backend"""
         url = self.backend_url + f"/dataapi/v1/catalog/{catalog_uuid}"
-        params["format"] = "json"
+        params = {**(params or {}), "format": "json"}
         return self._make_request(url, params=params).json()
     
     def get_all_catalog_metadata(self, uuids: list[str]):
         """Fetch metadata for all the catalogs using catalog uuid"""
-        # TODO: rate limit is very prohibitive, fails after a few concurrent requests
-        with Pool(cpu_count()) as pool:
-            args = [
-                (uuid, dict())
-                for uuid in uuids
-            ]
-            responses = pool.starmap(self.catalog_metadata, args)
-        
-        return responses    
+        args = [
+            (uuid,)
+            for uuid in uuids
+        ]
+        return self._starmap(self.catalog_metadata, args)
+
     
-    def catalog(self, catalog_uuid: str,  offset: int = 0, limit: int = 10, format: Literal["json", "csv"]="json", params=dict()):
+    def catalog(self, catalog_uuid: str,  offset: int = 0, limit: int = 10, format: Literal["json", "csv"]="json", params: Mapping[str, Any] | None = None):
         """Fetch catalog records using OGD API"""
         url = self.api_url + f"/catalog/{catalog_uuid}"
-        params["api-key"] = self.api_key
-        params["format"] = format
-        params["offset"] = offset
-        params["limit"] = limit
+        params = {
+            **(params or {}),
+            "api-key": self.api_key,
+            "format": format,
+            "offset": offset,
+            "limit": limit,
+        }
         return self._make_request(url, params=params)
 
-    def resource(self, uuid: str,  offset: int = 0, limit: int = 10, format: Literal["json", "csv"]="json", params=dict()):
+    def resource(self, uuid: str,  offset: int = 0, limit: int = 10, format: Literal["json", "csv"]="json", params: Mapping[str, Any] | None = None):
         """Fetch catalog records using OGD API"""
         url = self.api_url + f"/resource/{uuid}"
-        params["api-key"] = self.api_key
-        params["format"] = format
-        params["offset"] = offset
-        params["limit"] = limit
+        params = {
+            **(params or {}),
+            "api-key": self.api_key,
+            "format": format,
+            "offset": offset,
+            "limit": limit,
+        }
         return self._make_request(url, params=params)
     
-    def resources(self, offset = 0, limit = 10, params = dict()):
+    def get_records(
+        self,
+        uuid: str,
+        interface: Literal["ogd:resource", "ogd:catalog"] = "ogd:resource",
+        offset: int = 0,
+        limit: int = 10,
+        params: Mapping[str, Any] | None = None,
+    ) -> dict:
+        """
+        Fetch records of a resource or catalog as JSON. With a record cache,
+        ranges it already holds are served from disk and only the part
+        that isn't cached is requested.
+        """
+        endpoint = self.resource if interface == "ogd:resource" else self.catalog
+        if self.record_cache is None:
+            return endpoint(uuid, offset, limit, "json", params).json()
+
+        cached = self.record_cache.get(uuid, params, "json", offset, limit)
+        if cached is not None:
+            return cached
+        start = self.record_cache.missing(uuid, params, "json", offset, limit) or offset
+        response = endpoint(uuid, start, offset + limit - start, "json", params).json()
+        self.record_cache.put(uuid, params, "json", start, response)
+        return self.record_cache.get(uuid, params, "json", offset, limit) or response
+
+    def resources(self, offset = 0, limit = 10, params: Mapping[str, Any] | None = None):
         """Fetch resources"""
         url = self.api_url + "/lists"
-        params["format"] = "json"
-        params["offset"] = offset
-        params["limit"] = limit
+        params = {**(params or {}), "format": "json", "offset": offset, "limit": limit}
         return self._make_request(url, params=params).json()
 
     
-    def resources_by_catalog_nid(self, catalog_nid: int, offset = 0, limit = 10, params=dict()):
+    def resources_by_catalog_nid(self, catalog_nid: int, offset = 0, limit = 10, params: Mapping[str, Any] | None = None):
         """Fetch resources belonging to a catalog using catalog nid"""
         url = self.backend_url + "/dmspublic/v1/resources"
-        params["filters[catalog_reference]"] = catalog_nid
-        params["offset"] = offset
-        params["limit"] = limit
+        params = {
+            **(params or {}),
+            "filters[catalog_reference]": catalog_nid,
+            "offset": offset,
+            "limit": limit,
+        }
         return self._make_request(url, params=params)
     
-    def get_all_resources_by_catalog_nid(self, catalog_nid: int, batch_size=100,  params=dict()):
+    def get_all_resources_by_catalog_nid(self, catalog_nid: int, batch_size=100,  params: Mapping[str, Any] | None = None):
         """Fetch all resources belonging to a catalog using catalog nid"""
         # get the total number of resources
-        initial_resp = self.resources_by_catalog(catalog_nid, limit=1)
-        total_records = initial_resp["total"]
+        initial_resp = self.resources_by_catalog_nid(catalog_nid, 0, 1, params)
+        total_records = initial_resp.json()["total"]
 
         args = [
             (catalog_nid, i, batch_size, params)
             for i in range(0, total_records, batch_size)
         ]
-
-        with Pool(cpu_count()) as pool:
-            responses = pool.starmap(self.resources_by_catalog, args)
-        
-        return responses
+        responses = self._starmap(self.resources_by_catalog_nid, args)
+        return [response.json() for response in responses]
     
     def prep_filtering_params(self, filters=dict()):
         pass
@@ -144,6 +268,13 @@ class DocumentAdapter:
 
     @staticmethod
     def from_catalog(catalog: dict[str, Any]):
+        facets = dict(
+            sector=DocumentAdapter.all_values(catalog, "field_sector:name"),
+            jurisdiction=DocumentAdapter.all_values(catalog, "field_asset_jurisdiction:name"),
+            department=DocumentAdapter.all_values(
+                catalog, "field_ministry_department:name", "field_state_department:name"
+            ),
+        )
         return dict(
             type="dataset",
             url=f"https://data.gov.in{catalog.get('node_alias')[0]}",
@@ -153,5 +284,47 @@ class DocumentAdapter:
             uuid=catalog["uuid"][0],
             nid=catalog["nid"][0],
             vid=catalog["vid"][0],
-            is_api_available=catalog["is_api_available"][0] in {"1", 1}
-        )
\ No newline at end of file
+            is_api_available=catalog["is_api_available"][0] in {"1", 1},
+            # facets for filtering searches, multi-valued ones are joined
+            # for display and flagged per value for filtering
+            govt_type=DocumentAdapter.first_value(
+                catalog, "field_ds_govt_type", DocumentAdapter.first_value(catalog, "govt_type")
+            ),
+            **{field: VALUE_SEPARATOR.join(values) for field, values in facets.items()},
+            **{flag(field, value): True for field, values in facets.items() for value in values},
+        )
+
+    @staticmethod
+    def first_value(catalog: dict[str, Any], key: str, default: str = ""):
+        """First value of a (usually list valued) catalog field"""
+        value = catalog.get(key)
+        if isinstance(value, list):
+            value = value[0] if value else None
+        if value is None:
+            return default
+        # vectorstore metadata only holds scalars
+        return value if isinstance(value, (str, int, float, bool)) else str(value)
+
+    @staticmethod
+    def all_values(catalog: dict[str, Any], *keys: str) -> list[str]:
+        """Distinct values of (usually list valued) catalog fields"""
+        values = list()
+        for key in keys:
+            value = catalog.get(key)
+            for item in value if isinstance(value, list) else [value]:
+                if item not in (None, "") and str(item) not in values:
+                    values.append(str(item))
+        return values
+
+    @staticmethod
+    def to_vectorstore_inputs(catalog: dict[str, Any]):
+        """Prepare a catalog for indexing as a document, its metadata and id"""
+        metadata = DocumentAdapter.from_catalog(catalog)
+        document = metadata.pop("content")
+        if catalog.get("ai_long_text"):
+            document += f"\nAI Summary: {catalog['ai_long_text']}"
+        return dict(
+            id=f"ogd:catalog:{metadata['uuid']}",
+            document=document,
+            metadata=metadata,
+        )
@@ -0,0 +1,307 @@
+"""
+Planning and execution of structured data requests.
+
+A DataRequest (filters, group by, aggregates, limit) is compiled into the
+cheapest form the source understands: a datastore_search_sql query for CKAN
+datastores, which does all the work server side, or `filters[...]`
+parameters for the OGD API, which only filters on (in)equality. Whatever the
+server can't do is done locally over the fetched pages, which OGDProxy
+serves from its record cache when it has one.
+"""
+import json
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Literal
+
+import pandas as pd
+import requests
+from pydantic import BaseModel
+
+from datatalker.ckan import CKANProxy
+from datatalker.ogdp import OGDProxy
+
+if TYPE_CHECKING:
+    from datatalker.engine import DataEngine
+
+
+PAGE_SIZE = 1000 # records per page fetched for local aggregation
+MAX_ROWS = 100_000 # rows fetched at most for local aggregation
+
+SQL_OPERATORS = {"eq": "=", "ne": "<>", "gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+SQL_FUNCTIONS = {"count": "COUNT", "sum": "SUM", "avg": "AVG", "min": "MIN", "max": "MAX"}
+PANDAS_FUNCTIONS = {"count": "count", "sum": "sum", "avg": "mean", "min": "min", "max": "max"}
+
+
+class Filter(BaseModel):
+    field: str
+    op: Literal["eq", "ne", "in", "gt", "gte", "lt", "lte"] = "eq"
+    value: str | float | list[str | float]
+
+
+class Aggregate(BaseModel):
+    function: Literal["count", "sum", "avg", "min", "max"]
+    field: str | None = None # None counts rows
+    alias: str | None = None
+
+    @property
+    def name(self) -> str:
+        return self.alias or f"{self.function}_{self.field or 'rows'}"
+
+
+class DataRequest(BaseModel):
+    dataset_id: str
+    # "local" queries a dataset registered in a DataEngine by name
+    interface: Literal["ckan:datastore", "ogd:resource", "ogd:catalog", "local"]
+    filters: list[Filter] = []
+    group_by: list[str] = []
+    aggregates: list[Aggregate] = []
+    order_by: list[str] = [] # fields, or aggregate names, prefixed with "-" for descending
+    limit: int = 100
+
+
+@dataclass
+class QueryPlan:
+    """How a request is run: what the server does and what is left to do locally"""
+    request: DataRequest
+    sql: str | None = None
+    params: dict[str, Any] = field(default_factory=dict)
+    local_filters: list[Filter] = field(default_factory=list)
+    aggregate_locally: bool = False
+
+
+def quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def quote_literal(value: str | float) -> str:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return repr(int(value)) if float(value).is_integer() else repr(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def compile_sql(request: DataRequest) -> str:
+    """PostgreSQL for CKAN's datastore_search_sql, where the table is the resource id"""
+    columns = [quote_identifier(name) for name in request.group_by]
+    for agg in request.aggregates:
+        # datastore columns are often text, numeric functions need a cast
+        target = "*" if agg.field is None else quote_identifier(agg.field)
+        if agg.field is not None and agg.function in {"sum", "avg"}:
+            target += "::numeric"
+        columns.append(f"{SQL_FUNCTIONS[agg.function]}({target}) AS {quote_identifier(agg.name)}")
+    # group by fields without aggregates ask for their distinct values
+    select = "SELECT DISTINCT" if request.group_by and not request.aggregates else "SELECT"
+    sql = f"{select} {', '.join(columns) or '*'} FROM {quote_identifier(request.dataset_id)}"
+
+    conditions = list()
+    for f in request.filters:
+        if f.op == "in":
+            values = f.value if isinstance(f.value, list) else [f.value]
+            conditions.append(f"{quote_identifier(f.field)} IN ({', '.join(map(quote_literal, values))})")
+        else:
+            conditions.append(f"{quote_identifier(f.field)} {SQL_OPERATORS[f.op]} {quote_literal(f.value)}")
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    if request.group_by and request.aggregates:
+        sql += " GROUP BY " + ", ".join(quote_identifier(name) for name in request.group_by)
+    if request.order_by:
+        sql += " ORDER BY " + ", ".join(
+            quote_identifier(name.removeprefix("-")) + (" DESC" if name.startswith("-") else "")
+            for name in request.order_by
+        )
+    return sql + f" LIMIT {int(request.limit)}"
+
+
+def compile_ogd_params(request: DataRequest) -> tuple[dict[str, Any], list[Filter]]:
+    """OGD API parameters for the filters it supports, and the filters left over"""
+    params, remaining = dict(), list()
+    for f in request.filters:
+        if f.op in {"eq", "ne"} and not isinstance(f.value, list):
+            name = f"{'filters' if f.op == 'eq' else 'notfilters'}[{f.field}]"
+            if name not in params:
+                params[name] = f.value
+                continue
+        remaining.append(f)
+    if not request.aggregates:
+        for name in request.order_by[:1]:
+            params[f"sort[{name.removeprefix('-')}]"] = "desc" if name.startswith("-") else "asc"
+    return params, remaining
+
+
+def plan(request: DataRequest) -> QueryPlan:
+    """Decide what runs on the server for a request"""
+    if request.interface == "ckan:datastore":
+        return QueryPlan(request, sql=compile_sql(request))
+    params, remaining = compile_ogd_params(request)
+    return QueryPlan(
+        request,
+        params=params,
+        local_filters=remaining,
+        aggregate_locally=bool(request.aggregates or request.group_by or remaining),
+    )
+
+
+def apply_locally(frame: pd.DataFrame, request: DataRequest, filters: list[Filter]) -> pd.DataFrame:
+    """Filter, aggregate, order and limit fetched records the way the server would have"""
+    if frame.empty:
+        # no records come without columns, the requested ones are empty instead
+        aggregated = {agg.name for agg in request.aggregates}
+        requested = [
+            *(f.field for f in filters),
+            *request.group_by,
+            *(agg.field for agg in request.aggregates if agg.field is not None),
+            *(name.removeprefix("-") for name in request.order_by if name.removeprefix("-") not in aggregated),
+        ]
+        frame = frame.reindex(columns=list(dict.fromkeys([*frame.columns, *requested])))
+
+    for f in filters:
+        column = frame[f.field]
+        values = f.value if isinstance(f.value, list) else [f.value]
+        if any(isinstance(value, (int, float)) for value in values):
+            column = pd.to_numeric(column, errors="coerce")
+        else:
+            column = column.astype(str)
+        mask = {
+            "eq": lambda: column == values[0],
+            "ne": lambda: column != values[0],
+            "in": lambda: column.isin(values),
+            "gt": lambda: column > values[0],
+            "gte": lambda: column >= values[0],
+            "lt": lambda: column < values[0],
+            "lte": lambda: column <= values[0],
+        }[f.op]()
+        frame = frame[mask]
+
+    if request.aggregates:
+        numeric = {
+            agg.field for agg in request.aggregates
+            if agg.field is not None and agg.function != "count"
+        }
+        # rows are counted over a column that is never null
+        frame = frame.assign(_row=1, **{
+            name: pd.to_numeric(frame[name], errors="coerce") for name in numeric
+        })
+        aggregations = {
+            agg.name: (agg.field or "_row", PANDAS_FUNCTIONS[agg.function])
+            for agg in request.aggregates
+        }
+        if request.group_by:
+            frame = frame.groupby(request.group_by, dropna=False).agg(**aggregations).reset_index()
+        else:
+            frame = pd.DataFrame([{
+                name: frame[column].agg(function) for name, (column, function) in aggregations.items()
+            }])
+    elif request.group_by:
+        frame = frame[request.group_by].drop_duplicates()
+
+    if request.order_by:
+        frame = frame.sort_values(
+            [name.removeprefix("-") for name in request.order_by],
+            ascending=[not name.startswith("-") for name in request.order_by],
+        )
+    return frame.head(request.limit).reset_index(drop=True)
+
+
+def mark_partial(result: pd.DataFrame, request: DataRequest, fetched: int, total: int) -> pd.DataFrame:
+    """
+    Flag a result computed from only some of the matching rows, the
+    `partial`, `rows_used` and `rows_total` attrs tell how many were left out
+    """
+    result.attrs["partial"] = total > fetched
+    result.attrs["rows_used"] = fetched
+    result.attrs["rows_total"] = max(total, fetched)
+    if result.attrs["partial"]:
+        print(f"Aggregated the first {fetched} of {total} rows of {request.dataset_id}.")
+    return result
+
+
+def partial_note(result: pd.DataFrame) -> str | None:
+    """A note telling the user that a result only covers part of the data"""
+    if not result.attrs.get("partial"):
+        return None
+    return (
+        f"Only the first {result.attrs['rows_used']} of {result.attrs['rows_total']} "
+        "matching rows were used, the result may be incomplete."
+    )
+
+
+class QueryPlanner:
+    """Run data requests against CKAN datastores and the OGD API"""
+
+    def __init__(
+        self,
+        ckan: CKANProxy | None = None,
+        ogd: OGDProxy | None = None,
+        max_rows: int = MAX_ROWS,
+        engine: "DataEngine | None" = None,
+    ):
+        """
+        Parameters
+        ----------
+        ckan, ogd : optional
+            Proxies of the sources requests may target.
+        max_rows : int, optional
+            Rows fetched at most when aggregating locally, results of capped
+            fetches are flagged by `mark_partial`.
+        engine : DataEngine, optional
+            Engine holding the datasets of "local" requests.
+        """
+        self.ckan = ckan
+        self.ogd = ogd
+        self.max_rows = max_rows
+        self.engine = engine
+
+    def run(self, request: DataRequest) -> pd.DataFrame:
+        """The result of a request, pushing as much of it as possible to the server"""
+        source = {"ckan:datastore": self.ckan, "local": self.engine}.get(request.interface, self.ogd)
+        if source is None:
+            raise ValueError(f"The planner has no source for {request.interface} requests")
+        if request.interface == "local":
+            return self.engine.query(request).to_pandas()
+        query_plan = plan(request)
+        if query_plan.sql is not None:
+            try:
+                return pd.DataFrame(self.ckan.datastore_search_sql(query_plan.sql)["records"])
+            except requests.exceptions.HTTPError as e:
+                # e.g. SQL search disabled on the instance, or a column that won't cast
+                print(f"datastore_search_sql failed, aggregating locally: {e}")
+                return self.run_ckan_locally(request)
+        return self.run_ogd(query_plan)
+
+    def run_ckan_locally(self, request: DataRequest) -> pd.DataFrame:
+        equal = {f.field: f.value for f in request.filters if f.op == "eq"}
+        remaining = [f for f in request.filters if f.op != "eq"]
+        params = {"filters": json.dumps(equal)} if equal else dict()
+        records, offset, total = list(), 0, 0
+        while offset < self.max_rows:
+            page = self.ckan.datastore_search(
+                request.dataset_id, {**params, "limit": PAGE_SIZE, "offset": offset}
+            )
+            records.extend(page["records"])
+            offset += len(page["records"])
+            total = page.get("total", 0)
+            if not page["records"] or offset >= total:
+                break
+        result = apply_locally(pd.DataFrame(records), request, remaining)
+        return mark_partial(result, request, len(records), total)
+
+    def run_ogd(self, query_plan: QueryPlan) -> pd.DataFrame:
+        request = query_plan.request
+        if not query_plan.aggregate_locally:
+            response = self.ogd.get_records(
+                request.dataset_id, request.interface, limit=request.limit, params=query_plan.params
+            )
+            return pd.DataFrame(response.get("records") or [])
+
+        # only the server filtered rows cross the wire, pages come from the record cache when cached
+        records, offset, total = list(), 0, None
+        while offset < self.max_rows and (total is None or offset < total):
+            response = self.ogd.get_records(
+                request.dataset_id, request.interface, offset, PAGE_SIZE, query_plan.params
+            )
+            page = response.get("records") or []
+            records.extend(page)
+            total = int(response.get("total", 0))
+            offset += len(page)
+            if not page:
+                break
+        result = apply_locally(pd.DataFrame(records), request, query_plan.local_filters)
+        return mark_partial(result, request, len(records), total or 0)
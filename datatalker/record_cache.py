@@ -0,0 +1,222 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Mapping
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from datatalker.config import CACHE_DIR
+
+
+RECORD_CACHE_DIR = (Path(CACHE_DIR) / "records").as_posix()
+RECORD_TTL = 24 * 60 * 60 # a day, in seconds
+
+
+def records_to_table(records: list[dict[str, Any]]) -> pa.Table:
+    """Arrow table of API records, columns with mixed types are kept as strings"""
+    try:
+        return pa.Table.from_pylist(records)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        columns = dict.fromkeys(key for record in records for key in record)
+        return pa.Table.from_pylist(
+            [
+                {key: None if record.get(key) is None else str(record[key]) for key in columns}
+                for record in records
+            ],
+            schema=pa.schema([(key, pa.string()) for key in columns]),
+        )
+
+
+class RecordCache:
+    """
+    Disk cache of dataset records fetched page by page.
+
+    Pages are stored as Parquet files under a key made of the dataset uuid,
+    the filters and the format. A read is served when the cached pages,
+    possibly several and overlapping, cover the requested range. An SQLite
+    index tracks page sizes and access times for TTL expiry and LRU eviction.
+    """
+
+    def __init__(
+        self,
+        root: str = RECORD_CACHE_DIR,
+        ttl: float | None = RECORD_TTL,
+        max_bytes: int = 1 << 30,
+    ):
+        """
+        Parameters
+        ----------
+        root : str
+            Directory holding the Parquet pages and their index.
+        ttl : float, optional
+            Seconds a page stays valid. None keeps pages until evicted.
+        max_bytes : int, optional
+            Least recently used pages are evicted beyond this many bytes on disk.
+        """
+        self.root = Path(root)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self._db = None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            self.root.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(self.root / "index.sqlite3", check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                "key TEXT, start INTEGER, count INTEGER, path TEXT PRIMARY KEY, "
+                "bytes INTEGER, created_at REAL, accessed_at REAL)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS datasets ("
+                "key TEXT PRIMARY KEY, total INTEGER, meta TEXT, created_at REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS pages_key ON pages (key, start)")
+        return self._db
+
+    @staticmethod
+    def key(uuid: str, filters: Mapping[str, Any] | None = None, format: str = "json") -> str:
+        filters = json.dumps(dict(filters or {}), sort_keys=True, default=str)
+        return hashlib.sha256("\0".join([uuid, filters, format]).encode()).hexdigest()
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl is not None and now - created_at > self.ttl
+
+    def _drop(self, paths: list[str]):
+        for path in paths:
+            Path(path).unlink(missing_ok=True)
+        self.db.executemany("DELETE FROM pages WHERE path = ?", [(path,) for path in paths])
+
+    def _cover(self, key: str, start: int, stop: int, now: float) -> tuple[list[tuple], int]:
+        """Pages covering [start, stop) in order, and where the coverage ends"""
+        rows = self.db.execute(
+            "SELECT start, count, path, created_at FROM pages WHERE key = ? ORDER BY start",
+            (key,),
+        ).fetchall()
+        expired = {path for _, _, path, created_at in rows if self._expired(created_at, now)}
+        if expired:
+            self._drop(list(expired))
+        pages = [row[:3] for row in rows if row[2] not in expired]
+
+        cover, position = list(), start
+        while position < stop:
+            # the page reaching furthest among those containing position
+            candidates = [page for page in pages if page[0] <= position < page[0] + page[1]]
+            if not candidates:
+                break
+            page = max(candidates, key=lambda page: page[0] + page[1])
+            cover.append(page)
+            position = page[0] + page[1]
+        return cover, position
+
+    def missing(self, uuid: str, filters=None, format: str = "json", offset: int = 0, limit: int = 10) -> int | None:
+        """First offset of the range that isn't cached, None when it all is"""
+        key = self.key(uuid, filters, format)
+        with self.lock:
+            dataset = self.db.execute("SELECT total FROM datasets WHERE key = ?", (key,)).fetchone()
+            stop = offset + limit if dataset is None else min(offset + limit, dataset[0])
+            _, position = self._cover(key, offset, stop, time.time())
+        return position if position < stop else None
+
+    def get(self, uuid: str, filters=None, format: str = "json", offset: int = 0, limit: int = 10) -> dict | None:
+        """
+        Cached records as an API-like response (metadata, total and records),
+        None unless the whole range is cached.
+        """
+        key = self.key(uuid, filters, format)
+        now = time.time()
+        with self.lock:
+            dataset = self.db.execute(
+                "SELECT total, meta, created_at FROM datasets WHERE key = ?", (key,)
+            ).fetchone()
+            if dataset is None or self._expired(dataset[2], now):
+                self.misses += 1
+                return None
+            total, meta, _ = dataset
+            stop = min(offset + limit, total)
+            cover, position = self._cover(key, offset, stop, now)
+            if position < stop:
+                self.misses += 1
+                return None
+            self.db.executemany(
+                "UPDATE pages SET accessed_at = ? WHERE path = ?",
+                [(now, path) for _, _, path in cover],
+            )
+            self.db.commit()
+            self.hits += 1
+
+        try:
+            records = self._stitch(cover, offset, stop)
+        except FileNotFoundError:
+            # evicted by another thread in the meantime
+            return None
+        return dict(json.loads(meta), total=total, offset=offset, limit=limit, count=len(records), records=records)
+
+    def _stitch(self, cover: list[tuple], start: int, stop: int) -> list[dict]:
+        """Records of [start, stop) from the covering pages, skipping rows where pages overlap"""
+        records, position = list(), start
+        for page_start, count, path in cover:
+            table = pq.read_table(path)
+            table = table.slice(position - page_start, min(stop, page_start + count) - position)
+            records.extend(table.to_pylist())
+            position = min(stop, page_start + count)
+        return records
+
+    def put(self, uuid: str, filters=None, format: str = "json", offset: int = 0, response: dict | None = None):
+        """Store a page of an API response holding `records` and `total`"""
+        records = response.get("records") or list()
+        key = self.key(uuid, filters, format)
+        meta = {
+            name: value for name, value in response.items()
+            if name not in {"records", "total", "offset", "limit", "count"}
+        }
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO datasets VALUES (?, ?, ?, ?)",
+                (key, int(response.get("total", offset + len(records))), json.dumps(meta, default=str), now),
+            )
+            if records:
+                path = self.root / key[:2] / f"{key}-{offset}-{len(records)}.parquet"
+                path.parent.mkdir(parents=True, exist_ok=True)
+                pq.write_table(records_to_table(records), path)
+                self.db.execute(
+                    "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, offset, len(records), path.as_posix(), path.stat().st_size, now, now),
+                )
+            self._evict()
+            self.db.commit()
+
+    def _evict(self):
+        (size,) = self.db.execute("SELECT COALESCE(SUM(bytes), 0) FROM pages").fetchone()
+        if size <= self.max_bytes:
+            return
+        evicted = list()
+        for path, nbytes in self.db.execute("SELECT path, bytes FROM pages ORDER BY accessed_at"):
+            evicted.append(path)
+            size -= nbytes
+            if size <= self.max_bytes:
+                break
+        self._drop(evicted)
+
+    def stats(self) -> dict:
+        with self.lock:
+            pages, size = self.db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM pages"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            hit_rate=self.hits / lookups if lookups else 0.0,
+            pages=pages,
+            bytes=size,
+        )
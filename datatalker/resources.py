@@ -1,11 +1,75 @@
-from datatalker.vectorstore import get_retriever
-from dspy.retrieve.chromadb_rm import ChromadbRM
+from datatalker.vectorstore import get_hybrid_retriever, embed, iter_metadatas
 from datatalker.types import Message, Thought, MessageRole, ResponseType, Resource
+from datatalker.config import LOG_VERDICTS, VERDICT_LOG, GATING_THRESHOLDS
+from datatalker.verdict_cache import VerdictCache
+from datatalker.semantic_cache import SemanticCache
+from datatalker.facets import FacetExtractor
+from datatalker.retrieval import retrieve_many
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from pathlib import Path
+from typing import TYPE_CHECKING
+import json
+import threading
+import time
 import dspy
+from dspy.dsp.utils import dotdict
+
+if TYPE_CHECKING:
+    # chromadb is slow to import, retrievers are created by vectorstore
+    from dspy.retrieve.chromadb_rm import ChromadbRM
 
 
 TOPK_DOCS_TO_RETRIEVE = 7
-RETRIEVER = get_retriever(collection_name="datasets_bge-m3")
+JUDGE_MAX_WORKERS = 4 # set to 1 to judge documents sequentially
+JUDGE_TIMEOUT = 60 # seconds a single relevance judgement may take
+VERDICT_CACHE = VerdictCache()
+SEMANTIC_CACHE = SemanticCache(embed)
+
+_RETRIEVER = None
+_FACET_EXTRACTOR = None
+_LOCK = threading.Lock()
+
+
+def get_default_retriever():
+    """Hybrid retriever over the datasets collection, opened on first use"""
+    global _RETRIEVER
+    with _LOCK:
+        if _RETRIEVER is None:
+            _RETRIEVER = get_hybrid_retriever(collection_name="datasets_bge-m3")
+    return _RETRIEVER
+
+
+def get_default_facet_extractor() -> FacetExtractor:
+    """Facet extractor using the metadata vocabulary of the default retriever"""
+    global _FACET_EXTRACTOR
+    retriever = get_default_retriever()
+    with _LOCK:
+        if _FACET_EXTRACTOR is None:
+            _FACET_EXTRACTOR = FacetExtractor.from_metadatas(iter_metadatas(retriever.retriever))
+    return _FACET_EXTRACTOR
+
+
+def warmup(query: str = "agriculture in Punjab") -> dict[str, float]:
+    """
+    Pay the start-up costs before serving traffic: opens the collection,
+    loads the BM25 and HNSW indexes and makes one embedding call.
+    Returns the seconds spent on each step.
+    """
+    timings = dict()
+    start = time.perf_counter()
+    retriever = get_default_retriever()
+    timings["open_retriever"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    embed([query])
+    timings["embed"] = time.perf_counter() - start
+
+    # the first query loads the HNSW index into memory
+    start = time.perf_counter()
+    retriever(query, k=1)
+    timings["query"] = time.perf_counter() - start
+    return timings
 
 
 class JudgeDatasetRelevance(dspy.Signature):
@@ -27,26 +91,325 @@ class RelevanceJudge(dspy.Module):
         return self.judge(dataset_description=document, query=query)
 
 
+def similarity(doc) -> float | None:
+    """Cosine similarity of a retrieved document, None when it has no vector score"""
+    distance = doc.get("score")
+    if distance is None:
+        return None
+    # ChromaDB reports squared L2 distances, bge-m3 embeddings are unit length
+    return 1 - distance / 2
+
+
+def load_gating_thresholds(path: str = GATING_THRESHOLDS) -> dict:
+    """Similarity thresholds written by scripts/calibrate_gating.py, if any"""
+    if not path or not Path(path).exists():
+        return dict()
+    with open(path) as f:
+        thresholds = json.load(f)
+    return dict(
+        accept_above=thresholds.get("accept_above"),
+        reject_below=thresholds.get("reject_below"),
+    )
+
+
 class ResourceRetriever(dspy.Module):
-    def __init__(self, retriever: ChromadbRM):
+    def __init__(
+        self,
+        retriever: "ChromadbRM",
+        max_workers: int = JUDGE_MAX_WORKERS,
+        judge_timeout: float | None = JUDGE_TIMEOUT,
+        preserve_order: bool = False,
+        accept_above: float | None = None,
+        reject_below: float | None = None,
+        verdict_log: str | None = VERDICT_LOG if LOG_VERDICTS else None,
+        verdict_cache: VerdictCache | None = VERDICT_CACHE,
+        facet_extractor: FacetExtractor | None = None,
+    ):
+        """
+        Retrieves similar documents and keeps the ones an LLM judges as relevant.
+        Parameters
+        ----------
+        retriever : ChromadbRM
+            Vectorstore retriever used to fetch candidate documents.
+        max_workers : int, optional
+            Number of relevance judgements to run concurrently.
+            A value of 1 judges the documents one after another.
+        judge_timeout : float, optional
+            Seconds to wait on a single judgement before skipping the document.
+            None waits indefinitely.
+        preserve_order : bool, optional
+            Stream verdicts in the retriever's rank order instead of the order
+            in which they complete.
+        accept_above : float, optional
+            Similarity at or above which a document is accepted without a judge call.
+        reject_below : float, optional
+            Similarity below which a document is dropped without a judge call.
+        verdict_log : str, optional
+            JSONL file recording the similarity and verdict of every judged
+            document, used to calibrate the gating thresholds. Only set by
+            default when LOG_VERDICTS is enabled.
+        verdict_cache : VerdictCache, optional
+            Cache of earlier verdicts, None judges every document afresh.
+        facet_extractor : FacetExtractor, optional
+            Narrows the search to the states, sectors and government types
+            mentioned in the query using metadata filters.
+        """
         self.retriever = retriever
         self.judge_relevance = RelevanceJudge()
+        self.max_workers = max_workers
+        self.judge_timeout = judge_timeout
+        self.preserve_order = preserve_order
+        self.accept_above = accept_above
+        self.reject_below = reject_below
+        self.verdict_log = verdict_log
+        self.verdict_cache = verdict_cache
+        self.facet_extractor = facet_extractor
+        # documents whose judgement timed out or failed, results are partial then
+        self.unjudged = 0
 
     def forward(self, query: str, k: int = TOPK_DOCS_TO_RETRIEVE):
-        docs = self.retriever(query, k=k)
+        where = self.facet_extractor.where(query) if self.facet_extractor else None
+        if where is None:
+            docs = self.retriever(query, k=k)
+        else:
+            yield Thought(f"Narrowing the search using the filters {where}")
+            docs = self.retriever(query, k=k, where=where)
+            if not docs:
+                # facets may be missing from documents indexed before they existed
+                yield Thought("No documents matched the filters, searching all documents")
+                docs = self.retriever(query, k=k)
 
         yield Thought(f"Found {len(docs)} similar documents for query '{query}'")
+        yield from self.judge_documents([(doc, query) for doc in docs])
 
-        for doc in docs:
-            grade = self.judge_relevance(document=doc.long_text, query=query)
-            yield Thought(
-                f"Judged resource '{doc['metadatas']['title']}' as '{'relevant' if grade.is_relevant else 'irrelevant'}'"
-            )
-            if grade.is_relevant:
-                doc["relevance_rationale"] = grade.how
+    def forward_many(self, queries: list[str], k: int = TOPK_DOCS_TO_RETRIEVE) -> list[list]:
+        """
+        Relevant documents for each of several queries.
+        Queries are embedded and searched in batches. Each document is judged
+        against each query that retrieved it, repeated queries are judged once.
+        """
+        # queries sharing a facet filter can share one batched search
+        groups = dict()
+        for i, query in enumerate(queries):
+            where = self.facet_extractor.where(query) if self.facet_extractor else None
+            groups.setdefault(json.dumps(where, sort_keys=True), (where, list()))[1].append(i)
+
+        candidates = [list() for _ in queries]
+        for where, indices in groups.values():
+            batch = retrieve_many(self.retriever, [queries[i] for i in indices], k=k, where=where)
+            for i, docs in zip(indices, batch):
+                if where is not None and not docs:
+                    docs = self.retriever(queries[i], k=k)
+                candidates[i] = docs
+
+        # a copy per pair, the rationale and similarity are those of its query
+        pairs = dict()
+        for query, docs in zip(queries, candidates):
+            for doc in docs:
+                pairs.setdefault((doc.id, query), (dotdict(doc), query))
+        keys = {id(doc): key for key, (doc, _) in pairs.items()}
+
+        relevant = dict()
+        for msg in self.judge_documents(list(pairs.values())):
+            if msg.type == ResponseType.OBJECT:
+                relevant[keys[id(msg.content)]] = msg.content
+        return [
+            [relevant[doc.id, query] for doc in docs if (doc.id, query) in relevant]
+            for query, docs in zip(queries, candidates)
+        ]
+
+    def judge_documents(self, candidates: list[tuple]):
+        """Yield thoughts and the relevant documents among (document, query) pairs"""
+        # only the ambiguous middle band of similarities needs an LLM verdict
+        undecided = list()
+        for doc, query in candidates:
+            sim = similarity(doc)
+            if sim is not None and self.accept_above is not None and sim >= self.accept_above:
+                yield Thought(
+                    f"Accepted resource '{doc['metadatas']['title']}' by similarity {sim:.3f}"
+                )
+                doc["relevance_rationale"] = "Closely matches the search query."
+                self.log_verdict(query, doc, True, judged=False)
                 yield Message(
                     role=MessageRole.SYSTEM, type=ResponseType.OBJECT, content=doc
                 )
+            elif sim is not None and self.reject_below is not None and sim < self.reject_below:
+                yield Thought(
+                    f"Dropped resource '{doc['metadatas']['title']}' by similarity {sim:.3f}"
+                )
+                self.log_verdict(query, doc, False, judged=False)
+            else:
+                undecided.append((doc, query))
+
+        # reuse verdicts from earlier searches for the same query and document
+        judge_model = getattr(dspy.settings.get("lm"), "model", None)
+        uncached = list()
+        for doc, query in undecided:
+            cached = self.recall_verdict(query, doc, judge_model)
+            if cached is None:
+                uncached.append((doc, query))
+            else:
+                yield from self.render_verdict(doc, cached)
+
+        if self.max_workers <= 1:
+            verdicts = self.judge_sequentially(uncached)
+        else:
+            verdicts = self.judge_concurrently(uncached)
+
+        for doc, query, grade in verdicts:
+            if isinstance(grade, TimeoutError):
+                self.unjudged += 1
+                yield Thought(
+                    f"Timed out judging resource '{doc['metadatas']['title']}', skipping it"
+                )
+                continue
+            if isinstance(grade, Exception):
+                self.unjudged += 1
+                yield Thought(
+                    f"Failed to judge resource '{doc['metadatas']['title']}' ({grade}), skipping it"
+                )
+                continue
+            self.log_verdict(query, doc, grade.is_relevant)
+            self.remember_verdict(query, doc, grade, judge_model)
+            yield from self.render_verdict(doc, grade)
+
+    def recall_verdict(self, query: str, doc, judge_model: str | None):
+        if self.verdict_cache is None:
+            return None
+        key = VerdictCache.key(query, doc.id, doc.long_text, judge_model)
+        verdict = self.verdict_cache.get(key)
+        return None if verdict is None else dspy.Prediction(**verdict)
+
+    def remember_verdict(self, query: str, doc, grade, judge_model: str | None):
+        if self.verdict_cache is None:
+            return
+        key = VerdictCache.key(query, doc.id, doc.long_text, judge_model)
+        self.verdict_cache.set(key, grade.is_relevant, grade.how)
+
+    def log_verdict(self, query: str, doc, is_relevant: bool, judged: bool = True):
+        """Record a verdict, `judged` is False when similarity gating decided without the judge"""
+        if not self.verdict_log:
+            return
+        record = dict(
+            query=query,
+            id=doc.id,
+            similarity=similarity(doc),
+            is_relevant=bool(is_relevant),
+            judged=judged,
+            timestamp=time.time(),
+        )
+        try:
+            Path(self.verdict_log).parent.mkdir(parents=True, exist_ok=True)
+            with open(self.verdict_log, "a") as f:
+                f.write(json.dumps(record) + "\n")
+        except OSError as e:
+            print(f"resources.log_verdict: {e}")
+
+    def render_verdict(self, doc, grade):
+        yield Thought(
+            f"Judged resource '{doc['metadatas']['title']}' as '{'relevant' if grade.is_relevant else 'irrelevant'}'"
+        )
+        if grade.is_relevant:
+            doc["relevance_rationale"] = grade.how
+            yield Message(
+                role=MessageRole.SYSTEM, type=ResponseType.OBJECT, content=doc
+            )
+
+    def judge_sequentially(self, candidates: list[tuple]):
+        """Yield (doc, query, grade) one judgement at a time, grade is the error when one fails"""
+        config = dspy.settings.config
+        for doc, query in candidates:
+            # a judgement can't be interrupted, an overrunning one is left
+            # behind in its own thread while the next one starts
+            executor = ThreadPoolExecutor(max_workers=1)
+            future = executor.submit(self._judge_in_context, config, doc, query)
+            try:
+                grade = future.result(timeout=self.judge_timeout)
+            except FuturesTimeoutError:
+                grade = TimeoutError(f"no verdict within {self.judge_timeout}s")
+            except Exception as e:
+                print(f"resources.judge: failed to judge document {doc.id}: {e}")
+                grade = e
+            finally:
+                executor.shutdown(wait=False)
+            yield doc, query, grade
+
+    def _judge_in_context(self, config: dict, doc, query: str):
+        # worker threads only see the global dspy config, carry over any
+        # dspy.context overrides active in the calling thread
+        with dspy.context(**config):
+            return self.judge_relevance(document=doc.long_text, query=query)
+
+    def judge_concurrently(self, candidates: list[tuple]):
+        """
+        Yield (doc, query, grade) as the judgements complete, grade is a
+        TimeoutError when one overran its deadline, or the error it failed with
+        """
+        config = dspy.settings.config
+        started = dict()
+
+        def judge(i, doc, query):
+            started[i] = time.monotonic()
+            return self._judge_in_context(config, doc, query)
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            futures = {
+                executor.submit(judge, i, doc, query): i
+                for i, (doc, query) in enumerate(candidates)
+            }
+            pending = set(futures)
+            verdicts = dict()
+            next_to_yield = 0
+            while pending:
+                done, pending = wait(
+                    pending, timeout=self._time_to_next_deadline(started, futures, pending),
+                    return_when=FIRST_COMPLETED
+                )
+                for future in done:
+                    i = futures[future]
+                    try:
+                        verdicts[i] = future.result()
+                    except Exception as e:
+                        print(f"resources.judge: failed to judge document {candidates[i][0].id}: {e}")
+                        verdicts[i] = e
+                # give up on judgements that overran their deadline
+                for future in list(pending):
+                    i = futures[future]
+                    if self._is_overdue(started.get(i)):
+                        future.cancel()
+                        pending.discard(future)
+                        verdicts[i] = TimeoutError(f"no verdict within {self.judge_timeout}s")
+
+                if self.preserve_order:
+                    while next_to_yield in verdicts:
+                        yield *candidates[next_to_yield], verdicts.pop(next_to_yield)
+                        next_to_yield += 1
+                else:
+                    for i in sorted(verdicts):
+                        yield *candidates[i], verdicts[i]
+                    verdicts.clear()
+        finally:
+            # don't block on stragglers, their results are discarded anyway
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _is_overdue(self, started_at: float | None) -> bool:
+        if self.judge_timeout is None or started_at is None:
+            return False
+        return time.monotonic() - started_at >= self.judge_timeout
+
+    def _time_to_next_deadline(self, started, futures, pending) -> float | None:
+        if self.judge_timeout is None:
+            return None
+        deadlines = [
+            started[futures[future]] + self.judge_timeout
+            for future in pending
+            if futures[future] in started
+        ]
+        if not deadlines:
+            # no judgement has started yet, check back shortly
+            return self.judge_timeout
+        return max(0.0, min(deadlines) - time.monotonic())
 
 
 class ContextualSearchQuery(dspy.Signature):
@@ -58,11 +421,135 @@ class ContextualSearchQuery(dspy.Signature):
 
 
 def get_relevant_resources(
-    query: str, k: int = TOPK_DOCS_TO_RETRIEVE, retriever=RETRIEVER
+    query: str,
+    k: int = TOPK_DOCS_TO_RETRIEVE,
+    retriever=None,
+    semantic_cache: SemanticCache | None = SEMANTIC_CACHE,
+    **judge_options
 ):
-    res_retriever = ResourceRetriever(retriever)
+    judge_options = {**load_gating_thresholds(), **judge_options}
+    if retriever is None:
+        retriever = get_default_retriever()
+        judge_options.setdefault("facet_extractor", get_default_facet_extractor())
+
+    # paraphrases only share results when they ask for the same facets,
+    # "fertilizer use in Punjab" must not answer "fertilizer use in Haryana"
+    facet_extractor = judge_options.get("facet_extractor")
+    facets = facet_extractor.extract(query) if facet_extractor else None
+    # nor do searches of another index, or judged by another model or thresholds,
+    # the cache lives in memory so the retriever object identifies the index
+    scope = (
+        k,
+        json.dumps(facets, sort_keys=True),
+        id(retriever),
+        getattr(dspy.settings.get("lm"), "model", None),
+        judge_options.get("accept_above"),
+        judge_options.get("reject_below"),
+    )
+    if semantic_cache is not None:
+        hit = semantic_cache.lookup(query, scope=scope)
+        if hit is not None:
+            return replay_relevant_resources(*hit)
+
+    res_retriever = ResourceRetriever(retriever, **judge_options)
     docs = res_retriever(query, k=k)
-    return docs
+    if semantic_cache is None:
+        return docs
+    return record_relevant_resources(
+        query, scope, docs, semantic_cache, is_complete=lambda: res_retriever.unjudged == 0
+    )
+
+
+def get_relevant_resources_many(
+    queries: list[str],
+    k: int = TOPK_DOCS_TO_RETRIEVE,
+    retriever=None,
+    **judge_options
+) -> list[list[dict]]:
+    """Relevant resources for each query, searched and judged as one batch"""
+    judge_options = {**load_gating_thresholds(), **judge_options}
+    if retriever is None:
+        retriever = get_default_retriever()
+        judge_options.setdefault("facet_extractor", get_default_facet_extractor())
+    res_retriever = ResourceRetriever(retriever, **judge_options)
+    return res_retriever.forward_many(queries, k=k)
+
+
+def search_multi_hop(
+    queries: list[str],
+    k: int = TOPK_DOCS_TO_RETRIEVE,
+    time_budget: float | None = None,
+    enough: int | None = None,
+    **options
+):
+    """
+    Run several sub-queries concurrently, streaming their relevant resources.
+    Each hop is a full search through get_relevant_resources. Resources are
+    deduplicated by id and yielded as each hop finishes. The search stops
+    early once `enough` resources were found or `time_budget` seconds passed.
+    """
+    config = dspy.settings.config
+
+    def hop(query):
+        with dspy.context(**config):
+            return [
+                msg.content
+                for msg in get_relevant_resources(query, k=k, **options)
+                if msg.type == ResponseType.OBJECT
+            ]
+
+    found = dict()
+    executor = ThreadPoolExecutor(max_workers=max(1, len(queries)))
+    try:
+        futures = {executor.submit(hop, query): query for query in queries}
+        for future in as_completed(futures, timeout=time_budget):
+            query = futures[future]
+            try:
+                docs = future.result()
+            except Exception as e:
+                yield Thought(f"Search for '{query}' failed: {e}")
+                continue
+            new_docs = [doc for doc in docs if doc["id"] not in found]
+            yield Thought(
+                f"Search for '{query}' found {len(docs)} relevant resources, {len(new_docs)} new"
+            )
+            for doc in new_docs:
+                found[doc["id"]] = doc
+                yield Message(
+                    role=MessageRole.SYSTEM, type=ResponseType.OBJECT, content=doc
+                )
+            if enough is not None and len(found) >= enough:
+                yield Thought(f"Found {len(found)} relevant resources, stopping the search")
+                break
+    except FuturesTimeoutError:
+        yield Thought(f"Search time budget of {time_budget}s ran out, stopping the search")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def replay_relevant_resources(similar_query: str, docs: list):
+    yield Thought(f"Reusing the results of the similar query '{similar_query}'")
+    for doc in docs:
+        yield Message(
+            role=MessageRole.SYSTEM, type=ResponseType.OBJECT, content=dict(doc)
+        )
+
+
+def record_relevant_resources(
+    query: str, scope, messages, semantic_cache: SemanticCache, is_complete=lambda: True
+):
+    """
+    Pass the messages through, caching the relevant docs once the search
+    completes. A search that is stopped, fails or leaves documents unjudged
+    isn't cached.
+    """
+    docs = list()
+    for msg in messages:
+        if msg.type == ResponseType.OBJECT:
+            docs.append(msg.content)
+        yield msg
+    if is_complete():
+        semantic_cache.store(query, docs, scope=scope)
 
 
 def rework_idp_resource_doc(doc) -> Resource:
@@ -0,0 +1,29 @@
+from dspy.dsp.utils import dotdict
+
+
+def retrieve_many(retriever, queries: list[str], k: int, where: dict | None = None) -> list[list[dotdict]]:
+    """
+    Search several queries at once, returns the documents found for each query.
+    Uses the retriever's batched search when it has one, embedding all queries
+    in a single request, and falls back to one search per query otherwise.
+    """
+    kwargs = {"where": where} if where else {}
+    if hasattr(retriever, "forward_many"):
+        return retriever.forward_many(queries, k=k, **kwargs)
+
+    collection = getattr(retriever, "_chromadb_collection", None)
+    if collection is None:
+        return [retriever(query, k=k, **kwargs) for query in queries]
+
+    # ChromadbRM only returns the results of the first query, query directly
+    embeddings = retriever._get_embeddings(queries)
+    results = collection.query(query_embeddings=embeddings, n_results=k, **kwargs)
+    return [
+        [
+            dotdict({"id": id, "score": dist, "long_text": doc, "metadatas": meta})
+            for id, dist, doc, meta in zip(ids, distances, documents, metadatas)
+        ]
+        for ids, distances, documents, metadatas in zip(
+            results["ids"], results["distances"], results["documents"], results["metadatas"]
+        )
+    ]
@@ -0,0 +1,86 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable
+
+import numpy as np
+
+
+class SemanticCache:
+    """
+    Cache of search results looked up by query meaning rather than wording.
+
+    A lookup embeds the query and returns the results of the closest recently
+    answered query when it lies within `max_distance` cosine distance, so
+    paraphrases such as "fertilizer use Punjab" and "Punjab fertilizer
+    consumption" share one set of results.
+    """
+
+    def __init__(
+        self,
+        embedding_fn: Callable[[list[str]], list],
+        max_distance: float = 0.08,
+        max_entries: int = 256,
+    ):
+        """
+        Parameters
+        ----------
+        embedding_fn : callable
+            Function embedding a list of texts, ideally a CachedEmbeddingFunction.
+        max_distance : float, optional
+            Largest cosine distance between two queries treated as the same search.
+        max_entries : int, optional
+            Least recently used results are evicted beyond this many queries.
+        """
+        self.embedding_fn = embedding_fn
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.entries: OrderedDict[tuple[str, Any], tuple[np.ndarray, Any]] = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def embed(self, query: str) -> np.ndarray:
+        vector = np.asarray(self.embedding_fn([query])[0], dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def lookup(self, query: str, scope: Any = None) -> tuple[str, Any] | None:
+        """
+        The closest cached query and its value, None on a miss.
+        Only entries stored under the same scope (e.g. the number of results) match.
+        """
+        vector = self.embed(query)
+        with self.lock:
+            keys = [key for key in self.entries if key[1] == scope]
+            if keys:
+                matrix = np.stack([self.entries[key][0] for key in keys])
+                distances = 1 - matrix @ vector
+                best = int(np.argmin(distances))
+                if distances[best] <= self.max_distance:
+                    key = keys[best]
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return key[0], self.entries[key][1]
+            self.misses += 1
+        return None
+
+    def store(self, query: str, value: Any, scope: Any = None):
+        vector = self.embed(query)
+        with self.lock:
+            self.entries[(query, scope)] = (vector, value)
+            self.entries.move_to_end((query, scope))
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> dict[str, int | float]:
+        """Hit and miss counters since the cache was created"""
+        lookups = self.hits + self.misses
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            entries=len(self.entries),
+            hit_rate=self.hits / lookups if lookups else 0.0,
+        )
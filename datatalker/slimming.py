@@ -0,0 +1,123 @@
+"""
+Slimming of catalog and resource metadata before it is sent to an LLM.
+
+Only the user-facing fields listed in the schema notes of the summarization
+prompts are kept, long texts and field lists are truncated, and single
+valued lists are unwrapped. Resources of a catalog that only differ by the
+years in them (year-wise splits) share a template key, so that one summary
+can be written per group and filled in for the others.
+"""
+import hashlib
+import json
+import re
+from typing import Any
+
+
+MAX_TEXT = 1500 # characters kept of long descriptions
+MAX_ITEMS = 20 # items kept of lists such as keywords
+MAX_FIELDS = 25 # data fields kept of a resource's schema
+
+# user-facing fields, following the schema notes of scripts/summarize.py
+RESOURCE_FIELDS = [
+    "title", "desc", "sector", "source", "org", "org_type",
+    "active", "visualizable", "external_ws", "external_ws_url",
+    "created_date", "updated_date", "data_fetch_date",
+    "status", "is_public", "public_type",
+    "field", "field_dependent", "primary_field",
+]
+# and of the catalog notes in notebooks/building_documents.ipynb
+CATALOG_FIELDS = [
+    "title", "body:value", "field_search_keywords", "keywords", "field_sector:name",
+    "field_asset_jurisdiction:name", "field_ds_govt_type", "field_group_name:name",
+    "field_ministry_department:name", "field_state_department:name",
+    "data_time_period_from", "data_time_period_to", "frequency",
+    "having_api", "high_value_dataset", "is_api_available", "is_priced", "is_webservice", "from_api",
+    "changed", "created", "published_date", "api_request_count", "view_count",
+]
+# data fields the platform adds to every resource
+INTERNAL_DATA_FIELDS = {"document_id", "resource_uuid"}
+# fields whose values differ across otherwise identical resources
+VOLATILE_FIELDS = {"created_date", "updated_date", "data_fetch_date", "status", "active"}
+# years, and the second year of a span such as 2019-20; other numbers (counts,
+# phases) change what a resource is about and aren't templated
+YEAR = re.compile(r"(?<!\d)(?:(?:19|20)\d{2}|(?<=(?:19|20)\d\d[-/])\d{2})(?!\d)")
+
+
+def truncate(value: Any) -> Any:
+    """Shorten long texts and lists, unwrap single valued lists"""
+    if isinstance(value, str) and len(value) > MAX_TEXT:
+        return value[:MAX_TEXT] + "..."
+    if isinstance(value, list):
+        if len(value) == 1:
+            return truncate(value[0])
+        items = [truncate(item) for item in value[:MAX_ITEMS]]
+        if len(value) > MAX_ITEMS:
+            items.append(f"... and {len(value) - MAX_ITEMS} more")
+        return items
+    return value
+
+
+def slim_fields(fields: list[dict]) -> list[str]:
+    """A resource's data fields as "Name (type)", platform fields left out"""
+    names = [
+        f"{field.get('name') or field.get('id')} ({field.get('type', 'unknown')})"
+        for field in fields
+        if field.get("id") not in INTERNAL_DATA_FIELDS
+    ]
+    if len(names) > MAX_FIELDS:
+        names = names[:MAX_FIELDS] + [f"... and {len(names) - MAX_FIELDS} more"]
+    return names
+
+
+def slim_resource(resource: dict[str, Any]) -> dict[str, Any]:
+    """The user-facing metadata of a resource, for a prompt"""
+    slim = dict()
+    for name in RESOURCE_FIELDS:
+        value = resource.get(name)
+        if value in (None, "", [], {}):
+            continue
+        if name == "field":
+            slim[name] = slim_fields(value)
+        elif name == "external_ws_url" and str(resource.get("external_ws")) != "1":
+            continue
+        else:
+            slim[name] = truncate(value)
+    return slim
+
+
+def slim_catalog(catalog: dict[str, Any]) -> dict[str, Any]:
+    """The user-facing metadata of a catalog, for a prompt"""
+    return {
+        name: truncate(catalog[name])
+        for name in CATALOG_FIELDS
+        if catalog.get(name) not in (None, "", [], {})
+    }
+
+
+def template_key(resource: dict[str, Any], slim: dict[str, Any] | None = None) -> str:
+    """
+    Key shared by the resources of a catalog whose slimmed metadata is the
+    same once years are masked.
+    """
+    slim = slim if slim is not None else slim_resource(resource)
+    structure = {name: value for name, value in slim.items() if name not in VOLATILE_FIELDS}
+    masked = YEAR.sub("#", json.dumps(structure, sort_keys=True, default=str))
+    return hashlib.sha256(f"{resource.get('catalog_uuid')}\0{masked}".encode()).hexdigest()
+
+
+def fill_template(summary: str, source: dict[str, Any], target: dict[str, Any]) -> str:
+    """
+    Adapt the summary of a resource to another of its group, replacing the
+    years in which their titles and descriptions differ.
+    """
+    replacements = dict()
+    for name in ("title", "desc"):
+        source_years = YEAR.findall(str(source.get(name, "")))
+        target_years = YEAR.findall(str(target.get(name, "")))
+        if len(source_years) != len(target_years):
+            continue
+        for old, new in zip(source_years, target_years):
+            if old != new:
+                replacements.setdefault(old, new)
+    # only years of the summary, all at once so that a replaced year isn't replaced again
+    return YEAR.sub(lambda match: replacements.get(match.group(), match.group()), summary)
@@ -0,0 +1,252 @@
+"""
+Bookkeeping for incremental metadata syncs into MongoDB.
+
+Each source (e.g. "ckan_packages") keeps a watermark, the newest modification
+time seen so far, in the `sync_state` collection. Every run records the ids it
+inserted, updated or marked deleted in `sync_changes`, which summarization
+and re-embedding jobs read through get_changes().
+
+Long harvests save their progress in `sync_checkpoints` through Checkpoint,
+so an interrupted run can skip the pages or ids it already stored.
+"""
+from datetime import datetime, timezone
+from typing import Any, Iterable
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DocumentTooLarge
+
+
+SYNC_STATE_COLLECTION = "sync_state"
+SYNC_CHANGES_COLLECTION = "sync_changes"
+SYNC_CHECKPOINTS_COLLECTION = "sync_checkpoints"
+UPSERT_BATCH_SIZE = 500
+CHANGES_PER_RECORD = 10000 # ids per sync_changes document, well below the BSON size limit
+
+
+def get_watermark(db, source: str):
+    """Newest modification time synced from a source, None before the first sync"""
+    state = db[SYNC_STATE_COLLECTION].find_one({"_id": source})
+    return state["watermark"] if state else None
+
+
+def set_watermark(db, source: str, watermark):
+    db[SYNC_STATE_COLLECTION].update_one(
+        {"_id": source},
+        {"$set": {"watermark": watermark, "synced_at": datetime.now(timezone.utc)}},
+        upsert=True,
+    )
+
+
+def write_batch(collection, requests: list, keys: list) -> list:
+    """
+    Bulk write requests without ordering, returns the keys of the ones that
+    failed. A document too large to encode fails the whole batch client side,
+    so the batch is split in halves until the culprits are isolated.
+    """
+    if not requests:
+        # pymongo refuses empty bulk writes
+        return list()
+    try:
+        collection.bulk_write(requests, ordered=False)
+        return list()
+    except BulkWriteError as e:
+        return [keys[error["index"]] for error in e.details["writeErrors"]]
+    except DocumentTooLarge:
+        if len(requests) == 1:
+            return list(keys)
+        # upserts are idempotent, rewriting the half that went through is harmless
+        middle = len(requests) // 2
+        return (
+            write_batch(collection, requests[:middle], keys[:middle])
+            + write_batch(collection, requests[middle:], keys[middle:])
+        )
+
+
+def upsert_documents(
+    collection,
+    documents: Iterable[dict[str, Any]],
+    key: str,
+    key_of=None,
+    failures: list | None = None,
+    seen_at: datetime | None = None,
+) -> list:
+    """
+    Insert or update documents matched on `key`, clearing any deleted mark.
+    Fields added downstream (e.g. summaries) are kept. Returns the keys written,
+    the keys that could not be written are appended to `failures`. `seen_at`
+    is stored with each document for mark_unseen().
+    """
+    key_of = key_of or (lambda doc: doc[key])
+    written, batch, batch_keys = list(), list(), list()
+
+    def flush():
+        failed = write_batch(collection, batch, batch_keys)
+        if failures is not None:
+            failures.extend(failed)
+        failed = set(failed)
+        written.extend(k for k in batch_keys if k not in failed)
+        batch.clear()
+        batch_keys.clear()
+
+    for doc in documents:
+        doc = {field: value for field, value in doc.items() if field != "_id"}
+        if seen_at is not None:
+            doc["seen_at"] = seen_at
+        doc_key = key_of(doc)
+        batch.append(UpdateOne(
+            {key: doc_key},
+            {"$set": doc, "$unset": {"deleted": "", "deleted_at": ""}},
+            upsert=True,
+        ))
+        batch_keys.append(doc_key)
+        if len(batch) >= UPSERT_BATCH_SIZE:
+            flush()
+    if batch:
+        flush()
+    return written
+
+
+def _mark_deleted(collection, key: str, gone: list):
+    for i in range(0, len(gone), UPSERT_BATCH_SIZE):
+        collection.update_many(
+            {key: {"$in": gone[i:i + UPSERT_BATCH_SIZE]}},
+            {"$set": {"deleted": True, "deleted_at": datetime.now(timezone.utc)}},
+        )
+
+
+def mark_deleted(collection, key: str, live_keys: Iterable, key_of=None) -> list:
+    """Mark documents whose key is no longer published upstream as deleted"""
+    key_of = key_of or (lambda doc: doc[key])
+    live_keys = set(live_keys)
+    gone = [
+        key_of(doc) for doc in collection.find({"deleted": {"$ne": True}}, {key: 1})
+        if key in doc and key_of(doc) not in live_keys
+    ]
+    _mark_deleted(collection, key, gone)
+    return gone
+
+
+def mark_unseen(collection, key: str, since: datetime, key_of=None) -> list:
+    """Mark documents not upserted with a `seen_at` after `since` as deleted"""
+    key_of = key_of or (lambda doc: doc[key])
+    query = {
+        "deleted": {"$ne": True},
+        "$or": [{"seen_at": {"$lt": since}}, {"seen_at": {"$exists": False}}],
+    }
+    gone = [key_of(doc) for doc in collection.find(query, {key: 1}) if key in doc]
+    _mark_deleted(collection, key, gone)
+    return gone
+
+
+def record_changes(db, source: str, changed: list, deleted: list | None = None):
+    """Record the ids changed by a sync run (or a part of it) for downstream jobs"""
+    changed, deleted = list(changed), list(deleted or [])
+    synced_at = datetime.now(timezone.utc)
+    for i in range(0, max(len(changed), len(deleted), 1), CHANGES_PER_RECORD):
+        db[SYNC_CHANGES_COLLECTION].insert_one(dict(
+            source=source,
+            synced_at=synced_at,
+            changed=changed[i:i + CHANGES_PER_RECORD],
+            deleted=deleted[i:i + CHANGES_PER_RECORD],
+        ))
+
+
+def get_changes(db, source: str, since: datetime | None = None) -> dict[str, set]:
+    """Ids changed or deleted in a source by the runs after `since`"""
+    query = {"source": source}
+    if since is not None:
+        query["synced_at"] = {"$gt": since}
+    changed, deleted = set(), set()
+    for run in db[SYNC_CHANGES_COLLECTION].find(query).sort([("synced_at", 1), ("_id", 1)]):
+        changed.update(run["changed"])
+        changed.difference_update(run["deleted"])
+        deleted.difference_update(run["changed"])
+        deleted.update(run["deleted"])
+    return dict(changed=changed, deleted=deleted)
+
+
+class Checkpoint:
+    """
+    Progress of a harvest kept in MongoDB, so an interrupted run can resume.
+    Items (page offsets, ids) are marked done once stored, or failed with
+    the error, and a resumed run skips the done ones. Small values such as
+    the run's mode can be kept alongside with get() and set().
+    """
+
+    def __init__(self, db, source: str, resume: bool = False):
+        self.source = source
+        self.items = db[SYNC_CHECKPOINTS_COLLECTION]
+        self.state = db[SYNC_STATE_COLLECTION]
+        self.state_id = f"{source}:checkpoint"
+        if not resume:
+            self.clear()
+
+        state = self.state.find_one({"_id": self.state_id})
+        if state is None:
+            state = dict(_id=self.state_id, started_at=datetime.now(timezone.utc), values=dict())
+            self.state.insert_one(state)
+        self.started_at: datetime = state["started_at"]
+        self.values: dict[str, Any] = state["values"]
+        self.done = {
+            item["item"]
+            for item in self.items.find({"source": source, "status": "done"}, {"item": 1})
+        }
+        if resume and self.done:
+            print(f"Resuming {source}: {len(self.done)} items already done.")
+
+    def get(self, name: str, default=None):
+        return self.values.get(name, default)
+
+    def set(self, name: str, value):
+        self.values[name] = value
+        self.state.update_one({"_id": self.state_id}, {"$set": {f"values.{name}": value}})
+
+    def is_done(self, item) -> bool:
+        return item in self.done
+
+    def pending(self, items: Iterable) -> list:
+        return [item for item in items if item not in self.done]
+
+    def mark_done(self, items: Iterable):
+        items = list(items)
+        for i in range(0, len(items), UPSERT_BATCH_SIZE):
+            self.items.bulk_write([
+                UpdateOne(
+                    {"source": self.source, "item": item},
+                    {"$set": {"status": "done"}, "$unset": {"error": ""}},
+                    upsert=True,
+                )
+                for item in items[i:i + UPSERT_BATCH_SIZE]
+            ], ordered=False)
+        self.done.update(items)
+
+    def mark_failed(self, item, error):
+        self.items.update_one(
+            {"source": self.source, "item": item},
+            {"$set": {"status": "failed", "error": str(error)}},
+            upsert=True,
+        )
+
+    def failed(self) -> dict:
+        """Items that failed and haven't been done since, with their error"""
+        return {
+            item["item"]: item.get("error")
+            for item in self.items.find({"source": self.source, "status": "failed"})
+        }
+
+    def clear(self):
+        self.items.delete_many({"source": self.source})
+        self.state.delete_one({"_id": self.state_id})
+        self.done = set()
+
+    def finish(self) -> dict:
+        """
+        End the run, the checkpoint is only kept when items failed so that
+        resuming retries just those. Returns the failed items.
+        """
+        failed = self.failed()
+        if failed:
+            print(f"{len(failed)} {self.source} items failed, rerun with --resume to retry them.")
+        else:
+            self.clear()
+        return failed
@@ -0,0 +1,128 @@
+import threading
+import time
+
+import requests
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Retry network failures, rate limiting and server errors, not 4xx answers"""
+    if isinstance(exc, requests.exceptions.HTTPError) and exc.response is not None:
+        return is_throttled(exc.response)
+    return isinstance(exc, requests.exceptions.RequestException)
+
+
+def is_throttled(response: requests.Response) -> bool:
+    """Whether the server is asking us to slow down"""
+    return response.status_code == 429 or response.status_code >= 500
+
+
+def retry_after(response: requests.Response) -> float | None:
+    """Seconds to wait according to a Retry-After header, if it holds a number"""
+    try:
+        return float(response.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket limiting how often an action may happen.
+
+    Tokens refill at `rate` per second up to `capacity`, and each call to
+    acquire() takes one, waiting for a refill when the bucket is empty.
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        # updated_at may lie in the future while paused
+        if now > self.updated_at:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+
+    def acquire(self, tokens: float = 1.0):
+        """Block until `tokens` are available and take them"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = max(0.0, self.updated_at - now) + (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveTokenBucket(TokenBucket):
+    """
+    Token bucket that adapts its rate to the server: the rate is cut by
+    `backoff` whenever a request is throttled and grows by `increase` per
+    successful request, up to `max_rate`. Keeps throughput counters.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        min_rate: float = 0.1,
+        max_rate: float | None = None,
+        increase: float = 0.05,
+        backoff: float = 0.5,
+        capacity: float | None = None,
+    ):
+        super().__init__(rate, capacity)
+        self.min_rate = min_rate
+        self.max_rate = max_rate or rate
+        self.increase = increase
+        self.backoff = backoff
+        self.started_at = time.monotonic()
+        self.requests = 0
+        self.successes = 0
+        self.throttled = 0
+        self.failures = 0
+        self.paused = 0.0
+
+    def acquire(self, tokens: float = 1.0):
+        super().acquire(tokens)
+        with self.lock:
+            self.requests += 1
+
+    def on_success(self):
+        with self.lock:
+            self.successes += 1
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self, pause: float | None = None):
+        """Slow down, and stop sending requests for `pause` seconds if given"""
+        with self.lock:
+            self.throttled += 1
+            self.rate = max(self.min_rate, self.rate * self.backoff)
+            # drop the saved up burst
+            self.tokens = 0.0
+            if pause:
+                now = time.monotonic()
+                self.paused += max(0.0, now + pause - max(now, self.updated_at))
+                self.updated_at = max(self.updated_at, now + pause)
+
+    def on_failure(self):
+        with self.lock:
+            self.failures += 1
+
+    def stats(self) -> dict:
+        """Request counters, the current rate and the achieved throughput"""
+        with self.lock:
+            elapsed = time.monotonic() - self.started_at
+            return dict(
+                requests=self.requests,
+                successes=self.successes,
+                throttled=self.throttled,
+                failures=self.failures,
+                rate=round(self.rate, 3),
+                paused_seconds=round(self.paused, 1),
+                elapsed_seconds=round(elapsed, 1),
+                throughput=round(self.successes / elapsed, 3) if elapsed else 0.0,
+            )
@@ -56,7 +56,7 @@ class Message:
         }
 
 
-Thought = lambda content: Message(role=MessageRole.THOUGHT, content=content)
+Thought = lambda content: Message(role=MessageRole.THOUGHT, type=ResponseType.TEXT, content=content)
 
 @dataclass
 class Context:
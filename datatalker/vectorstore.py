@@ -1,27 +1,130 @@
 import dspy
-from dspy.retrieve.chromadb_rm import ChromadbRM
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterator
 # from chromadb.utils import embedding_functions
-from datatalker.config import CHROMADB_DIR
-from chromadb.utils.embedding_functions.ollama_embedding_function import (
-    OllamaEmbeddingFunction
-)
+from datatalker.config import CHROMADB_DIR, RETRIEVER_BACKEND
+from datatalker.lexical import BM25Index, HybridRetriever, chroma_lookup, read_chroma
+from datatalker.flat_index import FlatIndex, FlatRetriever
+from datatalker.embedding import CachedEmbeddingFunction
 
 
-ollama_ef = OllamaEmbeddingFunction(
-    url="http://localhost:11434",
-    model_name="bge-m3"
-)
+_EMBEDDING_FN: CachedEmbeddingFunction | None = None
+_LOCK = threading.Lock()
+
+
+def get_embedding_function() -> CachedEmbeddingFunction:
+    """Cached bge-m3 embedding function, created on first use"""
+    global _EMBEDDING_FN
+    with _LOCK:
+        if _EMBEDDING_FN is None:
+            # chromadb is slow to import, only pay for it when embedding
+            from chromadb.utils.embedding_functions.ollama_embedding_function import (
+                OllamaEmbeddingFunction
+            )
+            ollama_ef = OllamaEmbeddingFunction(
+                url="http://localhost:11434",
+                model_name="bge-m3"
+            )
+            _EMBEDDING_FN = CachedEmbeddingFunction(ollama_ef, model_name="bge-m3")
+    return _EMBEDDING_FN
+
+
+def embed(texts: list[str]) -> list:
+    """Embed texts with the default embedding function"""
+    return get_embedding_function()(texts)
 
 
 def get_retriever(
     collection_name = "datasets_bge-m3",
     db_path = CHROMADB_DIR,
-    embedding_fn = ollama_ef
+    embedding_fn = None
 ):
-    embedder = dspy.Embedder(embedding_fn)
+    from dspy.retrieve.chromadb_rm import ChromadbRM
+
+    embedder = dspy.Embedder(embedding_fn or get_embedding_function(), caching=False)
     retriever = ChromadbRM(
         collection_name,
         db_path,
         embedding_function=embedder,
     )
     return retriever
+
+
+def get_flat_retriever(
+    collection_name = "datasets_bge-m3",
+    db_path = CHROMADB_DIR,
+    embedding_fn = None,
+    n_probe = 8,
+):
+    """Retriever over the memory-mapped index exported from a collection"""
+    index = FlatIndex(Path(db_path) / f"{collection_name}.flat")
+    return FlatRetriever(index, embedding_fn or get_embedding_function(), n_probe=n_probe)
+
+
+def collection_stamp_path(collection_name: str, db_path=CHROMADB_DIR) -> Path:
+    return Path(db_path) / f"{collection_name}.version"
+
+
+def mark_collection_updated(collection_name: str, db_path=CHROMADB_DIR):
+    """Record that a collection's documents changed, called by the ingest scripts"""
+    path = collection_stamp_path(collection_name, db_path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(datetime.now(timezone.utc).isoformat())
+
+
+def collection_version(collection_name: str, db_path=CHROMADB_DIR, retriever=None) -> dict:
+    """Cheap staleness marker of a collection: its size and the last ingest stamp"""
+    if isinstance(retriever, FlatRetriever):
+        return dict(count=len(retriever.index), updated_at=retriever.index.built_at)
+    stamp = collection_stamp_path(collection_name, db_path)
+    return dict(
+        count=retriever._chromadb_collection.count(),
+        updated_at=stamp.read_text().strip() if stamp.exists() else None,
+    )
+
+
+def iter_metadatas(retriever, batch_size: int = 1000) -> Iterator[dict]:
+    """Metadata of every document behind a flat or ChromaDB retriever"""
+    if isinstance(retriever, FlatRetriever):
+        yield from retriever.index.metadatas
+        return
+    collection = retriever._chromadb_collection
+    for offset in range(0, collection.count(), batch_size):
+        yield from collection.get(offset=offset, limit=batch_size, include=["metadatas"])["metadatas"]
+
+
+def get_hybrid_retriever(
+    collection_name = "datasets_bge-m3",
+    db_path = CHROMADB_DIR,
+    embedding_fn = None,
+    index_path = None,
+    backend = RETRIEVER_BACKEND,
+):
+    """Vector retriever fused with a BM25 index over the same collection"""
+    if backend == "flat":
+        retriever = get_flat_retriever(collection_name, db_path, embedding_fn)
+        lookup = retriever.index.get
+    else:
+        retriever = get_retriever(collection_name, db_path, embedding_fn)
+        lookup = chroma_lookup(retriever._chromadb_collection)
+
+    # rebuild the persisted index only when the collection has changed since
+    version = collection_version(collection_name, db_path, retriever)
+    index_path = index_path or Path(db_path) / f"{collection_name}.bm25.json.gz"
+    index = None
+    if Path(index_path).exists():
+        index, extra = BM25Index.load(index_path)
+        if extra.get("version") != version:
+            index = None
+    if index is None:
+        if backend == "flat":
+            ids, documents = retriever.index.ids, retriever.index.documents
+        else:
+            ids, documents = read_chroma(retriever._chromadb_collection)
+        index = BM25Index()
+        index.add(ids, documents)
+        index.save(index_path, version=version)
+
+    return HybridRetriever(retriever, index, lookup)
@@ -0,0 +1,117 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from datatalker.config import CACHE_DIR
+from datatalker.embedding import normalize_text
+
+
+VERDICT_CACHE_PATH = (Path(CACHE_DIR) / "verdicts.sqlite3").as_posix()
+VERDICT_TTL = 7 * 24 * 60 * 60 # a week, in seconds
+EVICTION_HEADROOM = 0.1 # share of max_entries freed at once, so eviction runs rarely
+
+
+class VerdictCache:
+    """
+    Persistent cache of relevance verdicts.
+
+    Verdicts are keyed by the normalized query, the document id, a hash of
+    the document text and the judge model. Regenerating a catalog's AI summary
+    changes its text, so stale verdicts stop matching without explicit
+    invalidation.
+    """
+
+    def __init__(
+        self,
+        db_path: str = VERDICT_CACHE_PATH,
+        ttl: float | None = VERDICT_TTL,
+        max_entries: int = 100_000,
+    ):
+        """
+        Parameters
+        ----------
+        db_path : str
+            SQLite file holding the verdicts.
+        ttl : float, optional
+            Seconds a verdict stays valid. None keeps verdicts until evicted.
+        max_entries : int, optional
+            Least recently used verdicts are evicted beyond this many entries.
+        """
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self._db = None
+        # entries in the table, counted once and kept up to date by this
+        # process, other processes' writes are picked up when evicting
+        self._count = 0
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS verdicts ("
+                "key TEXT PRIMARY KEY, is_relevant INTEGER, how TEXT, "
+                "created_at REAL, accessed_at REAL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS verdicts_accessed_at ON verdicts (accessed_at)"
+            )
+            (self._count,) = self._db.execute("SELECT COUNT(*) FROM verdicts").fetchone()
+        return self._db
+
+    @staticmethod
+    def key(query: str, doc_id: str, document: str, model: str | None) -> str:
+        parts = [
+            normalize_text(query).lower(),
+            doc_id,
+            hashlib.sha256(document.encode()).hexdigest(),
+            model or "",
+        ]
+        return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+    def get(self, key: str) -> dict | None:
+        """Cached verdict as a dict with is_relevant and how, None if absent or expired"""
+        now = time.time()
+        with self.lock:
+            row = self.db.execute(
+                "SELECT is_relevant, how, created_at FROM verdicts WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            is_relevant, how, created_at = row
+            if self.ttl is not None and now - created_at > self.ttl:
+                self._count -= self.db.execute("DELETE FROM verdicts WHERE key = ?", (key,)).rowcount
+                self.db.commit()
+                return None
+            self.db.execute("UPDATE verdicts SET accessed_at = ? WHERE key = ?", (now, key))
+            self.db.commit()
+        return dict(is_relevant=bool(is_relevant), how=how)
+
+    def set(self, key: str, is_relevant: bool, how: str):
+        now = time.time()
+        with self.lock:
+            exists = self.db.execute("SELECT 1 FROM verdicts WHERE key = ?", (key,)).fetchone()
+            self.db.execute(
+                "INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?, ?)",
+                (key, int(bool(is_relevant)), how, now, now),
+            )
+            self._count += exists is None
+            if self._count > self.max_entries:
+                self._evict()
+            self.db.commit()
+
+    def _evict(self):
+        (self._count,) = self.db.execute("SELECT COUNT(*) FROM verdicts").fetchone()
+        if self._count <= self.max_entries:
+            return
+        keep = int(self.max_entries * (1 - EVICTION_HEADROOM))
+        self._count -= self.db.execute(
+            "DELETE FROM verdicts WHERE key IN ("
+            "SELECT key FROM verdicts ORDER BY accessed_at LIMIT ?)",
+            (self._count - keep,),
+        ).rowcount
@@ -1,11 +1,12 @@
 import gradio as gr
 from gradio import ChatMessage
 from datatalker import talker
+from datatalker.lm_pool import LMPool
 import dspy
 
 
 if not dspy.settings.get("lm", None):
-    lm = dspy.LM(model="ollama_chat/gemma3", api_base="http://localhost:11434", cache=False)
+    lm = LMPool.from_config(cache=False)
     dspy.configure(lm=lm, caching=False)
 
 
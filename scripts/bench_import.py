@@ -0,0 +1,50 @@
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+
+def time_import(module: str) -> float:
+    """Wall-clock seconds for a fresh interpreter to import the module"""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", f"import {module}"], check=True)
+    return time.perf_counter() - start
+
+
+def slowest_imports(module: str, top: int) -> list[tuple[int, str]]:
+    """Modules with the largest cumulative import time, in microseconds"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        check=True, capture_output=True, text=True,
+    )
+    timings = list()
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        timings.append((int(cumulative), name.strip()))
+    return sorted(timings, reverse=True)[:top]
+
+
+def main(module: str, runs: int, top: int):
+    # the first import warms the bytecode and filesystem caches
+    time_import(module)
+    timings = [time_import(module) for _ in range(runs)]
+    print(
+        f"import {module}: median {statistics.median(timings):.3f}s, "
+        f"min {min(timings):.3f}s, max {max(timings):.3f}s over {runs} runs"
+    )
+    print("Slowest imports (cumulative):")
+    for cumulative, name in slowest_imports(module, top):
+        print(f"{cumulative / 1e6:8.3f}s  {name}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the import time of a module")
+    parser.add_argument("--module", default="datatalker", help="Module to import")
+    parser.add_argument("--runs", type=int, default=5, help="Number of timed imports")
+    parser.add_argument("--top", type=int, default=15, help="Number of slowest imports to list")
+
+    args = parser.parse_args()
+    main(args.module, args.runs, args.top)
@@ -0,0 +1,30 @@
+from datatalker.config import CHROMADB_DIR
+from datatalker.flat_index import FlatIndex
+from chromadb import PersistentClient
+from pathlib import Path
+import argparse
+import time
+
+
+def main(collection_name: str, db_path: str, dtype: str, n_lists: int):
+    chroma = PersistentClient(path=db_path)
+    collection = chroma.get_collection(collection_name)
+    index_path = Path(db_path) / f"{collection_name}.flat"
+
+    start = time.perf_counter()
+    index = FlatIndex.from_chroma(collection, index_path, dtype=dtype, n_lists=n_lists)
+    elapsed = time.perf_counter() - start
+    print(f"Exported {len(index)} embeddings to {index_path} in {elapsed:.1f}s.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export a ChromaDB collection to a memory-mapped embedding index"
+    )
+    parser.add_argument("--collection", default="datasets_bge-m3", help="ChromaDB collection name")
+    parser.add_argument("--db-path", default=CHROMADB_DIR, help="ChromaDB persist directory")
+    parser.add_argument("--dtype", choices=["float16", "int8"], default="float16", help="Storage type of the vectors")
+    parser.add_argument("--n-lists", type=int, default=0, help="Number of IVF partitions, 0 for exact search")
+
+    args = parser.parse_args()
+    main(args.collection, args.db_path, args.dtype, args.n_lists)
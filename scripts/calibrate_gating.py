@@ -0,0 +1,81 @@
+from datatalker.config import VERDICT_LOG, GATING_THRESHOLDS
+import argparse
+import json
+
+
+def load_verdicts(log_path: str) -> list[dict]:
+    verdicts = list()
+    with open(log_path) as f:
+        for line in f:
+            record = json.loads(line)
+            # gated decisions would only confirm the thresholds that made them
+            if record.get("similarity") is not None and record.get("judged", True):
+                verdicts.append(record)
+    return verdicts
+
+
+def accept_threshold(verdicts: list[dict], precision: float, min_samples: int):
+    """Lowest similarity above which the judge agreed often enough to skip it"""
+    ranked = sorted(verdicts, key=lambda v: v["similarity"], reverse=True)
+    threshold, relevant = None, 0
+    for n, verdict in enumerate(ranked, start=1):
+        relevant += verdict["is_relevant"]
+        if n >= min_samples and relevant / n >= precision:
+            threshold = verdict["similarity"]
+    return threshold
+
+
+def reject_threshold(verdicts: list[dict], precision: float, min_samples: int):
+    """Highest similarity below which the judge rejected often enough to skip it"""
+    ranked = sorted(verdicts, key=lambda v: v["similarity"])
+    threshold, irrelevant = None, 0
+    for n, verdict in enumerate(ranked, start=1):
+        irrelevant += not verdict["is_relevant"]
+        # documents strictly below the next similarity are rejected
+        if n >= min_samples and irrelevant / n >= precision and n < len(ranked):
+            threshold = ranked[n]["similarity"]
+    return threshold
+
+
+def main(log_path: str, output_path: str, precision: float, min_samples: int):
+    verdicts = load_verdicts(log_path)
+    print(f"Loaded {len(verdicts)} logged verdicts.")
+
+    accept_above = accept_threshold(verdicts, precision, min_samples)
+    reject_below = reject_threshold(verdicts, precision, min_samples)
+    if None not in (accept_above, reject_below) and reject_below > accept_above:
+        # the bands overlap, the logged verdicts are too noisy to gate on
+        accept_above = reject_below = None
+
+    accepted = [v for v in verdicts if accept_above is not None and v["similarity"] >= accept_above]
+    rejected = [v for v in verdicts if reject_below is not None and v["similarity"] < reject_below]
+    stats = dict(
+        samples=len(verdicts),
+        target_precision=precision,
+        accept_precision=(
+            sum(v["is_relevant"] for v in accepted) / len(accepted) if accepted else None
+        ),
+        reject_precision=(
+            sum(not v["is_relevant"] for v in rejected) / len(rejected) if rejected else None
+        ),
+        judge_calls_saved=(
+            (len(accepted) + len(rejected)) / len(verdicts) if verdicts else 0
+        ),
+    )
+    thresholds = dict(accept_above=accept_above, reject_below=reject_below, **stats)
+    with open(output_path, "w") as f:
+        json.dump(thresholds, f, indent=2)
+    print(json.dumps(thresholds, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Calibrate similarity thresholds for skipping relevance judgements"
+    )
+    parser.add_argument("--log", default=VERDICT_LOG, help="JSONL log of judged verdicts, written while LOG_VERDICTS=1")
+    parser.add_argument("--output", default=GATING_THRESHOLDS, help="Where to write the thresholds")
+    parser.add_argument("--precision", type=float, default=0.95, help="Required agreement with the judge")
+    parser.add_argument("--min-samples", type=int, default=50, help="Minimum verdicts on each side of a threshold")
+
+    args = parser.parse_args()
+    main(args.log, args.output, args.precision, args.min_samples)
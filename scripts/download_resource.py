@@ -0,0 +1,30 @@
+from datatalker.ogdp import OGDProxy
+from datatalker.download import download_resource
+import argparse
+import os
+
+
+def main(ogd_api_key: str, uuid: str, output: str, format: str, page_size: int, resume: bool):
+    ogd = OGDProxy(api_key=ogd_api_key)
+    path = download_resource(
+        ogd, uuid, output, format=format, page_size=page_size, resume=resume
+    )
+    print(f"Downloaded resource {uuid} to {path}")
+    print(f"OGD Platform requests: {ogd.stats()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Download every record of an OGD resource into a Parquet dataset directory"
+    )
+    parser.add_argument("uuid", help="Resource uuid")
+    parser.add_argument("output", help="Directory to write the Parquet parts to")
+    parser.add_argument("--format", choices=["csv", "json"], default="csv", help="Format requested from the API")
+    parser.add_argument("--page-size", type=int, default=1000, help="Records requested per page")
+    parser.add_argument("--no-resume", action="store_true", help="Start over instead of continuing an interrupted download")
+    args = parser.parse_args()
+
+    # get parameters from environment variables
+    OGDP_API_KEY = os.environ["OGDP_API_KEY"]
+
+    main(OGDP_API_KEY, args.uuid, args.output, args.format, args.page_size, not args.no_resume)
@@ -1,10 +1,198 @@
 from datatalker.ckan import CKANProxy
-from pymongo import MongoClient
-import traceback
+from datatalker.sync import (
+    get_watermark,
+    set_watermark,
+    upsert_documents,
+    mark_deleted,
+    record_changes,
+    Checkpoint,
+)
+from pymongo import MongoClient, UpdateOne
+from itertools import batched
+from datetime import datetime, timezone
+import requests
+import argparse
 import os
 
 
-def main(mongodb_url: str, ckan_url: str):
+BATCH_SIZE = 500 # items fetched and stored between checkpoints
+# resources whose datastore_info was a 404, with the last_modified they had then
+NO_DATASTORE_COLLECTION = "ckan_no_datastore"
+
+
+def fetch_packages(ckan: CKANProxy, pkg_slugs: list[str], checkpoint: Checkpoint):
+    """Fetch packages concurrently, recording the ones that fail"""
+    packages = list()
+    for pkg_slug, pkg, error in ckan.iter_packages(pkg_slugs):
+        if error is not None:
+            print(f"Failed to pull package {pkg_slug}: {error}")
+            checkpoint.mark_failed(pkg_slug, error)
+            continue
+        packages.append(pkg)
+    return packages
+
+
+def store_packages(db, packages: list[dict]) -> tuple[list, set]:
+    """Upsert packages and their resources, returns the package ids written and those that failed"""
+    failures, rsrc_failures = list(), list()
+    changed = upsert_documents(db["ckan_packages"], packages, key="id", failures=failures)
+    written = set(changed)
+    resources = [rsrc for pkg in packages if pkg["id"] in written for rsrc in pkg["resources"]]
+    upsert_documents(db["ckan_resources"], resources, key="id", failures=rsrc_failures)
+    record_changes(db, "ckan_packages", changed)
+    # a package is only stored once its resources are
+    rsrc_failures = set(rsrc_failures)
+    failed = set(failures) | {
+        pkg["id"] for pkg in packages if any(rsrc["id"] in rsrc_failures for rsrc in pkg["resources"])
+    }
+    return changed, failed
+
+
+def checkpoint_packages(checkpoint: Checkpoint, packages: list[dict], failed: set):
+    """Mark the stored packages done and the others failed, by name"""
+    for pkg in packages:
+        if pkg["id"] in failed:
+            checkpoint.mark_failed(pkg["name"], "write failed")
+    checkpoint.mark_done(pkg["name"] for pkg in packages if pkg["id"] not in failed)
+
+
+def pull_packages(db, ckan: CKANProxy, full: bool = False, resume: bool = False):
+    """Upsert new and modified packages and their resources, returns the resource ids to refresh"""
+    ckan_pkgs = db["ckan_packages"]
+    ckan_rsrcs = db["ckan_resources"]
+    checkpoint = Checkpoint(db, "ckan_packages", resume=resume)
+    # a resumed run carries on in the mode it started in
+    full = checkpoint.get("full", full)
+    checkpoint.set("full", full)
+
+    watermark = None if full else get_watermark(db, "ckan_packages")
+    changed_count = 0
+    if watermark is None:
+        # fetch packages concurrently, storing and checkpointing them in batches
+        pending = checkpoint.pending(ckan.get_package_list())
+        print(f"Pulling {len(pending)} packages...")
+        for pkg_slugs in batched(pending, BATCH_SIZE):
+            packages = fetch_packages(ckan, pkg_slugs, checkpoint)
+            changed, failed = store_packages(db, packages)
+            changed_count += len(changed)
+            checkpoint_packages(checkpoint, packages, failed)
+        # every live resource may have a datastore
+        rsrc_ids = ckan_rsrcs.distinct("id", {"deleted": {"$ne": True}})
+    else:
+        # incremental pulls are short, an interrupted one starts over from the same watermark
+        print(f"Pulling packages modified since {watermark}...")
+        rsrc_ids = list()
+        for packages in batched(ckan.iter_modified_packages(since=watermark), BATCH_SIZE):
+            changed, failed = store_packages(db, packages)
+            changed_count += len(changed)
+            # failures hold the watermark back, so the next run pulls them again
+            checkpoint_packages(checkpoint, packages, failed)
+            rsrc_ids.extend(rsrc["id"] for pkg in packages for rsrc in pkg["resources"])
+
+    # package_list is cheap, use it to find packages removed upstream
+    gone = mark_deleted(ckan_pkgs, "name", ckan.get_package_list())
+    deleted = ckan_pkgs.distinct("id", {"name": {"$in": gone}})
+    # resources dropped from modified packages or belonging to deleted ones
+    mark_deleted(ckan_rsrcs, "id", ckan_pkgs.distinct("resources.id", {"deleted": {"$ne": True}}))
+    record_changes(db, "ckan_packages", [], deleted)
+    failed = checkpoint.finish()
+
+    # log package statistics
+    print(f"Pulled {changed_count} new or modified packages from CKAN.")
+    if deleted:
+        print(f"Marked {len(deleted)} packages removed from CKAN as deleted.")
+    return rsrc_ids, not failed
+
+
+def resource_version(rsrc: dict) -> str | None:
+    return rsrc.get("last_modified") or rsrc.get("metadata_modified")
+
+
+def known_without_datastore(db, rsrc_ids: list[str]) -> set[str]:
+    """Resources known to have no datastore, unless modified since they were probed"""
+    rsrcs = db["ckan_resources"].find(
+        {"id": {"$in": rsrc_ids}},
+        {"id": 1, "last_modified": 1, "metadata_modified": 1, "datastore_active": 1},
+    )
+    probed = {
+        doc["_id"]: doc["last_modified"]
+        for doc in db[NO_DATASTORE_COLLECTION].find({"_id": {"$in": rsrc_ids}})
+    }
+    return {
+        rsrc["id"] for rsrc in rsrcs
+        # CKAN flags resources with a datastore, trust it when it says no
+        if rsrc.get("datastore_active") is False
+        # without a timestamp there's no telling whether it changed, probe it again
+        or (
+            resource_version(rsrc) is not None
+            and probed.get(rsrc["id"]) == resource_version(rsrc)
+        )
+    }
+
+
+def remember_without_datastore(db, rsrc_ids: list[str]):
+    """Add resources whose datastore_info came back 404 to the negative cache"""
+    rsrcs = db["ckan_resources"].find(
+        {"id": {"$in": rsrc_ids}}, {"id": 1, "last_modified": 1, "metadata_modified": 1}
+    )
+    checked_at = datetime.now(timezone.utc)
+    updates = [
+        UpdateOne(
+            {"_id": rsrc["id"]},
+            {"$set": {"last_modified": resource_version(rsrc), "checked_at": checked_at}},
+            upsert=True,
+        )
+        for rsrc in rsrcs
+    ]
+    if updates:
+        db[NO_DATASTORE_COLLECTION].bulk_write(updates, ordered=False)
+
+
+def pull_datastores(db, ckan: CKANProxy, rsrc_ids: list[str], resume: bool = False):
+    """Upsert the datastore info of the given resources, returns whether all were pulled"""
+    ckan_dsts = db["ckan_datastores"]
+    checkpoint = Checkpoint(db, "ckan_datastores", resume=resume)
+    pending = checkpoint.pending(rsrc_ids)
+    pulled, missing, skipped, failures = 0, 0, 0, 0
+    print(f"Pulling {len(pending)} datastores...")
+    for batch in batched(pending, BATCH_SIZE):
+        known_missing = known_without_datastore(db, list(batch))
+        skipped += len(known_missing)
+        datastores, done, not_found = list(), list(known_missing), list()
+        # probe the rest concurrently
+        to_probe = [rsrc_id for rsrc_id in batch if rsrc_id not in known_missing]
+        for rsrc_id, datastore, error in ckan.iter_datastore_info(to_probe):
+            if error is None:
+                datastores.append(dict(datastore, resource_id=rsrc_id))
+                done.append(rsrc_id)
+            elif isinstance(error, requests.exceptions.HTTPError) and error.response.status_code == 404:
+                # the resource has no datastore
+                not_found.append(rsrc_id)
+                done.append(rsrc_id)
+            else:
+                checkpoint.mark_failed(rsrc_id, error)
+                failures += 1
+        pulled += len(upsert_documents(ckan_dsts, datastores, key="resource_id"))
+        remember_without_datastore(db, not_found)
+        db[NO_DATASTORE_COLLECTION].delete_many(
+            {"_id": {"$in": [datastore["resource_id"] for datastore in datastores]}}
+        )
+        missing += len(not_found)
+        checkpoint.mark_done(done)
+    failed = checkpoint.finish()
+
+    # log datastore statistics
+    print(f"Pulled {pulled} datastores from CKAN.")
+    if skipped:
+        print(f"Skipped {skipped} resources known to have no datastore.")
+    if missing:
+        print(f"{missing} resources don't seem to have a datastore associated with them.")
+    if failures:
+        print(f"Failed to pull the datastores of {failures} resources.")
+    return not failed
+
+
+def main(mongodb_url: str, ckan_url: str, full: bool = False, resume: bool = False):
     # get db connection
     client = MongoClient(mongodb_url)
     collection_name = "datatalker"
@@ -13,63 +201,28 @@ def main(mongodb_url: str, ckan_url: str):
     # initialize CKAN
     ckan = CKANProxy(ckan_url)
 
-    # fetch packages
-    pkg_list = ckan.get_package_list()
-    packages = [
-        ckan.get_package(pkg_slug)
-        for pkg_slug in pkg_list
-    ]
-
-    # store packages in a mongodb collection
-    packages_collection_name = "ckan_packages"
-    ckan_pkgs = db[packages_collection_name]
-    ckan_pkgs.insert_many(packages)
-
-    # store resources in a separate mongodb collection
-    resources_collection_name = "ckan_resources"
-    ckan_rsrcs = db[resources_collection_name]
-    rsrcs = [
-        rsrc
-        for pkg in packages
-        for rsrc in pkg["resources"]
-    ]
-    ckan_rsrcs.insert_many(rsrcs)
-
-    # log package statistics
-    pkg_count = ckan_pkgs.count_documents({})
-    rsrc_count = ckan_rsrcs.count_documents({})
-    print(f"Pulled {pkg_count} packages containing {rsrc_count} resrouces from CKAN.")
-
-    # fetch datastores
-    rsrc_ids = ckan_rsrcs.distinct("id")
-    datastores = list()
-    failures = list()
-    print("Pulling datastores...")
-    print("You may ignore HTTP 404 errors, as they indicate the absence of certain datastores.")
-    for rsrc_id in rsrc_ids:
-        try:
-            datastore = ckan.get_datastore_info(rsrc_id)
-            datastores.append(datastore)
-        except:
-            traceback.print_exc()
-            failures.append(rsrc_id)
-    
-    # store datastores in a mongodb collection
-    datastores_collection_name = "ckan_datastores"
-    ckan_dsts = db[datastores_collection_name]
-    ckan_dsts.insert_many(datastores)
+    rsrc_ids, pkgs_complete = pull_packages(db, ckan, full=full, resume=resume)
+    dsts_complete = pull_datastores(db, ckan, rsrc_ids, resume=resume)
 
-    # log datastore statistics
-    ds_count = ckan_dsts.count_documents({})
-    print(f"Pulled {ds_count} datastores from CKAN.")
-    fail_count = len(failures)
-    if fail_count:
-        print(f"{fail_count} resources don't seem to have a datastore associated with them.")
+    # only move the watermark once nothing is left to retry
+    if pkgs_complete and dsts_complete:
+        latest = db["ckan_packages"].find_one(
+            {"deleted": {"$ne": True}}, sort=[("metadata_modified", -1)]
+        )
+        if latest is not None:
+            set_watermark(db, "ckan_packages", latest["metadata_modified"])
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Sync package, resource and datastore metadata from a CKAN instance"
+    )
+    parser.add_argument("--full", action="store_true", help="Re-pull everything instead of only what changed since the last sync")
+    parser.add_argument("--resume", action="store_true", help="Continue an interrupted run, retrying only what failed or wasn't done")
+    args = parser.parse_args()
+
     # get parameters from environment variables
     MONGODB_URL = os.environ['MONGODB_URL']
     CKAN_URL = os.environ['CKAN_URL']
 
-    main(MONGODB_URL, CKAN_URL)
\ No newline at end of file
+    main(MONGODB_URL, CKAN_URL, full=args.full, resume=args.resume)
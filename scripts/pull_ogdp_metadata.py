@@ -1,10 +1,101 @@
 from datatalker.ogdp import OGDProxy
+from datatalker.sync import (
+    get_watermark,
+    set_watermark,
+    upsert_documents,
+    mark_unseen,
+    record_changes,
+    Checkpoint,
+)
 from pymongo import MongoClient
-import traceback
+from itertools import batched
+import argparse
 import os
 
 
-def main(mongodb_url: str, ogd_api_key: str):
+BATCH_SIZE = 1000 # records per page
+
+
+def catalog_uuid(catalog):
+    return catalog["uuid"][0]
+
+
+def catalog_changed_at(catalog):
+    changed = catalog.get("changed") or [0]
+    return int(changed[0])
+
+
+def resource_updated_at(resource):
+    return int(resource.get("updated") or 0)
+
+
+def sync(
+    db,
+    ogd: OGDProxy,
+    source: str,
+    endpoint_method,
+    records_of,
+    key: str,
+    key_of,
+    changed_at,
+    sort_params: dict,
+    full: bool = False,
+    resume: bool = False,
+):
+    """Upsert new and modified records of an OGD endpoint, returns the number changed"""
+    collection = db[source]
+    checkpoint = Checkpoint(db, source, resume=resume)
+    # a resumed run carries on in the mode it started in
+    full = checkpoint.get("full", full)
+    checkpoint.set("full", full)
+    watermark = None if full else get_watermark(db, source)
+
+    if watermark is None:
+        # full pulls are checkpointed page by page
+        pages = ogd.iter_pages(endpoint_method, records_of, BATCH_SIZE, skip=checkpoint.done)
+    else:
+        # incremental pulls are short, an interrupted one starts over from the same watermark
+        records = ogd.iter_modified(endpoint_method, records_of, changed_at, watermark, sort_params)
+        pages = ((None, list(batch), None) for batch in batched(records, BATCH_SIZE))
+
+    latest = checkpoint.get("latest", watermark or 0)
+    changed_count, failed_pages, failures = 0, 0, list()
+    for offset, records, error in pages:
+        if error is not None:
+            print(f"Failed to pull {source} at offset {offset}: {error}")
+            checkpoint.mark_failed(offset, error)
+            failed_pages += 1
+            continue
+        changed = upsert_documents(
+            collection, records, key=key, key_of=key_of,
+            failures=failures, seen_at=checkpoint.started_at,
+        )
+        record_changes(db, source, changed)
+        changed_count += len(changed)
+        latest = max([latest, *map(changed_at, records)])
+        checkpoint.set("latest", latest)
+        if offset is not None:
+            checkpoint.mark_done([offset])
+
+    deleted = list()
+    if watermark is None and not failed_pages:
+        # every live record was upserted since the run started
+        deleted = mark_unseen(collection, key, checkpoint.started_at, key_of=key_of)
+        record_changes(db, source, [], deleted)
+    if not failed_pages and latest:
+        set_watermark(db, source, latest)
+    checkpoint.finish()
+
+    print(f"Pulled {changed_count} new or modified {source} from OGD Platform.")
+    if deleted:
+        print(f"Marked {len(deleted)} {source} removed from OGD Platform as deleted.")
+    if failures:
+        # e.g. documents exceeding MongoDB's BSON size limit
+        print(f"Failed to store {len(failures)} {source}.")
+    return changed_count
+
+
+def main(mongodb_url: str, ogd_api_key: str, full: bool = False, resume: bool = False):
     # get db connection
     client = MongoClient(mongodb_url)
     collection_name = "datatalker"
@@ -13,55 +104,36 @@ def main(mongodb_url: str, ogd_api_key: str):
     # initalize ODGP
     ogd = OGDProxy(api_key=ogd_api_key)
 
-    # fetch catalogs
-    responses = ogd.get_all(ogd.catalogs)
-    catalogs = [
-        catalog
-        for response in responses
-        for catalog in response["data"]["rows"]
-    ]
-
-    # store catalogs in a mongodb collection
-    catalogs_collection_name = "ogd_catalogs"
-    ogd_catalogs = db[catalogs_collection_name]
-    ogd_catalogs.insert_many(catalogs)
-
-    # log catalog statistics
-    catalog_count = ogd_catalogs.count_documents({})
-    print(f"Pulled {catalog_count} catalogs from OGD Platform.")
-
-    # fetch resources
-    responses = ogd.get_all(ogd.resources)
-    resources = [
-        resource
-        for response in responses
-        for resource in response["records"]
-    ]
-
-    # store resources in a mongodb collection
-    resources_collection_name = "ogd_resources"
-    ogd_resources = db[resources_collection_name]
-    
-    # NOTE: couldn't insert four resources due to BJSON object size too large error
-    failures = list()
-    for doc in resources:
-        try:
-            ogd_resources.insert_one(doc)
-        except:
-            failures.append(doc)
-            traceback.print_exc()
-    
-    # log resource statistics
-    resource_count = ogd_resources.count_documents({})
-    fail_count = len(failures)
-    print(f"Pulled {resource_count} resources from OGD Platform.")
-    if fail_count:
-        print(f"Failed to pull {fail_count} resources.")
-
-
-if __name__ == "__main__":    
+    # sync catalogs
+    sync(
+        db, ogd, "ogd_catalogs", ogd.catalogs,
+        records_of=lambda response: response["data"]["rows"],
+        key="uuid", key_of=catalog_uuid, changed_at=catalog_changed_at,
+        sort_params={"sort[changed]": "desc"}, full=full, resume=resume,
+    )
+
+    # sync resources
+    sync(
+        db, ogd, "ogd_resources", ogd.resources,
+        records_of=lambda response: response["records"],
+        key="index_name", key_of=None, changed_at=resource_updated_at,
+        sort_params={"sort[updated]": "desc"}, full=full, resume=resume,
+    )
+
+    # log request statistics
+    print(f"OGD Platform requests: {ogd.stats()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Sync catalog and resource metadata from the OGD Platform"
+    )
+    parser.add_argument("--full", action="store_true", help="Re-pull everything instead of only what changed since the last sync")
+    parser.add_argument("--resume", action="store_true", help="Continue an interrupted run, retrying only what failed or wasn't done")
+    args = parser.parse_args()
+
     # get parameters from environment vairables
     MONGODB_URL = os.environ["MONGODB_URL"]
     OGDP_API_KEY = os.environ["OGDP_API_KEY"]
 
-    main(MONGODB_URL, OGDP_API_KEY)
+    main(MONGODB_URL, OGDP_API_KEY, full=args.full, resume=args.resume)
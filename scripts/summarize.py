@@ -1,17 +1,25 @@
-from pymongo import MongoClient
-import dspy
+from datatalker.sync import write_batch, Checkpoint
+from datatalker.slimming import slim_resource, template_key, fill_template
+from datatalker.lm_pool import LMPool
+from pymongo import MongoClient, UpdateOne
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timezone
+from tenacity import Retrying, stop_after_attempt, wait_exponential
 from tqdm import tqdm
-from multiprocessing import Pool
-import traceback
+import dspy
+import time
 import argparse
+import os
 
-client = MongoClient("mongodb://localhost:27017/")
 
-db = client["datatalker"]
-rsrcs = db["ogd_resources"]
+PAGE_SIZE = 200 # documents read from the cursor at a time
+WRITE_BATCH_SIZE = 50 # summaries per bulk write
+MAX_ATTEMPTS = 3 # LLM calls per document before giving up on it
 
-lm = dspy.LM(model="ollama_chat/gemma3", api_base="http://localhost:11434")
+# spread over the model servers in LM_ENDPOINTS
+lm = LMPool.from_config()
 dspy.configure(lm=lm)
+WORKERS = lm.capacity # concurrent LLM calls
 
 RESOURCE_NOTES = """
 Your job is to write a professional long descripton of the Resource using the following notes on its schema. Highlight it's content, spatio-temporal span, variables, data collection methodology or body, and potential use cases.
@@ -77,31 +85,212 @@ WriteResourceDescription = dspy.Signature(
 )
 writer = dspy.ChainOfThought(WriteResourceDescription)
 
-def add_summary(resource):
-    try:
-        ai_writeup = writer(resource_json=resource)
-        desc = ai_writeup.textual_description
-        _id = resource["_id"]
-        rsrcs.update_one(
-            {"_id": _id},
-            {"$set": {"ai_long_text": desc}}
+FILTERS = {"source": {"$ne": "visualize.data.gov.in"}}
+
+
+def shard_bounds(rsrcs, shard: int, shards: int) -> tuple | None:
+    """
+    The [start, stop) _id range of a shard, None bounds are open. Ranges split
+    the resources evenly and don't depend on what's already summarized, so
+    concurrent processes agree on them. None when the shard is empty.
+    """
+    if shards == 1:
+        return None, None
+    buckets = list(rsrcs.aggregate([
+        {"$match": FILTERS},
+        {"$bucketAuto": {"groupBy": "$_id", "buckets": shards}},
+    ]))
+    if shard >= len(buckets):
+        return None
+    # bucket maxima are exclusive, except the last one's
+    start = buckets[shard]["_id"]["min"] if shard > 0 else None
+    stop = buckets[shard]["_id"]["max"] if shard < len(buckets) - 1 else None
+    return start, stop
+
+
+def iter_pending(rsrcs, filters: dict, start=None, stop=None, page_size: int = PAGE_SIZE):
+    """Stream the matching resources in _id order, paging on the last _id seen rather than skipping"""
+    lower = None if start is None else ("$gte", start)
+    while True:
+        bounds = dict([lower] if lower else []) | ({"$lt": stop} if stop is not None else {})
+        page = list(rsrcs.find({**filters, "_id": bounds} if bounds else filters).sort("_id", 1).limit(page_size))
+        yield from page
+        if len(page) < page_size:
+            break
+        lower = ("$gt", page[-1]["_id"])
+
+
+def summarize(resource: dict, max_attempts: int = MAX_ATTEMPTS) -> str:
+    """Long description of a (slimmed) resource, retrying failed LLM calls"""
+    retrying = Retrying(
+        stop=stop_after_attempt(max_attempts),
+        wait=wait_exponential(multiplier=1, min=2, max=30),
+        reraise=True,
+    )
+    return retrying(lambda: writer(resource_json=resource).textual_description)
+
+
+def main(
+    mongodb_url: str,
+    workers: int = WORKERS,
+    shard: int = 0,
+    shards: int = 1,
+    limit: int | None = None,
+    regenerate: bool = False,
+    resume: bool = False,
+):
+    client = MongoClient(mongodb_url)
+    db = client["datatalker"]
+    rsrcs = db["ogd_resources"]
+    # summaries are looked up by template key
+    rsrcs.create_index("ai_summary_key")
+
+    # a regeneration summarizes everything not summarized since it started,
+    # the start is kept so a resumed run carries on where it stopped
+    checkpoint = Checkpoint(db, f"summarize:{shard}/{shards}", resume=resume)
+    if regenerate:
+        started_at = checkpoint.get("started_at") or datetime.now(timezone.utc)
+        checkpoint.set("started_at", started_at)
+        filters = {**FILTERS, "ai_long_text_at": {"$not": {"$gte": started_at}}}
+    else:
+        filters = {**FILTERS, "ai_long_text": {"$exists": 0}}
+
+    bounds = shard_bounds(rsrcs, shard, shards)
+    if bounds is None:
+        print(f"Shard {shard} of {shards} is empty.")
+        return
+    start, stop = bounds
+    id_range = {
+        op: value for op, value in (("$gte", start), ("$lt", stop)) if value is not None
+    }
+    total = rsrcs.count_documents({**filters, "_id": id_range} if id_range else filters)
+    total = min(total, limit) if limit else total
+    print(f"Summarizing {total} resources (shard {shard} of {shards}) with {workers} workers.")
+
+    # summaries written in this run, or reusable from an earlier one
+    fresh = {"ai_long_text_at": {"$gte": started_at}} if regenerate else {"ai_long_text": {"$exists": 1}}
+
+    def find_summary(key: str) -> tuple[dict, str] | None:
+        source = rsrcs.find_one(
+            {"ai_summary_key": key, "ai_summary_of": {"$exists": 0}, **fresh},
+            {"title": 1, "desc": 1, "ai_long_text": 1},
         )
-    except:
-        traceback.print_exc()
+        return None if source is None else (source, source["ai_long_text"])
+
+    resources = iter_pending(rsrcs, filters, start, stop)
+    summarized, templated, failed, updates, keys = 0, 0, 0, list(), list()
+    bar = tqdm(total=total, unit="docs")
+    started = time.monotonic()
+
+    def record(_id, text: str, key: str, source_id=None):
+        fields = {"ai_long_text": text, "ai_long_text_at": datetime.now(timezone.utc), "ai_summary_key": key}
+        update = {"$set": fields, "$unset": {"ai_summary_of": ""}}
+        if source_id is not None:
+            update = {"$set": {**fields, "ai_summary_of": source_id}}
+        updates.append(UpdateOne({"_id": _id}, update))
+        keys.append(_id)
+        bar.update()
+
+    # failures of earlier runs are cleared once they are written, the rest
+    # of the progress is what the filters already select
+    failed_before = set(checkpoint.failed())
+
+    def flush():
+        nonlocal failed
+        if not updates:
+            return
+        failures = write_batch(rsrcs, updates, keys)
+        checkpoint.mark_done(
+            str(_id) for _id in keys if str(_id) in failed_before and _id not in set(failures)
+        )
+        for _id in failures:
+            checkpoint.mark_failed(str(_id), "write failed")
+        failed += len(failures)
+        updates.clear()
+        keys.clear()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # one resource per group of structurally identical resources is
+        # summarized, the others wait for it and get its summary filled in
+        written: dict[str, tuple[dict, str]] = dict()
+        waiting: dict[str, list[tuple]] = dict()
+        pending, submitted = dict(), 0
+
+        def submit(_id, slim: dict, key: str):
+            pending[executor.submit(summarize, slim)] = (_id, slim, key)
+            waiting[key] = list()
+
+        while True:
+            # keep the workers busy, with a few documents queued each
+            while len(pending) < 2 * workers and (limit is None or submitted < limit):
+                resource = next(resources, None)
+                if resource is None:
+                    break
+                submitted += 1
+                slim = slim_resource(resource)
+                key = template_key(resource, slim)
+                if key not in written and key not in waiting and (found := find_summary(key)):
+                    written[key] = found
+                if key in written:
+                    source, text = written[key]
+                    record(resource["_id"], fill_template(text, source, slim), key, source["_id"])
+                    templated += 1
+                elif key in waiting:
+                    waiting[key].append((resource["_id"], slim))
+                else:
+                    submit(resource["_id"], slim, key)
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                _id, slim, key = pending.pop(future)
+                members = waiting.pop(key)
+                try:
+                    text = future.result()
+                except Exception as e:
+                    checkpoint.mark_failed(str(_id), e)
+                    failed += 1
+                    bar.update()
+                    if members:
+                        # another member of the group gets a go
+                        submit(*members[0], key)
+                        waiting[key] = members[1:]
+                    continue
+                record(_id, text, key)
+                summarized += 1
+                written[key] = (dict(slim, _id=_id), text)
+                for member_id, member in members:
+                    record(member_id, fill_template(text, slim, member), key, _id)
+                    templated += 1
+            if len(updates) >= WRITE_BATCH_SIZE:
+                flush()
+            elapsed = time.monotonic() - started
+            bar.set_postfix(failed=failed, templated=templated, per_minute=f"{60 * summarized / elapsed:.1f}")
+    flush()
+    bar.close()
+
+    elapsed = time.monotonic() - started
+    print(
+        f"Summarized {summarized} resources in {elapsed / 60:.1f} min "
+        f"({60 * summarized / max(elapsed, 1e-9):.1f}/min), {templated} from a summary "
+        f"of an identical resource, {failed} failed."
+    )
+    for endpoint in lm.stats():
+        print(f"LM endpoint {endpoint}")
+    checkpoint.finish()
 
 
-filters = {
-    "source": {"$ne": "visualize.data.gov.in"},
-    "ai_long_text": {"$exists": 0}
-}
-total = rsrcs.count_documents(filters)
-# Set up argument parser
-parser = argparse.ArgumentParser(description='Process resources with pagination')
-parser.add_argument('--limit', type=int, default=25000, help='Number of documents to process')
-parser.add_argument('--skip', type=int, default=0, help='Number of documents to skip')
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write AI long descriptions of OGD resources")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Concurrent LLM calls")
+    parser.add_argument("--shard", type=int, default=0, help="Index of the _id range this process summarizes")
+    parser.add_argument("--shards", type=int, default=1, help="Number of processes splitting the work")
+    parser.add_argument("--limit", type=int, default=None, help="Number of documents to process")
+    parser.add_argument("--regenerate", action="store_true", help="Rewrite existing descriptions too")
+    parser.add_argument("--resume", action="store_true", help="Continue an interrupted regeneration")
+    args = parser.parse_args()
 
-args = parser.parse_args()
+    # get parameters from environment variables
+    MONGODB_URL = os.environ.get("MONGODB_URL", "mongodb://localhost:27017/")
 
-gen = list(rsrcs.find(filters, limit=args.limit, skip=args.skip))
-for doc in tqdm(gen):
-    add_summary(doc)
\ No newline at end of file
+    main(MONGODB_URL, args.workers, args.shard, args.shards, args.limit, args.regenerate, args.resume)
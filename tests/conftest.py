@@ -0,0 +1,28 @@
+import os
+import sys
+import tempfile
+
+import mongomock
+import pytest
+from pymongo.errors import InvalidOperation
+
+# keep caches and indexes written during the tests out of the working tree
+_TMP = tempfile.mkdtemp(prefix="datatalker-tests-")
+os.environ.setdefault("CACHE_DIR", os.path.join(_TMP, "cache"))
+os.environ.setdefault("CHROMADB_DIR", os.path.join(_TMP, "vectorstore"))
+
+# scripts are run from the repository root, their modules import as top level
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "scripts"))
+
+
+@pytest.fixture
+def mongo_client(monkeypatch):
+    """In-memory MongoDB client"""
+    # mongomock's bulk_write doesn't take the arguments pymongo passes
+    def bulk_write(self, requests, ordered=True):
+        if not requests:
+            raise InvalidOperation("No operations to execute")
+        for request in requests:
+            self.update_one(request._filter, request._doc, upsert=request._upsert)
+    monkeypatch.setattr(mongomock.Collection, "bulk_write", bulk_write)
+    return mongomock.MongoClient()
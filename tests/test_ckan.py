@@ -0,0 +1,44 @@
+import threading
+import time
+
+from datatalker.ckan import CKANProxy
+
+
+def test_iter_concurrently_bounds_the_calls_in_flight():
+    proxy = CKANProxy("http://ckan.example", max_workers=2, requests_per_second=None)
+    active, peak, lock = [0], [0], threading.Lock()
+
+    def method(id_):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.01)
+        with lock:
+            active[0] -= 1
+        if id_ == "3":
+            raise ValueError("gone")
+        return int(id_) * 10
+
+    results = {id_: (result, error) for id_, result, error in proxy.iter_concurrently(method, (str(i) for i in range(20)))}
+    assert peak[0] <= 2
+    assert results["4"] == (40, None)
+    assert results["3"][0] is None and isinstance(results["3"][1], ValueError)
+    assert len(results) == 20
+
+
+def test_iter_concurrently_stops_early_without_queued_calls():
+    proxy = CKANProxy("http://ckan.example", max_workers=2, requests_per_second=None)
+    started = list()
+
+    def method(id_):
+        started.append(id_)
+        time.sleep(0.05)
+        return id_
+
+    calls = proxy.iter_concurrently(method, (str(i) for i in range(1000)))
+    first = next(calls)
+    calls.close()
+    time.sleep(0.1)
+    assert first[2] is None
+    # the window and its refill, not every id
+    assert len(started) <= 4
@@ -0,0 +1,30 @@
+import subprocess
+import sys
+
+import datatalker
+from datatalker.types import Thought
+
+
+def test_retrieve_tells_the_user_when_nothing_is_found(monkeypatch):
+    monkeypatch.setattr(datatalker, "get_relevant_resources", lambda query: iter([Thought("Searching")]))
+    talker = datatalker.DataTalker()
+    replies = list(talker.handle_retrieval(datatalker.retrieve("rainfall", [], max_hops=1)))
+    assert replies == [datatalker.NO_DATASETS_FOUND_MSG]
+    assert talker.resources == {}
+
+
+def test_retrieval_is_a_single_search_by_default(monkeypatch):
+    queries = list()
+    monkeypatch.setattr(datatalker, "get_relevant_resources", lambda query: queries.append(query) or iter([]))
+    monkeypatch.setattr(datatalker, "search_multi_hop", lambda *args, **kwargs: 1 / 0)
+    talker = datatalker.DataTalker()
+    assert talker.retrieval_options == {}
+    list(datatalker.retrieve("rainfall", [], **talker.retrieval_options))
+    assert queries == ["rainfall"]
+    assert datatalker.DataTalker(datatalker.MULTI_HOP_OPTIONS).retrieval_options["max_hops"] == 3
+
+
+def test_import_leaves_pandas_and_pyarrow_to_the_data_handlers():
+    code = "import sys, datatalker; print(any(m in sys.modules for m in ('pandas', 'pyarrow')))"
+    out = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True)
+    assert out.stdout.strip() == "False"
@@ -0,0 +1,69 @@
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import pytest
+
+from datatalker.download import ResourceDownloader
+
+
+class FakeResponse:
+    def __init__(self, body):
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+class FakeOGD:
+    """Serves numbered records, at most `max_limit` per request"""
+
+    max_workers = 2
+
+    def __init__(self, total, max_limit=1000):
+        self.total = total
+        self.max_limit = max_limit
+
+    def resource(self, uuid, offset=0, limit=10, format="json", params=None):
+        stop = min(offset + min(limit, self.max_limit), self.total)
+        return FakeResponse(dict(
+            total=self.total,
+            field=[{"id": "n", "name": "Number", "type": "integer"}],
+            records=[{"n": str(n)} for n in range(offset, stop)],
+        ))
+
+
+def download(ogd, path):
+    downloader = ResourceDownloader(ogd, page_size=4, pages_per_part=2, format="json", progress=False)
+    return downloader.download("rainfall", path)
+
+
+def test_download_completes_short_pages(tmp_path):
+    path = download(FakeOGD(total=11, max_limit=3), tmp_path)
+    table = ds.dataset(path, format="parquet").to_table()
+    assert sorted(table["n"].to_pylist()) == [float(n) for n in range(11)]
+    assert sorted(p.name for p in path.glob("part-*.parquet")) == ["part-00000.parquet", "part-00001.parquet"]
+
+
+class TruncatedOGD(FakeOGD):
+    """Stops serving records past the first page"""
+
+    def resource(self, uuid, offset=0, limit=10, format="json", params=None):
+        response = super().resource(uuid, offset, limit, format, params)
+        if offset >= 4:
+            response.body["records"] = []
+        return response
+
+
+def test_download_fails_on_missing_records(tmp_path, monkeypatch):
+    writers = list()
+    writer_class = pq.ParquetWriter
+
+    def track(*args, **kwargs):
+        writers.append(writer_class(*args, **kwargs))
+        return writers[-1]
+
+    monkeypatch.setattr(pq, "ParquetWriter", track)
+    with pytest.raises(RuntimeError, match="offset 4"):
+        download(TruncatedOGD(total=11), tmp_path)
+    # the unfinished part's writer is closed, leaving a readable file
+    assert len(writers) == 1 and not writers[0].is_open
+    assert pq.read_table(tmp_path / "_part-00000.tmp").num_rows == 4
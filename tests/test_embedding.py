@@ -0,0 +1,48 @@
+import numpy as np
+
+from datatalker.embedding import CachedEmbeddingFunction
+
+
+class CountingEmbedder:
+    """Embeds a text as [length, number of words], recording each call"""
+
+    def __init__(self):
+        self.calls = list()
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        return [[len(text), len(text.split())] for text in texts]
+
+
+def test_memory_lru_serves_repeats_and_evicts_the_oldest():
+    embedder = CountingEmbedder()
+    embed = CachedEmbeddingFunction(embedder, "bge-m3", db_path=None, max_memory_items=2)
+    first = embed(["rainfall", "rainfall  ", "crops"])
+    # normalized duplicates are embedded once, in one call
+    assert embedder.calls == [["rainfall", "crops"]]
+    np.testing.assert_array_equal(first[0], first[1])
+
+    embed(["rainfall"])  # now the most recently used
+    embed(["schools"])  # evicts "crops"
+    assert list(embed.memory) == [embed.key("rainfall"), embed.key("schools")]
+    embed(["crops"])
+    assert embedder.calls[-1] == ["crops"]
+    assert embed.stats()["misses"] == 4
+
+
+def test_sqlite_tier_outlives_the_process_and_is_scoped_by_model(tmp_path):
+    db_path = (tmp_path / "embeddings.sqlite3").as_posix()
+    embedder = CountingEmbedder()
+    CachedEmbeddingFunction(embedder, "bge-m3", db_path=db_path)(["rainfall in kerala"])
+
+    reopened = CachedEmbeddingFunction(embedder, "bge-m3", db_path=db_path)
+    (vector,) = reopened(["rainfall in kerala"])
+    assert len(embedder.calls) == 1
+    assert vector.dtype == np.float32 and vector.tolist() == [18.0, 3.0]
+    assert reopened.stats() == dict(hits=0, disk_hits=1, misses=0, hit_rate=1.0)
+    # promoted to memory on the disk hit
+    reopened(["rainfall in kerala"])
+    assert reopened.stats()["hits"] == 1
+
+    CachedEmbeddingFunction(embedder, "nomic-embed", db_path=db_path)(["rainfall in kerala"])
+    assert len(embedder.calls) == 2
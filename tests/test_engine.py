@@ -0,0 +1,72 @@
+import pandas as pd
+import pyarrow as pa
+
+from datatalker.engine import DataEngine, to_markdown
+from datatalker.query import Aggregate, DataRequest, Filter
+
+
+def request(dataset_id, **fields):
+    return DataRequest(dataset_id=dataset_id, interface="local", **fields)
+
+
+def make_engine(tmp_path):
+    engine = DataEngine(tmp_path)
+    engine.register("rainfall", [
+        {"state": "Kerala", "district": "Idukki", "year": "2020", "mm": "3000"},
+        {"state": "Kerala", "district": "Wayanad", "year": "2020", "mm": "2500"},
+        {"state": "Kerala", "district": "Idukki", "year": "2021", "mm": "3200"},
+        {"state": "Punjab", "district": "Ludhiana", "year": "2020", "mm": "700"},
+    ])
+    engine.register("population", pd.DataFrame({
+        "district": ["Idukki", "Ludhiana"], "people": [1_100_000, 3_500_000],
+    }))
+    return engine
+
+
+def test_query_filters_and_aggregates_text_columns(tmp_path):
+    engine = make_engine(tmp_path)
+    table = engine.query(request(
+        "rainfall",
+        filters=[Filter(field="year", op="eq", value=2020)],
+        group_by=["state"],
+        aggregates=[Aggregate(function="sum", field="mm"), Aggregate(function="count")],
+        order_by=["-sum_mm"],
+    ))
+    assert table.to_pylist() == [
+        {"state": "Kerala", "sum_mm": 5500.0, "count_rows": 2},
+        {"state": "Punjab", "sum_mm": 700.0, "count_rows": 1},
+    ]
+
+
+def test_query_plain_lookup_and_distinct(tmp_path):
+    engine = make_engine(tmp_path)
+    lookup = engine.query(request("rainfall", filters=[Filter(field="state", value="Punjab")]))
+    assert lookup["district"].to_pylist() == ["Ludhiana"]
+    distinct = engine.query(request("rainfall", group_by=["state"], order_by=["state"]))
+    assert distinct.to_pylist() == [{"state": "Kerala"}, {"state": "Punjab"}]
+
+
+def test_join_casts_mismatched_keys(tmp_path):
+    engine = make_engine(tmp_path)
+    engine.register("codes", pa.table({"code": [1, 2], "district": ["Idukki", "Wayanad"]}))
+    engine.register("ids", pa.table({"code": ["1", "2"], "area": [4358, 2131]}))
+    joined = engine.join(request("codes"), request("ids"), keys=["code"])
+    assert sorted(joined.to_pylist(), key=lambda row: row["code"]) == [
+        {"code": "1", "district": "Idukki", "area": 4358},
+        {"code": "2", "district": "Wayanad", "area": 2131},
+    ]
+
+
+def test_to_markdown():
+    table = pa.table({"state": ["Kerala", None], "mm": [1, 2]})
+    assert to_markdown(table) == "| state | mm |\n|---|---|\n| Kerala | 1 |\n|  | 2 |"
+
+
+def test_join_limits_the_joined_rows_not_the_sides(tmp_path):
+    engine = DataEngine(tmp_path)
+    engine.register("left", pa.table({"key": list(range(10)), "a": list(range(10))}))
+    engine.register("right", pa.table({"key": list(range(9, -1, -1)), "b": list(range(10))}))
+    joined = engine.join(request("left", limit=3), request("right", limit=3), keys=["key"], join_type="inner")
+    # limited sides would have shared no keys
+    assert joined.num_rows == 3
+    assert engine.join(request("left"), request("right"), keys=["key"], join_type="inner", limit=5).num_rows == 5
@@ -0,0 +1,45 @@
+from datatalker.facets import FacetExtractor, matches, to_where
+from datatalker.ogdp import DocumentAdapter
+
+
+CATALOG = {
+    "title": ["District-wise Rainfall"],
+    "node_alias": ["/catalog/rainfall"],
+    "uuid": ["c1"], "nid": ["1"], "vid": ["1"],
+    "is_api_available": ["1"],
+    "field_sector:name": ["Agriculture", "Water Resources"],
+    "field_asset_jurisdiction:name": ["Kerala", "Tamil Nadu"],
+    "field_ministry_department:name": ["Ministry of Agriculture"],
+    "field_state_department:name": ["Kerala Water Authority"],
+    "field_ds_govt_type": ["State"],
+}
+
+
+def test_from_catalog_keeps_every_facet_value():
+    metadata = DocumentAdapter.from_catalog(CATALOG)
+    assert metadata["sector"] == "Agriculture; Water Resources"
+    assert metadata["department"] == "Ministry of Agriculture; Kerala Water Authority"
+    assert metadata["jurisdiction=Tamil Nadu"] is True
+    assert metadata["sector=Water Resources"] is True
+
+
+def test_any_facet_value_matches():
+    metadata = DocumentAdapter.from_catalog(CATALOG)
+    extractor = FacetExtractor.from_metadatas([metadata, {"jurisdiction": "Punjab", "sector": "Health"}])
+    assert extractor.vocabulary["sector"] == {"Agriculture", "Water Resources", "Health"}
+
+    where = extractor.where("water resources of tamil nadu")
+    assert where == {"$and": [{"jurisdiction=Tamil Nadu": True}, {"sector=Water Resources": True}]}
+    assert matches(metadata, where)
+    assert not matches(metadata, extractor.where("health in punjab"))
+    assert matches(metadata, extractor.where("datasets of the kerala water authority"))
+
+
+def test_to_where_matches_any_of_several_values():
+    where = to_where({"jurisdiction": ["Punjab", "Kerala"], "govt_type": ["State"]})
+    assert where == {"$and": [
+        {"$or": [{"jurisdiction=Punjab": True}, {"jurisdiction=Kerala": True}]},
+        {"govt_type": "State"},
+    ]}
+    assert matches({"jurisdiction=Kerala": True, "govt_type": "State"}, where)
+    assert not matches({"jurisdiction=Goa": True, "govt_type": "State"}, where)
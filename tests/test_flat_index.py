@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+from datatalker.facets import matches
+from datatalker.flat_index import FlatIndex, FlatRetriever, kmeans, normalize
+
+
+WHERES = [
+    {"sector=Water": True},
+    {"$or": [{"jurisdiction=Kerala": True}, {"jurisdiction=Punjab": True}]},
+    {"$and": [{"sector=Water": True}, {"govt_type": "State"}]},
+    {"govt_type": {"$in": ["Central", "Other"]}},
+    {"govt_type": {"$ne": "State"}},
+    {"title": "doc 3"},
+]
+
+
+def make_corpus(n=60, dim=16, seed=0):
+    rng = np.random.default_rng(seed)
+    embeddings = rng.normal(size=(n, dim))
+    ids = [f"doc-{i}" for i in range(n)]
+    documents = [f"document {i}" for i in range(n)]
+    metadatas = [
+        {
+            "title": f"doc {i}",
+            "govt_type": ["State", "Central"][i % 2],
+            f"sector={['Water', 'Health', 'Agriculture'][i % 3]}": True,
+            f"jurisdiction={['Kerala', 'Punjab', 'Goa', 'Delhi'][i % 4]}": True,
+        }
+        for i in range(n)
+    ]
+    return ids, documents, metadatas, embeddings
+
+
+@pytest.mark.parametrize("dtype, tolerance", [("float16", 1e-3), ("int8", 2e-2)])
+def test_vectors_round_trip(tmp_path, dtype, tolerance):
+    ids, documents, metadatas, embeddings = make_corpus()
+    index = FlatIndex.build(tmp_path / "index", ids, documents, metadatas, embeddings, dtype=dtype)
+    stored = index.scores(np.eye(embeddings.shape[1], dtype=np.float32)).T
+    np.testing.assert_allclose(stored, normalize(embeddings), atol=tolerance)
+    assert index.documents[5] == "document 5" and index.metadatas[5]["title"] == "doc 5"
+
+
+def test_exact_search_finds_the_nearest_vectors(tmp_path):
+    ids, documents, metadatas, embeddings = make_corpus()
+    index = FlatIndex.build(tmp_path / "index", ids, documents, metadatas, embeddings)
+    hits = index.search(embeddings[[3, 7]], k=3)
+    assert [hits[0][0][0], hits[1][0][0]] == [3, 7]
+    assert hits[0][0][1] == pytest.approx(1, abs=1e-3)
+
+
+def test_ivf_search_probes_the_nearest_partitions(tmp_path):
+    ids, documents, metadatas, embeddings = make_corpus()
+    index = FlatIndex.build(tmp_path / "index", ids, documents, metadatas, embeddings, n_lists=4)
+    for i in (0, 11, 42):
+        (row, sim), *_ = index.search(embeddings[i], k=1, n_probe=1)[0]
+        assert index.ids[row] == ids[i]
+    # probing every partition is an exact search
+    exact = FlatIndex.build(tmp_path / "exact", ids, documents, metadatas, embeddings)
+    assert (
+        [index.ids[row] for row, _ in index.search(embeddings[5], k=10, n_probe=4)[0]]
+        == [exact.ids[row] for row, _ in exact.search(embeddings[5], k=10)[0]]
+    )
+
+
+def test_more_partitions_than_vectors_are_clamped(tmp_path):
+    ids, documents, metadatas, embeddings = make_corpus(n=3)
+    assert len(kmeans(normalize(embeddings), 8)) == 3
+    index = FlatIndex.build(tmp_path / "index", ids, documents, metadatas, embeddings, n_lists=8)
+    assert len(index.centroids) == 3
+
+
+@pytest.mark.parametrize("where", WHERES)
+def test_facet_masks_agree_with_matches(tmp_path, where):
+    ids, documents, metadatas, embeddings = make_corpus()
+    index = FlatIndex.build(tmp_path / "index", ids, documents, metadatas, embeddings, n_lists=4)
+    expected = [matches(metadata, where) for metadata in index.metadatas]
+    assert index.where_mask(where).tolist() == expected
+    hits = index.search(embeddings[0], k=len(ids), where=where, n_probe=4)[0]
+    assert sorted(row for row, _ in hits) == [row for row, keep in enumerate(expected) if keep]
+
+
+def test_retriever_and_get_read_the_doc_store(tmp_path):
+    ids, documents, metadatas, embeddings = make_corpus()
+    index = FlatIndex.build(tmp_path / "index", ids, documents, metadatas, embeddings)
+    retriever = FlatRetriever(index, lambda texts: embeddings[[9]], k=2)
+    doc = retriever("anything")[0]
+    assert (doc.id, doc.long_text, doc.metadatas["title"]) == ("doc-9", "document 9", "doc 9")
+    assert doc.score == pytest.approx(0, abs=1e-3)
+    assert [doc.id for doc in index.get(["doc-4", "missing", "doc-1"])] == ["doc-4", "doc-1"]
+    assert [doc.id for doc in index.get(["doc-4", "doc-3"], where={"govt_type": "Central"})] == ["doc-3"]
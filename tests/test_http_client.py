@@ -0,0 +1,74 @@
+import threading
+
+import pytest
+import requests
+
+from datatalker.http_client import HTTPClient
+
+
+def response(status: int) -> requests.Response:
+    resp = requests.Response()
+    resp.status_code = status
+    resp.url = "http://portal.example/api"
+    return resp
+
+
+class FakeSession:
+    """Answers each URL with its scripted statuses, the last one repeating"""
+
+    def __init__(self, statuses: dict[str, list[int]]):
+        self.statuses = statuses
+        self.calls = list()
+        self.lock = threading.Lock()
+
+    def request(self, method, url, params, timeout, **kwargs):
+        with self.lock:
+            self.calls.append((url, params))
+            script = self.statuses[url]
+            status = script.pop(0) if len(script) > 1 else script[0]
+        return response(status)
+
+
+def make_client(statuses, **kwargs):
+    client = HTTPClient(min_wait=0, max_wait=0, **kwargs)
+    client.session = FakeSession(statuses)
+    return client
+
+
+def test_server_errors_are_retried_client_errors_are_not():
+    client = make_client({"http://a": [503, 429, 200], "http://b": [404]}, max_attempts=5)
+    params = {"offset": 0}
+    assert client.get("http://a", params).status_code == 200
+    assert [url for url, _ in client.session.calls] == ["http://a"] * 3
+    # the caller's parameters are copied, never shared
+    assert all(sent == params and sent is not params for _, sent in client.session.calls)
+
+    with pytest.raises(requests.exceptions.HTTPError):
+        client.get("http://b")
+    assert len(client.session.calls) == 4
+
+
+def test_each_call_gets_its_own_retry_state():
+    client = make_client({"http://down": [503], "http://up": [200]}, max_attempts=3)
+    copies = list()
+    copy = client.retrying.copy
+    client.retrying.copy = lambda *args, **kwargs: copies.append(1) or copy(*args, **kwargs)
+
+    errors = list()
+
+    def call(url):
+        try:
+            client.get(url)
+        except requests.exceptions.HTTPError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call, args=(url,)) for url in ["http://down", "http://up"] * 4]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    urls = [url for url, _ in client.session.calls]
+    # every failing call made exactly its own attempts, the others one each
+    assert urls.count("http://down") == 4 * 3 and urls.count("http://up") == 4
+    assert len(errors) == 4 and len(copies) == 8
@@ -0,0 +1,87 @@
+import numpy as np
+from dspy.dsp.utils import dotdict
+
+from datatalker import vectorstore
+from datatalker.facets import matches
+from datatalker.flat_index import FlatIndex
+from datatalker.lexical import BM25Index, HybridRetriever, reciprocal_rank_fusion
+
+
+IDS = ["pmkisan", "rainfall", "schools"]
+DOCUMENTS = [
+    "PM-KISAN beneficiaries by district",
+    "District-wise rainfall in Kerala",
+    "Schools and enrollment in Delhi",
+]
+METADATAS = [{"sector=Agriculture": True}, {"sector=Water": True}, {"sector=Education": True}]
+
+
+def make_index():
+    index = BM25Index()
+    index.add(IDS, DOCUMENTS)
+    return index
+
+
+def lookup(ids, where=None):
+    docs = {
+        doc_id: dotdict(id=doc_id, long_text=document, metadatas=metadata)
+        for doc_id, document, metadata in zip(IDS, DOCUMENTS, METADATAS)
+    }
+    return [docs[doc_id] for doc_id in ids if not where or matches(docs[doc_id].metadatas, where)]
+
+
+def test_ranking_scores_exact_terms():
+    index = make_index()
+    assert [doc_id for doc_id, _ in index.ranking("pmkisan beneficiaries in district")][:1] == ["pmkisan"]
+    assert len(index.ranking("district", limit=1)) == 1
+    assert index.ranking("the data of") == []
+
+
+def test_save_and_load_keeps_only_postings(tmp_path):
+    make_index().save(tmp_path / "index.json.gz", version={"count": 3})
+    index, extra = BM25Index.load(tmp_path / "index.json.gz")
+    assert extra == {"version": {"count": 3}}
+    assert not hasattr(index, "documents")
+    assert [doc_id for doc_id, _ in index.ranking("rainfall kerala")] == ["rainfall"]
+
+
+def test_reciprocal_rank_fusion_favours_ids_ranked_in_both():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["b", "d"]], k=60)
+    assert sorted(fused, key=fused.get, reverse=True) == ["b", "a", "d", "c"]
+    assert fused["a"] == 1 / 61
+
+
+def test_hybrid_retriever_keeps_vector_results():
+    semantic = [dotdict(id="schools", score=0.9, long_text=DOCUMENTS[2], metadatas=METADATAS[2])]
+    retriever = HybridRetriever(lambda query, k, **kwargs: semantic, make_index(), lookup, k=2)
+    docs = retriever("rainfall in schools")
+    assert [doc.id for doc in docs] == ["schools", "rainfall"]
+    assert docs[0].score == 0.9
+    assert docs[1].long_text == DOCUMENTS[1]
+
+
+def test_hybrid_retriever_filters_lexical_hits():
+    retriever = HybridRetriever(lambda query, k, **kwargs: [], make_index(), lookup, k=3)
+    docs = retriever("district", where={"sector=Water": True})
+    assert [doc.id for doc in docs] == ["rainfall"]
+
+
+def test_hybrid_index_is_rebuilt_only_when_the_collection_changes(tmp_path, monkeypatch):
+    embeddings = np.eye(3, 4)
+    FlatIndex.build(tmp_path / "docs.flat", IDS, DOCUMENTS, METADATAS, embeddings)
+    embedding_fn = lambda texts: np.ones((len(texts), 4))
+    adds = list()
+    add = BM25Index.add
+    monkeypatch.setattr(BM25Index, "add", lambda self, *args: adds.append(1) or add(self, *args))
+
+    def open_retriever():
+        return vectorstore.get_hybrid_retriever("docs", tmp_path, embedding_fn, backend="flat")
+
+    open_retriever()
+    retriever = open_retriever()
+    assert len(adds) == 1
+    assert [doc_id for doc_id, _ in retriever.index.ranking("kerala")] == ["rainfall"]
+
+    FlatIndex.build(tmp_path / "docs.flat", IDS[:2], DOCUMENTS[:2], METADATAS[:2], embeddings[:2])
+    assert len(open_retriever().index) == 2
+    assert len(adds) == 2
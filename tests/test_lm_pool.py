@@ -0,0 +1,106 @@
+import threading
+import time
+
+import pytest
+
+from datatalker import lm_pool
+from datatalker.lm_pool import LMPool
+
+
+class StubLM:
+    """Endpoint LM answering with its name, or failing while `failing` is set"""
+
+    def __init__(self, name, delay=0.0):
+        self.name = name
+        self.delay = delay
+        self.failing = False
+        self.calls = 0
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        with self.lock:
+            self.calls += 1
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(self.delay)
+            if self.failing:
+                raise ConnectionError(f"{self.name} is unreachable")
+            return self.name
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+def make_pool(n_endpoints=2, delay=0.0, **kwargs):
+    api_bases = [f"http://server-{i}:11434" for i in range(n_endpoints)]
+    pool = LMPool("ollama_chat/gemma3", api_bases, health_check_interval=None, **kwargs)
+    for i, endpoint in enumerate(pool.endpoints):
+        endpoint.lm = StubLM(f"server-{i}", delay)
+    return pool
+
+
+def test_retries_are_kept_without_another_endpoint():
+    single = LMPool("ollama_chat/gemma3", ["http://server:11434"], health_check_interval=None)
+    assert single.endpoints[0].lm.num_retries == lm_pool.SINGLE_ENDPOINT_RETRIES
+    pool = LMPool("ollama_chat/gemma3", ["http://a:11434", "http://b:11434"], health_check_interval=None)
+    assert [endpoint.lm.num_retries for endpoint in pool.endpoints] == [1, 1]
+
+
+def test_concurrency_per_endpoint_is_capped():
+    pool = make_pool(2, delay=0.05, max_concurrency=1)
+    results = list()
+    threads = [
+        threading.Thread(target=lambda: results.append(pool.forward(prompt="hi")))
+        for _ in range(6)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 6
+    assert [endpoint.lm.max_active for endpoint in pool.endpoints] == [1, 1]
+    assert all(endpoint.outstanding == 0 for endpoint in pool.endpoints)
+
+
+def test_failed_requests_fail_over_to_another_endpoint():
+    pool = make_pool(2)
+    pool.endpoints[0].lm.failing = True
+    assert {pool.forward(prompt="hi") for _ in range(3)} == {"server-1"}
+    assert pool.stats()[0]["failures"] >= 1
+
+    for endpoint in pool.endpoints:
+        endpoint.lm.failing = True
+    with pytest.raises(ConnectionError):
+        pool.forward(prompt="hi")
+
+
+def test_failing_endpoint_cools_down(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(lm_pool.time, "monotonic", lambda: now[0])
+    pool = make_pool(2, max_failures=1, cooldown=30)
+    down, up = pool.endpoints
+    down.lm.failing = True
+    # the first endpoint is tried first, then taken out of rotation
+    assert pool.forward(prompt="hi") == "server-1"
+    assert not down.is_up(now[0])
+    calls = down.lm.calls
+    for _ in range(3):
+        assert pool.forward(prompt="hi") == "server-1"
+    assert down.lm.calls == calls
+
+    # back in rotation once the cooldown ends
+    down.lm.failing = False
+    now[0] += 31
+    assert down.is_up(now[0])
+    assert pool.forward(prompt="hi") == "server-0"
+
+
+def test_health_check_puts_answering_endpoints_back(monkeypatch):
+    pool = make_pool(2, max_failures=1, cooldown=30)
+    pool.endpoints[0].down_until = time.monotonic() + 30
+    monkeypatch.setattr(pool, "probe", lambda endpoint: True)
+    pool.check_health()
+    assert pool.stats()[0]["up"]
@@ -0,0 +1,99 @@
+import threading
+import time
+
+import pytest
+
+from datatalker.ogdp import OGDProxy
+
+
+def paged(records):
+    """Endpoint method serving records, with their total, a page at a time"""
+    calls = list()
+
+    def endpoint_method(offset, limit, params=None):
+        calls.append(offset)
+        return {"total": len(records), "records": records[offset:offset + limit]}
+
+    endpoint_method.calls = calls
+    return endpoint_method
+
+
+def records_of(response):
+    return response["records"]
+
+
+def changed_at(record):
+    return record["updated"]
+
+
+def test_iter_modified_includes_records_stamped_at_the_watermark():
+    ogd = OGDProxy(api_key="key")
+    # newest first, two records share the watermark's second
+    records = [{"id": i, "updated": t} for i, t in enumerate([9, 8, 7, 7, 6, 5, 4, 3])]
+    endpoint_method = paged(records)
+    found = ogd.iter_modified(endpoint_method, records_of, changed_at, 7, {}, batch_size=3)
+    assert [r["id"] for r in found] == [0, 1, 2, 3]
+    # the page of the second record at the watermark is read, paging stops after it
+    assert endpoint_method.calls == [0, 3]
+
+
+class SlowEndpoint:
+    """Pages of numbered records, earlier pages take longer, records past `fail_at` fail"""
+
+    def __init__(self, total, fail_at=None):
+        self.total = total
+        self.fail_at = fail_at
+        self.requested = list()
+        self.active = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, offset, limit, params=None):
+        with self.lock:
+            self.requested.append(offset)
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            if limit > 1:
+                time.sleep(0.02 / (1 + offset // limit))
+            if self.fail_at is not None and offset >= self.fail_at:
+                raise ConnectionError(f"offset {offset}")
+            return {"total": self.total, "records": list(range(offset, min(offset + limit, self.total)))}
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+def test_iter_pages_yields_in_order_with_bounded_read_ahead():
+    ogd = OGDProxy(api_key="key", max_workers=3)
+    endpoint = SlowEndpoint(total=100)
+    pages = ogd.iter_pages(endpoint, records_of, batch_size=10, skip={30})
+    first = next(pages)
+    assert first == (0, list(range(10)), None)
+    # the probe for the total, the window and its refill
+    assert len(endpoint.requested) <= 1 + 3 + 1
+    rest = list(pages)
+    assert [offset for offset, _, _ in rest] == [10, 20, 40, 50, 60, 70, 80, 90]
+    assert endpoint.peak <= 3
+    assert 30 not in endpoint.requested
+
+
+def test_iter_all_raises_the_error_of_a_failed_page():
+    ogd = OGDProxy(api_key="key", max_workers=2)
+    pages = list(ogd.iter_pages(SlowEndpoint(total=40, fail_at=20), records_of, batch_size=10))
+    assert [(offset, error is None) for offset, _, error in pages] == [
+        (0, True), (10, True), (20, False), (30, False),
+    ]
+    records = ogd.iter_all(SlowEndpoint(total=40, fail_at=20), records_of, batch_size=10)
+    assert [next(records) for _ in range(20)] == list(range(20))
+    with pytest.raises(ConnectionError, match="offset 20"):
+        next(records)
+
+
+def test_iter_modified_scans_every_page_of_an_unsorted_endpoint():
+    ogd = OGDProxy(api_key="key")
+    records = [{"id": i, "updated": t} for i, t in enumerate([3, 9, 1, 2, 8, 1, 7])]
+    endpoint_method = paged(records)
+    found = ogd.iter_modified(endpoint_method, records_of, changed_at, 7, {}, batch_size=3)
+    assert [r["id"] for r in found] == [1, 4, 6]
+    assert endpoint_method.calls == [0, 3, 6]
@@ -0,0 +1,56 @@
+import mongomock
+from pymongo.errors import BulkWriteError
+
+import pull_ckan_metadata
+from datatalker.sync import Checkpoint
+
+
+class FakeCKAN:
+    packages = {
+        name: dict(id=f"id-{name}", name=name, resources=[dict(id=f"rsrc-{name}")])
+        for name in ("rainfall", "schools")
+    }
+
+    def get_package_list(self):
+        return list(self.packages)
+
+    def iter_packages(self, names):
+        for name in names:
+            yield name, self.packages[name], None
+
+
+def test_pull_packages_only_marks_stored_packages_done(mongo_client, monkeypatch):
+    bulk_write = mongomock.Collection.bulk_write
+
+    def failing_bulk_write(self, requests, ordered=True):
+        # the schools package is rejected by the server
+        bad = [i for i, r in enumerate(requests) if r._doc["$set"].get("id") == "id-schools"]
+        good = [r for i, r in enumerate(requests) if i not in bad]
+        if good:
+            bulk_write(self, good, ordered)
+        if bad:
+            raise BulkWriteError({"writeErrors": [{"index": i} for i in bad]})
+
+    monkeypatch.setattr(mongomock.Collection, "bulk_write", failing_bulk_write)
+    db = mongo_client.datatalker
+    rsrc_ids, complete = pull_ckan_metadata.pull_packages(db, FakeCKAN(), full=True)
+
+    assert not complete
+    assert rsrc_ids == ["rsrc-rainfall"]
+    checkpoint = Checkpoint(db, "ckan_packages", resume=True)
+    assert checkpoint.pending(FakeCKAN.packages) == ["schools"]
+    assert checkpoint.failed() == {"schools": "write failed"}
+
+
+def test_resources_without_timestamps_are_probed_again(mongo_client):
+    db = mongo_client.datatalker
+    db.ckan_resources.insert_many([
+        dict(id="dated", last_modified="2024-01-01"),
+        dict(id="modified", last_modified="2024-06-01"),
+        dict(id="undated"),
+        dict(id="flagged", datastore_active=False),
+    ])
+    pull_ckan_metadata.remember_without_datastore(db, ["dated", "modified", "undated"])
+    db.ckan_resources.update_one({"id": "modified"}, {"$set": {"last_modified": "2024-07-01"}})
+    known = pull_ckan_metadata.known_without_datastore(db, ["dated", "modified", "undated", "flagged"])
+    assert known == {"dated", "flagged"}
@@ -0,0 +1,99 @@
+import pandas as pd
+import pytest
+
+from datatalker.query import (
+    Aggregate, DataRequest, Filter, QueryPlanner, apply_locally, compile_ogd_params, compile_sql,
+    partial_note,
+)
+
+
+def request(**fields):
+    return DataRequest(**{"dataset_id": "rainfall", "interface": "ckan:datastore", **fields})
+
+
+RECORDS = pd.DataFrame([
+    {"state": "Kerala", "year": "2020", "mm": "3000"},
+    {"state": "Kerala", "year": "2021", "mm": "2500"},
+    {"state": "Punjab", "year": "2020", "mm": "700"},
+    {"state": "Punjab", "year": "2021", "mm": "n/a"},
+])
+
+
+def test_compile_sql_aggregates():
+    sql = compile_sql(request(
+        filters=[Filter(field="year", op="gte", value=2020.0), Filter(field="state", op="in", value=["Kerala", "O'Neil"])],
+        group_by=["state"],
+        aggregates=[Aggregate(function="avg", field="mm"), Aggregate(function="count")],
+        order_by=["-avg_mm"],
+        limit=10,
+    ))
+    assert sql == (
+        'SELECT "state", AVG("mm"::numeric) AS "avg_mm", COUNT(*) AS "count_rows" FROM "rainfall"'
+        ' WHERE "year" >= 2020 AND "state" IN (\'Kerala\', \'O\'\'Neil\')'
+        ' GROUP BY "state" ORDER BY "avg_mm" DESC LIMIT 10'
+    )
+
+
+def test_compile_sql_group_by_without_aggregates_is_distinct():
+    assert compile_sql(request(group_by=["state"])) == 'SELECT DISTINCT "state" FROM "rainfall" LIMIT 100'
+
+
+def test_compile_ogd_params():
+    params, remaining = compile_ogd_params(request(
+        interface="ogd:resource",
+        filters=[
+            Filter(field="state", value="Kerala"),
+            Filter(field="year", op="ne", value="2019"),
+            Filter(field="state", value="Punjab"),
+            Filter(field="mm", op="gt", value=100),
+        ],
+        order_by=["-year", "state"],
+    ))
+    assert params == {"filters[state]": "Kerala", "notfilters[year]": "2019", "sort[year]": "desc"}
+    assert [(f.field, f.value) for f in remaining] == [("state", "Punjab"), ("mm", 100)]
+
+
+def test_apply_locally_aggregates_numbers_stored_as_text():
+    result = apply_locally(RECORDS, request(
+        group_by=["state"],
+        aggregates=[Aggregate(function="sum", field="mm"), Aggregate(function="count")],
+        order_by=["state"],
+    ), [Filter(field="mm", op="gt", value=1000)])
+    assert result.to_dict(orient="records") == [{"state": "Kerala", "sum_mm": 5500.0, "count_rows": 2}]
+
+
+def test_apply_locally_distinct_ordered_and_limited():
+    result = apply_locally(RECORDS, request(group_by=["state"], order_by=["-state"], limit=1), [])
+    assert result.to_dict(orient="records") == [{"state": "Punjab"}]
+
+
+def test_apply_locally_without_records_keeps_the_requested_columns():
+    result = apply_locally(pd.DataFrame([]), request(
+        group_by=["state"], aggregates=[Aggregate(function="sum", field="mm")], order_by=["-sum_mm"],
+    ), [Filter(field="year", value="2020")])
+    assert result.empty and list(result.columns) == ["state", "sum_mm"]
+
+
+def test_run_without_a_source_for_the_interface():
+    with pytest.raises(ValueError, match="ckan:datastore"):
+        QueryPlanner(ogd=object()).run(request())
+
+
+class PagedCKAN:
+    def __init__(self, records):
+        self.records = records
+
+    def datastore_search(self, dataset_id, params):
+        offset, limit = params["offset"], params["limit"]
+        return {"records": self.records[offset:offset + limit], "total": len(self.records)}
+
+
+def test_run_ckan_locally_flags_capped_results_as_partial():
+    records = RECORDS.to_dict(orient="records")
+    count = request(aggregates=[Aggregate(function="count")])
+    capped = QueryPlanner(ckan=PagedCKAN(records * 500), max_rows=500).run_ckan_locally(count)
+    assert capped.attrs == {"partial": True, "rows_used": 1000, "rows_total": 2000}
+    assert "1000 of 2000" in partial_note(capped)
+
+    full = QueryPlanner(ckan=PagedCKAN(records)).run_ckan_locally(count)
+    assert full.attrs["partial"] is False and partial_note(full) is None
@@ -0,0 +1,72 @@
+from datatalker import record_cache
+from datatalker.record_cache import RecordCache
+
+
+TOTAL = 30
+
+
+def page(offset, limit):
+    records = [{"n": n, "state": f"state {n}"} for n in range(offset, min(offset + limit, TOTAL))]
+    return {"title": "Rainfall", "total": TOTAL, "records": records}
+
+
+def numbers(response):
+    return [record["n"] for record in response["records"]]
+
+
+def test_overlapping_pages_are_stitched(tmp_path):
+    cache = RecordCache(tmp_path)
+    cache.put("rainfall", None, "json", 0, page(0, 10))
+    cache.put("rainfall", None, "json", 5, page(5, 10))
+    cache.put("rainfall", None, "json", 20, page(20, 10))
+
+    response = cache.get("rainfall", None, "json", offset=3, limit=10)
+    assert numbers(response) == list(range(3, 13))
+    assert (response["title"], response["total"], response["count"]) == ("Rainfall", TOTAL, 10)
+    # the gap at 15-19 is reported, and cached ranges past the total are complete
+    assert cache.get("rainfall", None, "json", offset=10, limit=15) is None
+    assert cache.missing("rainfall", None, "json", offset=10, limit=15) == 15
+    assert cache.missing("rainfall", None, "json", offset=25, limit=10) is None
+    assert numbers(cache.get("rainfall", None, "json", offset=25, limit=10)) == list(range(25, 30))
+
+
+def test_filters_and_formats_are_cached_apart(tmp_path):
+    cache = RecordCache(tmp_path)
+    cache.put("rainfall", {"filters[state]": "Kerala"}, "json", 0, page(0, 10))
+    assert cache.get("rainfall", {"filters[state]": "Kerala"}, "json", 0, 5) is not None
+    assert cache.get("rainfall", None, "json", 0, 5) is None
+    assert cache.get("rainfall", {"filters[state]": "Kerala"}, "csv", 0, 5) is None
+
+
+def test_pages_expire_after_the_ttl(tmp_path, monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(record_cache.time, "time", lambda: now[0])
+    cache = RecordCache(tmp_path, ttl=60)
+    cache.put("rainfall", None, "json", 0, page(0, 10))
+    now[0] += 59
+    assert cache.get("rainfall", None, "json", 0, 10) is not None
+    now[0] += 2
+    assert cache.get("rainfall", None, "json", 0, 10) is None
+    # expired pages are dropped from disk once a lookup finds them
+    assert cache.missing("rainfall", None, "json", 0, 10) == 0
+    assert cache.stats()["pages"] == 0
+    assert not list(tmp_path.glob("*/*.parquet"))
+
+
+def test_least_recently_used_pages_are_evicted(tmp_path, monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(record_cache.time, "time", lambda: now[0])
+    cache = RecordCache(tmp_path, ttl=None)
+    for offset in (0, 10):
+        now[0] += 1
+        cache.put("rainfall", None, "json", offset, page(offset, 10))
+    page_size = cache.stats()["bytes"] // 2
+    cache.max_bytes = 2 * page_size + page_size // 2
+
+    now[0] += 1
+    cache.get("rainfall", None, "json", 0, 10)  # the first page is now the most recent
+    now[0] += 1
+    cache.put("rainfall", None, "json", 20, page(20, 10))
+    assert cache.stats()["pages"] == 2
+    assert cache.get("rainfall", None, "json", 0, 10) is not None
+    assert cache.get("rainfall", None, "json", 10, 10) is None
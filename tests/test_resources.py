@@ -0,0 +1,179 @@
+import json
+import threading
+import time
+
+import dspy
+from dspy.dsp.utils import dotdict
+
+import calibrate_gating
+from datatalker import resources
+from datatalker.resources import ResourceRetriever
+from datatalker.semantic_cache import SemanticCache
+from datatalker.types import ResponseType
+
+
+class FakeRetriever:
+    def __init__(self, results):
+        self.results = results
+
+    def __call__(self, query, k=7, **kwargs):
+        return [dotdict(doc) for doc in self.results[query][:k]]
+
+
+def doc(doc_id, score=0.5):
+    return dict(id=doc_id, score=score, long_text=f"about {doc_id}", metadatas={"title": doc_id})
+
+
+class FakeJudge:
+    """Relevant when the query names the document"""
+
+    def __init__(self):
+        self.calls = list()
+
+    def __call__(self, document, query):
+        self.calls.append((document, query))
+        relevant = document.removeprefix("about ") in query
+        return dspy.Prediction(is_relevant=relevant, how=f"matches {query}")
+
+
+def make_retriever(results, **options):
+    retriever = ResourceRetriever(
+        FakeRetriever(results), max_workers=1, verdict_log=None, verdict_cache=None, **options
+    )
+    retriever.judge_relevance = FakeJudge()
+    return retriever
+
+
+def test_forward_many_judges_each_query_separately():
+    retriever = make_retriever({
+        "rainfall alpha": [doc("alpha"), doc("beta")],
+        "rainfall beta": [doc("alpha"), doc("beta")],
+    })
+    results = retriever.forward_many(["rainfall alpha", "rainfall beta", "rainfall alpha"])
+
+    assert [[d.id for d in docs] for docs in results] == [["alpha"], ["beta"], ["alpha"]]
+    assert results[0][0]["relevance_rationale"] == "matches rainfall alpha"
+    # the repeated query shares the verdicts of the first one
+    assert len(retriever.judge_relevance.calls) == 4
+
+
+def test_forward_streams_relevant_documents():
+    retriever = make_retriever({"crops alpha": [doc("alpha"), doc("beta")]})
+    messages = list(retriever("crops alpha", k=2))
+    found = [msg.content.id for msg in messages if msg.type == ResponseType.OBJECT]
+    assert found == ["alpha"]
+
+
+class FailingJudge(FakeJudge):
+    def __call__(self, document, query):
+        if "beta" in document:
+            raise RuntimeError("model down")
+        return super().__call__(document, query)
+
+
+def search(monkeypatch, judge, cache):
+    monkeypatch.setattr(resources, "RelevanceJudge", judge)
+    messages = resources.get_relevant_resources(
+        "crops alpha", k=2, retriever=FakeRetriever({"crops alpha": [doc("alpha"), doc("beta")]}),
+        semantic_cache=cache, max_workers=2, verdict_log=None, verdict_cache=None,
+    )
+    return [msg.content["id"] for msg in messages if msg.type == ResponseType.OBJECT]
+
+
+def test_only_complete_searches_are_cached(monkeypatch):
+    cache = SemanticCache(lambda texts: [[1.0, 0.0] for _ in texts])
+    assert search(monkeypatch, FailingJudge, cache) == ["alpha"]
+    assert len(cache.entries) == 0
+    assert search(monkeypatch, FakeJudge, cache) == ["alpha"]
+    assert len(cache.entries) == 1
+
+
+def test_gated_verdicts_are_logged_as_not_judged(tmp_path):
+    log = tmp_path / "verdicts.jsonl"
+    retriever = make_retriever(
+        {"crops alpha": [doc("alpha", score=0.0), doc("beta", score=1.6), doc("gamma", score=0.6)]},
+        accept_above=0.9, reject_below=0.5,
+    )
+    retriever.verdict_log = str(log)
+    list(retriever("crops alpha", k=3))
+
+    records = {r["id"]: r for r in map(json.loads, log.read_text().splitlines())}
+    assert {id: (r["is_relevant"], r["judged"]) for id, r in records.items()} == {
+        "alpha": (True, False), "beta": (False, False), "gamma": (False, True),
+    }
+    # calibration learns from the judge's verdicts only
+    assert [v["id"] for v in calibrate_gating.load_verdicts(log)] == ["gamma"]
+
+
+class SlowJudge(FakeJudge):
+    def __call__(self, document, query):
+        if "beta" in document:
+            time.sleep(1)
+        return super().__call__(document, query)
+
+
+def judged(retriever, query):
+    messages = list(retriever(query, k=3))
+    found = [msg.content.id for msg in messages if msg.type == ResponseType.OBJECT]
+    thoughts = [msg.content for msg in messages if msg.type != ResponseType.OBJECT]
+    return found, thoughts
+
+
+def test_sequential_judging_times_out_and_reports_errors():
+    results = {"crops alpha gamma": [doc("alpha"), doc("beta"), doc("gamma")]}
+    retriever = make_retriever(results, judge_timeout=0.1)
+    retriever.judge_relevance = SlowJudge()
+    started = time.monotonic()
+    found, thoughts = judged(retriever, "crops alpha gamma")
+    assert time.monotonic() - started < 0.9
+    assert found == ["alpha", "gamma"]
+    assert "Timed out judging resource 'beta', skipping it" in thoughts
+    assert retriever.unjudged == 1
+
+    retriever = make_retriever(results)
+    retriever.judge_relevance = FailingJudge()
+    found, thoughts = judged(retriever, "crops alpha gamma")
+    assert found == ["alpha", "gamma"]
+    assert "Failed to judge resource 'beta' (model down), skipping it" in thoughts
+    assert not any(thought.startswith("Timed out") for thought in thoughts)
+
+
+def test_verdicts_are_not_logged_unless_enabled():
+    assert ResourceRetriever(FakeRetriever({})).verdict_log is None
+
+
+def test_default_retriever_and_facets_are_opened_once(monkeypatch):
+    opened = list()
+
+    def open_retriever(collection_name):
+        time.sleep(0.05)
+        opened.append(collection_name)
+        return dotdict(retriever="vector retriever")
+
+    monkeypatch.setattr(resources, "_RETRIEVER", None)
+    monkeypatch.setattr(resources, "_FACET_EXTRACTOR", None)
+    monkeypatch.setattr(resources, "get_hybrid_retriever", open_retriever)
+    monkeypatch.setattr(resources, "iter_metadatas", lambda retriever: iter([{"sector": "Water"}]))
+
+    threads = [threading.Thread(target=resources.get_default_retriever) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert opened == ["datasets_bge-m3"]
+    extractor = resources.get_default_facet_extractor()
+    assert extractor is resources.get_default_facet_extractor()
+    assert extractor.vocabulary == {"sector": {"Water"}}
+
+
+def test_warmup_opens_embeds_and_queries(monkeypatch):
+    calls = list()
+    retriever = lambda query, k: calls.append(("query", query, k)) or []
+    monkeypatch.setattr(resources, "_RETRIEVER", None)
+    monkeypatch.setattr(resources, "get_hybrid_retriever", lambda collection_name: retriever)
+    monkeypatch.setattr(resources, "embed", lambda texts: calls.append(("embed", texts)))
+
+    timings = resources.warmup("rainfall")
+    assert calls == [("embed", ["rainfall"]), ("query", "rainfall", 1)]
+    assert set(timings) == {"open_retriever", "embed", "query"}
+    assert all(seconds >= 0 for seconds in timings.values())
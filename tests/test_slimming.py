@@ -0,0 +1,37 @@
+from datatalker.slimming import fill_template, slim_resource, template_key
+
+
+def resource(title, **fields):
+    return dict(catalog_uuid="c", title=title, desc="District-wise rainfall", sector=["Agriculture"], **fields)
+
+
+def test_slim_resource_keeps_user_facing_fields():
+    slim = slim_resource(resource(
+        "Rainfall 2019", index_name="internal", status="",
+        field=[{"id": "document_id"}, {"id": "mm", "name": "Rainfall (mm)", "type": "double"}],
+    ))
+    assert slim == dict(
+        title="Rainfall 2019", desc="District-wise rainfall", sector="Agriculture",
+        field=["Rainfall (mm) (double)"],
+    )
+
+
+def test_template_key_ignores_years_and_volatile_fields():
+    key = template_key(resource("Rainfall 2019-20", updated_date="2020-04-01"))
+    assert template_key(resource("Rainfall 2020-21", updated_date="2021-04-01")) == key
+    assert template_key(resource("Rainfall of 20 districts 2019-20")) != template_key(
+        resource("Rainfall of 21 districts 2019-20")
+    )
+    assert template_key(dict(resource("Rainfall 2019-20"), catalog_uuid="d")) != key
+
+
+def test_fill_template_replaces_years():
+    summary = "Rainfall in 2019-20 across 20 districts, phase 1 of the 2019 survey."
+    filled = fill_template(summary, resource("Rainfall 2019-20"), resource("Rainfall 2020-21"))
+    assert filled == "Rainfall in 2020-21 across 20 districts, phase 1 of the 2020 survey."
+
+
+def test_fill_template_leaves_other_numbers():
+    summary = "Rainfall of 20 districts, phase 1."
+    source, target = resource("Rainfall of 20 districts, phase 1"), resource("Rainfall of 21 districts, phase 2")
+    assert fill_template(summary, source, target) == summary
@@ -0,0 +1,59 @@
+import mongomock
+import pytest
+
+import summarize
+
+
+class FakeResources:
+    def __init__(self, buckets):
+        self.buckets = buckets
+
+    def aggregate(self, pipeline):
+        return [{"_id": {"min": low, "max": high}} for low, high in self.buckets]
+
+
+def test_shard_bounds():
+    rsrcs = FakeResources([(0, 4), (4, 8), (8, 9)])
+    assert summarize.shard_bounds(rsrcs, 0, 1) == (None, None)
+    assert summarize.shard_bounds(rsrcs, 0, 3) == (None, 4)
+    assert summarize.shard_bounds(rsrcs, 1, 3) == (4, 8)
+    assert summarize.shard_bounds(rsrcs, 2, 3) == (8, None)
+    # fewer resources than shards
+    assert summarize.shard_bounds(FakeResources([(0, 1)]), 1, 2) is None
+
+
+def test_iter_pending_pages_by_id():
+    rsrcs = mongomock.MongoClient().db.rsrcs
+    rsrcs.insert_many([{"_id": i, "source": "data.gov.in"} for i in range(7)])
+    ids = [r["_id"] for r in summarize.iter_pending(rsrcs, {}, start=2, stop=6, page_size=2)]
+    assert ids == [2, 3, 4, 5]
+
+
+@pytest.fixture
+def mongo(mongo_client, monkeypatch):
+    monkeypatch.setattr(summarize, "MongoClient", lambda url: mongo_client)
+    return mongo_client
+
+
+def fail(resource):
+    raise RuntimeError("model down")
+
+
+def test_main_without_summaries_to_write(mongo, monkeypatch):
+    mongo.datatalker.ogd_resources.insert_many([{"_id": i, "title": f"t{i}"} for i in range(3)])
+    monkeypatch.setattr(summarize, "summarize", fail)
+    summarize.main("mongodb://test", workers=2)
+    assert mongo.datatalker.ogd_resources.count_documents({"ai_long_text": {"$exists": 1}}) == 0
+
+
+def test_main_templates_identical_resources(mongo, monkeypatch):
+    mongo.datatalker.ogd_resources.insert_many([
+        {"_id": i, "catalog_uuid": "c", "title": f"Rainfall {year}"}
+        for i, year in enumerate([2019, 2020, 2021])
+    ])
+    calls = list()
+    monkeypatch.setattr(summarize, "summarize", lambda slim: calls.append(slim) or f"About {slim['title']}.")
+    summarize.main("mongodb://test", workers=1)
+    texts = [r["ai_long_text"] for r in mongo.datatalker.ogd_resources.find().sort("_id", 1)]
+    assert len(calls) == 1
+    assert texts == ["About Rainfall 2019.", "About Rainfall 2020.", "About Rainfall 2021."]
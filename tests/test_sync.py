@@ -0,0 +1,29 @@
+from pymongo.errors import DocumentTooLarge
+
+from datatalker.sync import write_batch
+
+
+class FakeCollection:
+    """Rejects any batch holding a document marked too large"""
+
+    def __init__(self):
+        self.batches = list()
+
+    def bulk_write(self, requests, ordered=True):
+        if "big" in requests:
+            raise DocumentTooLarge("too large")
+        self.batches.append(list(requests))
+
+
+def test_write_batch_isolates_documents_too_large():
+    collection = FakeCollection()
+    requests = ["a", "b", "big", "c", "d"]
+    failures = write_batch(collection, requests, [r.upper() for r in requests])
+    assert failures == ["BIG"]
+    assert sorted(r for batch in collection.batches for r in batch) == ["a", "b", "c", "d"]
+
+
+def test_write_batch_skips_empty_batches():
+    collection = FakeCollection()
+    assert write_batch(collection, [], []) == []
+    assert collection.batches == []
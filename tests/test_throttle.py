@@ -0,0 +1,66 @@
+import pytest
+
+from datatalker import throttle
+from datatalker.throttle import AdaptiveTokenBucket, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = list()
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(throttle.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(throttle.time, "sleep", clock.sleep)
+    return clock
+
+
+def test_token_bucket_allows_a_burst_then_paces(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+    for _ in range(3):
+        bucket.acquire()
+    assert clock.sleeps == []
+    bucket.acquire()
+    assert clock.sleeps == [pytest.approx(0.5)]
+
+
+def test_token_bucket_refills_up_to_capacity(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+    for _ in range(3):
+        bucket.acquire()
+    clock.now += 60
+    for _ in range(3):
+        bucket.acquire()
+    assert clock.sleeps == []
+    assert bucket.tokens == pytest.approx(0)
+
+
+def test_adaptive_bucket_backs_off_and_recovers(clock):
+    bucket = AdaptiveTokenBucket(rate=4, min_rate=1, increase=0.5)
+    bucket.on_throttle()
+    assert bucket.rate == 2 and bucket.tokens == 0
+    bucket.on_throttle()
+    bucket.on_throttle()
+    assert bucket.rate == 1
+    for _ in range(10):
+        bucket.on_success()
+    assert bucket.rate == 4
+
+
+def test_adaptive_bucket_pauses_on_retry_after(clock):
+    bucket = AdaptiveTokenBucket(rate=8)
+    bucket.on_throttle(pause=30)
+    bucket.acquire()
+    # the pause, then a token at the lowered rate
+    assert clock.sleeps == [30 + 1 / 4]
+    assert bucket.stats()["paused_seconds"] == 30
@@ -0,0 +1,62 @@
+from datatalker import verdict_cache
+from datatalker.verdict_cache import VerdictCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_cache(tmp_path, monkeypatch, **kwargs):
+    clock = Clock()
+    monkeypatch.setattr(verdict_cache.time, "time", clock)
+    return VerdictCache(db_path=(tmp_path / "verdicts.sqlite3").as_posix(), **kwargs), clock
+
+
+def test_verdicts_expire_after_the_ttl(tmp_path, monkeypatch):
+    cache, clock = make_cache(tmp_path, monkeypatch, ttl=60)
+    key = VerdictCache.key("rainfall", "doc-1", "District-wise rainfall", "gemma3")
+    cache.set(key, True, "judged")
+    clock.now += 59
+    assert cache.get(key) == {"is_relevant": True, "how": "judged"}
+    clock.now += 2
+    assert cache.get(key) is None
+    assert cache._count == 0
+
+
+def test_keys_are_scoped_to_the_model_and_document_text():
+    key = VerdictCache.key("Rainfall  in Kerala", "doc-1", "District-wise rainfall", "gemma3")
+    assert key == VerdictCache.key("rainfall in kerala", "doc-1", "District-wise rainfall", "gemma3")
+    assert key != VerdictCache.key("rainfall in kerala", "doc-1", "District-wise rainfall", "llama3")
+    assert key != VerdictCache.key("rainfall in kerala", "doc-1", "Rainfall by district", "gemma3")
+
+
+def test_least_recently_used_verdicts_are_evicted(tmp_path, monkeypatch):
+    cache, clock = make_cache(tmp_path, monkeypatch, max_entries=10)
+    for i in range(10):
+        clock.now += 1
+        cache.set(f"key-{i}", i % 2 == 0, "judged")
+    # overwriting doesn't grow the cache, reading keeps a verdict
+    cache.set("key-9", False, "gated")
+    clock.now += 1
+    assert cache.get("key-0") is not None
+    assert cache._count == 10
+
+    clock.now += 1
+    cache.set("key-10", True, "judged")
+    # evicted down to 90% of max_entries, oldest accesses first
+    kept = [f"key-{i}" for i in range(11) if cache.get(f"key-{i}") is not None]
+    assert kept == ["key-0", *(f"key-{i}" for i in range(3, 11))]
+    assert cache._count == 9
+
+
+def test_count_is_read_from_an_existing_database(tmp_path, monkeypatch):
+    cache, _ = make_cache(tmp_path, monkeypatch)
+    for i in range(3):
+        cache.set(f"key-{i}", True, "judged")
+    reopened, _ = make_cache(tmp_path, monkeypatch)
+    reopened.get("key-0")
+    assert reopened._count == 3